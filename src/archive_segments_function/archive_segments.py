@@ -0,0 +1,187 @@
+import json
+import logging
+import os
+import time
+
+import boto3
+from boto3.dynamodb.conditions import Attr, Key
+from dynamodb_util import projection_params
+from group_shards import iter_group
+from message_blocks import block_id
+from segment_archive import archive_key_for, encode_archive
+
+# Set up logger
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+# Connect to AWS services
+dynamodb = boto3.resource("dynamodb")
+table = dynamodb.Table("todam_table")
+s3 = boto3.client("s3")
+
+bucket = os.environ["S3_BUCKET"]
+SEGMENT_STATUS_INDEX = "SegmentStatusStartIndex"
+# The backlog is scanned for until SegmentStatusStartIndex is ACTIVE and
+# backfill_segment_status has given every older segment a status
+STATUS_READS_ENABLED = os.environ.get("SEGMENT_STATUS_READS_ENABLED", "false") == "true"
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", "30"))
+# Archived messages stay readable in the table this long before TTL removes them
+TTL_GRACE_SECONDS = int(os.environ.get("ARCHIVE_TTL_GRACE_SECONDS", str(24 * 3600)))
+MESSAGE_ATTRIBUTES = (
+    "id",
+    "user_id",
+    "user_type",
+    "message_type",
+    "content",
+    "send_timestamp",
+)
+SEGMENT_ATTRIBUTES = (
+    "id",
+    "segment_id",
+    "group_id",
+    "start_timestamp",
+    "end_timestamp",
+    "archive_key",
+    "archived_at",
+    "block_count",
+)
+# Leave time to record progress before the Lambda timeout
+STOP_BEFORE_TIMEOUT_MS = 60 * 1000
+
+
+def scan_archivable_segments(cutoff_ms: int):
+    """Yield the segments ``find_archivable_segments`` would, from a table scan."""
+    scan_params = {
+        "FilterExpression": Attr("is_segment").eq(True)
+        & Attr("is_resolved").eq(True)
+        & Attr("end_timestamp").lt(cutoff_ms)
+        & Attr("archived_at").not_exists(),
+        **projection_params(*SEGMENT_ATTRIBUTES),
+    }
+    while True:
+        response = table.scan(**scan_params)
+        yield from response.get("Items", [])
+        if "LastEvaluatedKey" not in response:
+            return
+        scan_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def find_archivable_segments(cutoff_ms: int):
+    """Yield resolved segments that ended before ``cutoff_ms`` and are not archived.
+
+    Resolved segments keep ``segment_status`` "resolved" until they are
+    archived, so the index partition only holds the archiving backlog and
+    the segments too young for it, which the key condition skips.
+    """
+    if not STATUS_READS_ENABLED:
+        yield from scan_archivable_segments(cutoff_ms)
+        return
+    query_params = {
+        "IndexName": SEGMENT_STATUS_INDEX,
+        "KeyConditionExpression": Key("segment_status").eq("resolved")
+        & Key("start_timestamp").lt(cutoff_ms),
+        "FilterExpression": Attr("end_timestamp").lt(cutoff_ms),
+    }
+    while True:
+        response = table.query(**query_params)
+        for item in response.get("Items", []):
+            # The index does not project archive progress or the block layout
+            segment = table.get_item(
+                Key={"id": item["id"]}, **projection_params(*SEGMENT_ATTRIBUTES)
+            ).get("Item")
+            if segment and "archived_at" not in segment:
+                yield segment
+        if "LastEvaluatedKey" not in response:
+            return
+        query_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def archive_segment(segment: dict) -> int:
+    """Move one segment's messages to S3, then expire them from the table.
+
+    The segment item gains ``archive_key`` once the object is written, so
+    readers switch to S3 before any message disappears, and ``archived_at``
+    once every message has been given a TTL, which also takes it out of the
+    "resolved" partition of SegmentStatusStartIndex.
+    """
+    items = list(
+        iter_group(
+            table,
+            segment["group_id"],
+            Key("send_timestamp").between(
+                segment["start_timestamp"], segment["end_timestamp"]
+            ),
+            FilterExpression=Attr("is_message").eq(True),
+            **projection_params(*MESSAGE_ATTRIBUTES),
+        )
+    )
+    archive_key = segment.get("archive_key") or archive_key_for(segment)
+
+    if not segment.get("archive_key"):
+        messages = [
+            {
+                "id": item["id"],
+                "user_id": item.get("user_id", "unknown_user_id"),
+                "user_type": item.get("user_type", "unknown_user_type"),
+                "message_type": item.get("message_type", "unknown_message_type"),
+                "content": item.get("content", ""),
+                "send_timestamp": int(item["send_timestamp"]),
+            }
+            for item in items
+        ]
+        s3.put_object(
+            Bucket=bucket,
+            Key=archive_key,
+            Body=encode_archive(segment, messages),
+            ContentType="application/json",
+            ContentEncoding="gzip",
+        )
+        table.update_item(
+            Key={"id": segment["id"]},
+            UpdateExpression="SET archive_key = :k",
+            ExpressionAttributeValues={":k": archive_key},
+        )
+
+    expires_at = int(time.time()) + TTL_GRACE_SECONDS
+    block_ids = [
+        block_id(segment["id"], number)
+        for number in range(int(segment.get("block_count", 0)))
+    ]
+    for item_id in [item["id"] for item in items] + block_ids:
+        table.update_item(
+            Key={"id": item_id},
+            UpdateExpression="SET expires_at = :t",
+            ExpressionAttributeValues={":t": expires_at},
+        )
+
+    table.update_item(
+        Key={"id": segment["id"]},
+        UpdateExpression="SET archived_at = :now REMOVE segment_status, group_status",
+        ExpressionAttributeValues={":now": int(time.time() * 1000)},
+    )
+    logger.info(
+        "Archived %d messages of %s to %s", len(items), segment["id"], archive_key
+    )
+    return len(items)
+
+
+def lambda_handler(event, context):
+    logger.info("Lambda function started with event: %s", event)
+
+    cutoff_ms = int((time.time() - ARCHIVE_AFTER_DAYS * 24 * 3600) * 1000)
+    archived_segments = 0
+    archived_messages = 0
+    for segment in find_archivable_segments(cutoff_ms):
+        if context and context.get_remaining_time_in_millis() < STOP_BEFORE_TIMEOUT_MS:
+            # The next scheduled run picks up the remaining segments
+            logger.info("Stopping early to avoid the timeout")
+            break
+        archived_messages += archive_segment(segment)
+        archived_segments += 1
+
+    return {
+        "statusCode": 200,
+        "body": json.dumps(
+            {"segments": archived_segments, "messages": archived_messages}
+        ),
+    }
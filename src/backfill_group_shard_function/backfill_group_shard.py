@@ -0,0 +1,61 @@
+import json
+import logging
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+
+# Set up logger
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+# Connect to DynamoDB
+dynamodb = boto3.resource("dynamodb")
+table = dynamodb.Table("todam_table")
+
+
+def lambda_handler(event, context):
+    """Copy group_id into group_shard for items written before sharding.
+
+    Items predating GroupShardTimeIndex are all treated as shard 0, whose
+    key is the bare group id. Re-invoke with the returned
+    ``exclusive_start_key`` until it comes back empty.
+    """
+    scan_params = {
+        "FilterExpression": Attr("group_id").exists()
+        & Attr("group_shard").not_exists(),
+        "ProjectionExpression": "id, group_id",
+    }
+    if event.get("exclusive_start_key"):
+        scan_params["ExclusiveStartKey"] = event["exclusive_start_key"]
+
+    updated = 0
+    while True:
+        response = table.scan(**scan_params)
+        for item in response.get("Items", []):
+            if not item.get("group_id"):
+                continue
+            try:
+                table.update_item(
+                    Key={"id": item["id"]},
+                    UpdateExpression="SET group_shard = :g",
+                    ConditionExpression="attribute_not_exists(group_shard)",
+                    ExpressionAttributeValues={":g": item["group_id"]},
+                )
+                updated += 1
+            except table.meta.client.exceptions.ConditionalCheckFailedException:
+                # Written with a shard key since the scan page was read
+                continue
+
+        scan_params["ExclusiveStartKey"] = response.get("LastEvaluatedKey")
+        # Stop early enough to hand the cursor back before the timeout
+        if not scan_params["ExclusiveStartKey"] or (
+            context and context.get_remaining_time_in_millis() < 30 * 1000
+        ):
+            break
+
+    logger.info("Backfilled group_shard on %d items", updated)
+    return {
+        "statusCode": 200,
+        "body": json.dumps({"updated": updated}),
+        "exclusive_start_key": scan_params["ExclusiveStartKey"],
+    }
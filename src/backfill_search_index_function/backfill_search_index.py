@@ -0,0 +1,52 @@
+import json
+import logging
+import os
+
+import boto3
+from search_index import DynamoDBIndexStore, build_index
+
+# Set up logger
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+# Connect to DynamoDB
+dynamodb = boto3.resource("dynamodb")
+table = dynamodb.Table("todam_table")
+search_index_table = dynamodb.Table(
+    os.environ.get("SEARCH_INDEX_TABLE", "todam_search_index")
+)
+store = DynamoDBIndexStore(search_index_table)
+
+
+def lambda_handler(event, context):
+    """Index the segments and messages written before the search index.
+
+    The stream only carries changes made after IndexMessagesFunction was
+    deployed. Indexing is idempotent per message, so this can run while the
+    stream is being consumed and a page can be retried. Re-invoke with the
+    returned ``exclusive_start_key`` until it comes back empty.
+    """
+    scan_params = {}
+    if event.get("exclusive_start_key"):
+        scan_params["ExclusiveStartKey"] = event["exclusive_start_key"]
+
+    scanned = 0
+    while True:
+        response = table.scan(**scan_params)
+        items = [item for item in response.get("Items", []) if item.get("group_id")]
+        build_index(store, items)
+        scanned += len(items)
+
+        scan_params["ExclusiveStartKey"] = response.get("LastEvaluatedKey")
+        # Stop early enough to hand the cursor back before the timeout
+        if not scan_params["ExclusiveStartKey"] or (
+            context and context.get_remaining_time_in_millis() < 30 * 1000
+        ):
+            break
+
+    logger.info("Indexed %d items", scanned)
+    return {
+        "statusCode": 200,
+        "body": json.dumps({"scanned": scanned}),
+        "exclusive_start_key": scan_params["ExclusiveStartKey"],
+    }
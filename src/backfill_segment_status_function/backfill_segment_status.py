@@ -0,0 +1,82 @@
+import json
+import logging
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+from dynamodb_util import group_status_key
+
+# Set up logger
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+# Connect to DynamoDB
+dynamodb = boto3.resource("dynamodb")
+table = dynamodb.Table("todam_table")
+
+
+def lambda_handler(event, context):
+    """Set segment_status and group_status on segments written before them.
+
+    Only segments with a status appear in SegmentStatusStartIndex, which
+    /segments reads for unresolved segments and the archive job for
+    resolved ones that are not archived yet, and only unresolved segments
+    with a group_status in SegmentGroupStatusIndex. Re-invoke with the
+    returned ``exclusive_start_key`` until it comes back empty.
+    """
+    scan_params = {
+        "FilterExpression": Attr("is_segment").eq(True)
+        & (Attr("segment_status").not_exists() | Attr("group_status").not_exists())
+        & Attr("archived_at").not_exists(),
+        "ProjectionExpression": "id, group_id, is_end, is_resolved, segment_status",
+    }
+    if event.get("exclusive_start_key"):
+        scan_params["ExclusiveStartKey"] = event["exclusive_start_key"]
+
+    updated = 0
+    while True:
+        response = table.scan(**scan_params)
+        for item in response.get("Items", []):
+            if item.get("is_resolved"):
+                if "segment_status" in item:
+                    # Resolved segments have no group_status
+                    continue
+                update = "SET segment_status = :s"
+                condition = "attribute_not_exists(segment_status)"
+                values = {":s": "resolved"}
+            else:
+                status = "ended" if item.get("is_end") else "open"
+                update = "SET segment_status = :s, group_status = :g"
+                condition = (
+                    "(attribute_not_exists(segment_status) OR segment_status = :s)"
+                    " AND is_resolved <> :true"
+                )
+                values = {
+                    ":s": status,
+                    ":g": group_status_key(item["group_id"], status),
+                    ":true": True,
+                }
+            try:
+                table.update_item(
+                    Key={"id": item["id"]},
+                    UpdateExpression=update,
+                    ConditionExpression=condition,
+                    ExpressionAttributeValues=values,
+                )
+                updated += 1
+            except table.meta.client.exceptions.ConditionalCheckFailedException:
+                # Ended or resolved since the scan page was read
+                continue
+
+        scan_params["ExclusiveStartKey"] = response.get("LastEvaluatedKey")
+        # Stop early enough to hand the cursor back before the timeout
+        if not scan_params["ExclusiveStartKey"] or (
+            context and context.get_remaining_time_in_millis() < 30 * 1000
+        ):
+            break
+
+    logger.info("Backfilled the status keys of %d segments", updated)
+    return {
+        "statusCode": 200,
+        "body": json.dumps({"updated": updated}),
+        "exclusive_start_key": scan_params["ExclusiveStartKey"],
+    }
@@ -0,0 +1,145 @@
+import functools
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+
+# Configure logger
+logger = logging.getLogger(__name__)
+logger.setLevel("INFO")
+
+METRICS_NAMESPACE = "Todam/DynamoDB"
+# Group of calls not tied to one group, e.g. registrations
+NO_GROUP = "none"
+# Group of calls covering every group, e.g. listing all segments
+ALL_GROUPS = "*"
+
+READ_OPERATIONS = ("GetItem", "Query", "Scan", "BatchGetItem", "TransactGetItems")
+WRITE_OPERATIONS = (
+    "PutItem",
+    "UpdateItem",
+    "DeleteItem",
+    "BatchWriteItem",
+    "TransactWriteItems",
+)
+
+_lock = threading.Lock()
+_current_group: Optional[str] = None
+# (group_id, table, operation) -> [read units, write units, requests]
+_usage: Dict[Tuple[Optional[str], str, str], list] = defaultdict(lambda: [0.0, 0.0, 0])
+
+
+def track(resource) -> None:
+    """Request consumed capacity on every call of a boto3 DynamoDB resource.
+
+    The handlers' Table objects share the resource's client, so its calls
+    are accounted without changing them.
+    """
+    events = getattr(getattr(resource.meta.client, "meta", None), "events", None)
+    if events is None:
+        return
+    for operation in READ_OPERATIONS + WRITE_OPERATIONS:
+        events.register(
+            f"provide-client-params.dynamodb.{operation}", _request_capacity
+        )
+        events.register(f"after-call.dynamodb.{operation}", _record_capacity)
+
+
+def _request_capacity(params, **kwargs) -> None:
+    params.setdefault("ReturnConsumedCapacity", "TOTAL")
+
+
+def _record_capacity(parsed, model, **kwargs) -> None:
+    consumed = parsed.get("ConsumedCapacity")
+    if not consumed:
+        return
+    is_read = model.name in READ_OPERATIONS
+    for entry in consumed if isinstance(consumed, list) else [consumed]:
+        units = float(entry.get("CapacityUnits", 0))
+        with _lock:
+            usage = _usage[(_current_group, entry["TableName"], model.name)]
+            usage[0 if is_read else 1] += units
+            usage[2] += 1
+
+
+def set_group(group_id: Optional[str]) -> None:
+    """Account the following calls of this invocation to ``group_id``."""
+    global _current_group
+    _current_group = group_id
+
+
+def drain() -> Dict[Tuple[str, str, str], list]:
+    """Return and reset this invocation's usage by group, table and operation.
+
+    Calls made before any group was set go to the invocation's group when
+    exactly one was set, else to NO_GROUP.
+    """
+    global _current_group
+    with _lock:
+        usage = dict(_usage)
+        _usage.clear()
+        _current_group = None
+    groups = {group for group, _, _ in usage if group is not None}
+    fallback = next(iter(groups)) if len(groups) == 1 else NO_GROUP
+
+    drained: Dict[Tuple[str, str, str], list] = defaultdict(lambda: [0.0, 0.0, 0])
+    for (group, table, operation), (read, write, requests) in usage.items():
+        total = drained[(group or fallback, table, operation)]
+        total[0] += read
+        total[1] += write
+        total[2] += requests
+    return dict(drained)
+
+
+def publish(endpoint: str) -> None:
+    """Log this invocation's consumed capacity in CloudWatch EMF."""
+    timestamp = int(time.time() * 1000)
+    for (group, table, operation), (read, write, requests) in drain().items():
+        record = {
+            "_aws": {
+                "Timestamp": timestamp,
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": METRICS_NAMESPACE,
+                        "Dimensions": [
+                            ["Endpoint", "Table"],
+                            ["Endpoint", "GroupId"],
+                            ["Table", "Operation"],
+                        ],
+                        "Metrics": [
+                            {"Name": "ReadCapacityUnits", "Unit": "Count"},
+                            {"Name": "WriteCapacityUnits", "Unit": "Count"},
+                            {"Name": "Requests", "Unit": "Count"},
+                        ],
+                    }
+                ],
+            },
+            "Endpoint": endpoint,
+            "GroupId": group,
+            "Table": table,
+            "Operation": operation,
+            "ReadCapacityUnits": read,
+            "WriteCapacityUnits": write,
+            "Requests": requests,
+        }
+        print(json.dumps(record))
+
+
+def accounted(handler):
+    """Publish the DynamoDB capacity each invocation of ``handler`` consumed."""
+    endpoint = handler.__module__
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        drain()
+        try:
+            return handler(event, context)
+        finally:
+            try:
+                publish(endpoint)
+            except Exception as e:
+                logger.error("Error publishing consumed capacity: %s", e)
+
+    return wrapper
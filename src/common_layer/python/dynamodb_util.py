@@ -0,0 +1,12 @@
+def projection_params(*attributes: str) -> dict:
+    """Build ProjectionExpression kwargs that are safe for reserved words."""
+    names = {f"#p{index}": attribute for index, attribute in enumerate(attributes)}
+    return {
+        "ProjectionExpression": ", ".join(names),
+        "ExpressionAttributeNames": names,
+    }
+
+
+def group_status_key(group_id: str, status: str) -> str:
+    """Partition key of an unresolved segment in SegmentGroupStatusIndex."""
+    return f"{group_id}#{status}"
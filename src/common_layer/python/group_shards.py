@@ -0,0 +1,226 @@
+import heapq
+import logging
+import math
+import os
+import time
+import zlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Tuple
+
+import boto3
+from boto3.dynamodb.conditions import ConditionExpressionBuilder, Key
+from capacity import track
+
+# Configure logger
+logger = logging.getLogger(__name__)
+logger.setLevel("INFO")
+
+GROUP_SHARD_TABLE_NAME = os.environ.get("GROUP_SHARD_TABLE", "todam_group_shard_table")
+GROUP_SHARD_INDEX = "GroupShardTimeIndex"
+GROUP_INDEX = "GroupTimeIndex"
+# Reads stay on GroupTimeIndex until GroupShardTimeIndex is ACTIVE and
+# backfill_group_shard has given every older item a group_shard
+SHARD_READS_ENABLED = os.environ.get("GROUP_SHARD_READS_ENABLED", "false") == "true"
+# Sustained writes per second one GSI partition key should absorb
+SHARD_WRITES_PER_SECOND = float(os.environ.get("SHARD_WRITES_PER_SECOND", "50"))
+MAX_SHARDS = 16
+# Writes are reported to the rate counter in batches of this size
+RATE_SAMPLE = 10
+SHARD_COUNT_TTL_SECONDS = 60
+
+dynamodb = boto3.resource("dynamodb")
+# Shard counters are written per message, so they count against the group
+track(dynamodb)
+group_shard_table = dynamodb.Table(GROUP_SHARD_TABLE_NAME)
+
+_shard_counts: Dict[str, Tuple[int, float]] = {}
+_pending_writes: Dict[str, int] = defaultdict(int)
+_finished_minutes: Dict[Tuple[str, int], int] = {}
+
+
+def shard_key(group_id: str, shard: int) -> str:
+    """Shard 0 keeps the bare group id, so unsharded groups are unchanged."""
+    return group_id if shard == 0 else f"{group_id}#{shard}"
+
+
+def get_shard_count(group_id: str) -> int:
+    cached = _shard_counts.get(group_id)
+    if cached and time.monotonic() - cached[1] < SHARD_COUNT_TTL_SECONDS:
+        return cached[0]
+    item = group_shard_table.get_item(Key={"group_id": group_id}).get("Item", {})
+    shard_count = int(item.get("shard_count", 1))
+    _shard_counts[group_id] = (shard_count, time.monotonic())
+    return shard_count
+
+
+def choose_shard_key(group_id: str, item_id: str) -> str:
+    """Pick the GSI partition for a new message of ``group_id``."""
+    shard_count = get_shard_count(group_id)
+    if shard_count == 1:
+        return group_id
+    return shard_key(group_id, zlib.crc32(item_id.encode("utf-8")) % shard_count)
+
+
+def _rate_key(group_id: str, minute: int) -> str:
+    return f"{group_id}#rate#{minute}"
+
+
+def _finished_minute_count(group_id: str, minute: int) -> int:
+    """Writes of a past minute; it no longer changes, so it is read once."""
+    if (group_id, minute) not in _finished_minutes:
+        for key in [key for key in _finished_minutes if key[1] < minute]:
+            del _finished_minutes[key]
+        item = group_shard_table.get_item(
+            Key={"group_id": _rate_key(group_id, minute)}
+        ).get("Item", {})
+        _finished_minutes[(group_id, minute)] = int(item.get("write_count", 0))
+    return _finished_minutes[(group_id, minute)]
+
+
+def record_write(group_id: str, count: int = 1) -> None:
+    """Track the group's write rate and raise its shard count when it runs hot.
+
+    The rate is estimated over a sliding minute: this minute's writes plus
+    the share of the previous minute's that still falls in the window.
+    Shard counts only ever grow: readers fan out over every shard that may
+    hold data, so shrinking would hide items written to the higher shards.
+    """
+    _pending_writes[group_id] += count
+    if _pending_writes[group_id] < RATE_SAMPLE:
+        return
+
+    count = _pending_writes.pop(group_id)
+    now = time.time()
+    minute = int(now // 60)
+    response = group_shard_table.update_item(
+        Key={"group_id": _rate_key(group_id, minute)},
+        UpdateExpression="ADD write_count :n SET expires_at = :ttl",
+        ExpressionAttributeValues={":n": count, ":ttl": (minute + 10) * 60},
+        ReturnValues="UPDATED_NEW",
+    )
+    elapsed = now - minute * 60
+    previous = _finished_minute_count(group_id, minute - 1)
+    rate = (
+        int(response["Attributes"]["write_count"]) + previous * (60 - elapsed) / 60
+    ) / 60
+    wanted = min(
+        MAX_SHARDS, 2 ** math.ceil(math.log2(max(1, rate / SHARD_WRITES_PER_SECOND)))
+    )
+    if wanted <= get_shard_count(group_id):
+        return
+
+    try:
+        group_shard_table.update_item(
+            Key={"group_id": group_id},
+            UpdateExpression="SET shard_count = :s",
+            ConditionExpression="attribute_not_exists(shard_count) OR shard_count < :s",
+            ExpressionAttributeValues={":s": wanted},
+        )
+        logger.info(
+            "Group %s now writes to %d shards (%.1f writes/s)", group_id, wanted, rate
+        )
+    except group_shard_table.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
+    _shard_counts.pop(group_id, None)
+
+
+def read_shard_count(group_id: str) -> int:
+    """Shards to fan reads out over; GroupTimeIndex holds a group in one."""
+    return get_shard_count(group_id) if SHARD_READS_ENABLED else 1
+
+
+def group_index_key(group_id: str, shard: int = 0):
+    """Index name and partition key condition of one read shard of a group.
+
+    Segment items are never sharded, so shard 0 also holds every segment.
+    """
+    if not SHARD_READS_ENABLED:
+        return GROUP_INDEX, Key("group_id").eq(group_id)
+    return GROUP_SHARD_INDEX, Key("group_shard").eq(shard_key(group_id, shard))
+
+
+def _shard_query_params(group_id: str, shard: int, time_condition, params: dict):
+    """Query parameters of one shard with their condition expressions built.
+
+    boto3 builds condition objects with one placeholder counter per client,
+    which concurrent calls reset under each other, so shard queries sent
+    from several threads carry strings built by a builder of their own.
+    """
+    index_name, key_condition = group_index_key(group_id, shard)
+    query_params = {**params, "IndexName": index_name}
+    names = dict(params.get("ExpressionAttributeNames", {}))
+    values = dict(params.get("ExpressionAttributeValues", {}))
+    builder = ConditionExpressionBuilder()
+    conditions = [("KeyConditionExpression", key_condition & time_condition, True)]
+    if params.get("FilterExpression") is not None:
+        conditions.append(("FilterExpression", params["FilterExpression"], False))
+    for name, condition, is_key_condition in conditions:
+        if isinstance(condition, str):
+            continue
+        expression = builder.build_expression(condition, is_key_condition)
+        query_params[name] = expression.condition_expression
+        names.update(expression.attribute_name_placeholders)
+        values.update(expression.attribute_value_placeholders)
+    if names:
+        query_params["ExpressionAttributeNames"] = names
+    if values:
+        query_params["ExpressionAttributeValues"] = values
+    return query_params
+
+
+def iter_group(table, group_id: str, time_condition, **params):
+    """Lazily yield every matching item of all shards in ``send_timestamp`` order."""
+
+    def iter_shard(shard: int):
+        query_params = _shard_query_params(group_id, shard, time_condition, params)
+        while True:
+            response = table.query(**query_params)
+            yield from response.get("Items", [])
+            if "LastEvaluatedKey" not in response:
+                return
+            query_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    shards = [iter_shard(shard) for shard in range(read_shard_count(group_id))]
+    return heapq.merge(*shards, key=lambda item: item["send_timestamp"])
+
+
+def query_group(table, group_id: str, time_condition, **params) -> dict:
+    """Query every read shard of a group and merge the pages.
+
+    Returns a query-shaped response whose items are in ``send_timestamp``
+    order. When a shard's page was truncated, items from the earliest
+    truncation point on are dropped and ``LastEvaluatedKey`` carries that
+    ``send_timestamp``; the caller must resume from there inclusively, or
+    hand it on as a cursor, so no millisecond is split or lost.
+    """
+    shard_count = read_shard_count(group_id)
+
+    def query_shard(shard: int) -> dict:
+        return table.query(
+            **_shard_query_params(group_id, shard, time_condition, params)
+        )
+
+    if shard_count == 1:
+        responses = [query_shard(0)]
+    else:
+        with ThreadPoolExecutor(max_workers=shard_count) as executor:
+            responses = list(executor.map(query_shard, range(shard_count)))
+
+    items = heapq.merge(
+        *(response.get("Items", []) for response in responses),
+        key=lambda item: item["send_timestamp"],
+    )
+    truncated_at = [
+        response["LastEvaluatedKey"]["send_timestamp"]
+        for response in responses
+        if "LastEvaluatedKey" in response
+    ]
+    if not truncated_at:
+        return {"Items": list(items)}
+
+    cutoff = min(truncated_at)
+    return {
+        "Items": [item for item in items if item["send_timestamp"] < cutoff],
+        "LastEvaluatedKey": {"send_timestamp": cutoff},
+    }
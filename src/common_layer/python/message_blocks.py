@@ -0,0 +1,404 @@
+"""Block-packed copies of a segment's messages.
+
+Every message stays a todam_table item; search indexing, exports, archival
+and the image parser all work on those. Segments recorded with the block
+layout additionally get their messages packed into zlib-compressed block
+items of up to MESSAGE_BLOCK_SIZE messages or MESSAGE_BLOCK_BYTES of text,
+so reading a segment fetches a few small blocks plus the not yet packed
+tail instead of every message item.
+
+Segment attributes of the layout:
+
+- ``block_count``: number of sealed blocks, ids ``<segment_id>#block#<n>``
+- ``block_last_timestamps``: last ``send_timestamp`` of each block
+- ``packed_until``: messages up to this ``send_timestamp`` are in blocks
+
+A block never ends inside a millisecond, so every message sent at or
+before ``packed_until`` is in a block when it is sealed. Messages ingested
+more than PACK_SETTLE_MS after their send time may land behind a block
+that was already sealed; they are listed in ``late_messages#<group_id>#<day>``
+by send day, and readers fetch them along with the blocks.
+
+While a segment is recording, ``open_segment#<group_id>`` points at it and
+counts the messages and bytes of its unpacked tail, so the ingest path can
+tell when a block is due with a single update. Block, pointer and late
+list items carry neither ``group_id`` nor ``group_shard``, so the group
+index, the search index and the segment scans never see them.
+"""
+
+import json
+import logging
+import os
+import zlib
+from typing import Iterable, List, Optional, Tuple
+
+from boto3.dynamodb.conditions import Attr, Key
+from dynamodb_util import projection_params
+from group_shards import query_group
+from segment_archive import to_json_value
+
+# Configure logger
+logger = logging.getLogger(__name__)
+logger.setLevel("INFO")
+
+MESSAGE_BLOCK_SIZE = int(os.environ.get("MESSAGE_BLOCK_SIZE", "200"))
+MESSAGE_BLOCK_BYTES = int(os.environ.get("MESSAGE_BLOCK_BYTES", str(64 * 1024)))
+# Messages younger than this are left in the tail, so a message delivered
+# slightly out of order still lands after ``packed_until``
+PACK_SETTLE_MS = int(os.environ.get("MESSAGE_BLOCK_SETTLE_MS", "60000"))
+PACK_RETRY_EVERY = 20
+# BatchGetItem accepts at most this many keys per request
+BATCH_GET_KEYS = 100
+DAY_MS = 24 * 3600 * 1000
+
+BLOCK_FIELDS = (
+    "id",
+    "user_id",
+    "user_type",
+    "message_type",
+    "content",
+    "send_timestamp",
+)
+SEGMENT_BLOCK_ATTRIBUTES = (
+    "block_count",
+    "block_last_timestamps",
+    "packed_until",
+)
+
+
+def block_id(segment_id: str, block_number: int) -> str:
+    return f"{segment_id}#block#{block_number}"
+
+
+def open_segment_key(group_id: str) -> str:
+    return f"open_segment#{group_id}"
+
+
+def new_segment_attributes(start_timestamp: int) -> dict:
+    """Attributes that put a new segment on the block layout."""
+    return {
+        "block_count": 0,
+        "block_last_timestamps": [],
+        "packed_until": int(start_timestamp) - 1,
+    }
+
+
+def late_messages_key(group_id: str, day: int) -> str:
+    return f"late_messages#{group_id}#{day}"
+
+
+def open_segment_item(group_id: str, segment_id: str) -> dict:
+    return {
+        "id": open_segment_key(group_id),
+        "segment_id": segment_id,
+        "unpacked_count": 0,
+        "unpacked_bytes": 0,
+    }
+
+
+def message_bytes(item: dict) -> int:
+    return len((item.get("content") or "").encode("utf-8")) + 64
+
+
+def encode_block(messages: Iterable[dict]) -> bytes:
+    rows = [[message.get(field) for field in BLOCK_FIELDS] for message in messages]
+    return zlib.compress(
+        json.dumps(
+            rows, ensure_ascii=False, separators=(",", ":"), default=to_json_value
+        ).encode("utf-8")
+    )
+
+
+def decode_block(data) -> List[dict]:
+    # The boto3 resource wraps binary attributes in a Binary object
+    data = getattr(data, "value", data)
+    return [dict(zip(BLOCK_FIELDS, row)) for row in json.loads(zlib.decompress(data))]
+
+
+def record_messages(table, group_id: str, items: List[dict]) -> Optional[dict]:
+    """Count new messages against the tail of the group's open segment.
+
+    Returns the updated pointer, or None when no block layout segment is
+    recording in the group.
+    """
+    try:
+        return table.update_item(
+            Key={"id": open_segment_key(group_id)},
+            UpdateExpression="ADD unpacked_count :count, unpacked_bytes :bytes",
+            ConditionExpression="attribute_exists(segment_id)",
+            ExpressionAttributeValues={
+                ":count": len(items),
+                ":bytes": sum(map(message_bytes, items)),
+            },
+            ReturnValues="ALL_NEW",
+        )["Attributes"]
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return None
+
+
+def record_late_messages(table, group_id: str, items: List[dict], now: int) -> int:
+    """List messages ingested too late to be sure they missed every block.
+
+    A block may already cover their send time, and neither the next pack
+    nor the tail read looks before ``packed_until``. Returns how many were
+    listed.
+    """
+    late = {}
+    for item in items:
+        send_timestamp = int(item["send_timestamp"])
+        if now - send_timestamp > PACK_SETTLE_MS:
+            late.setdefault(send_timestamp // DAY_MS, set()).add(item["id"])
+    for day, ids in late.items():
+        table.update_item(
+            Key={"id": late_messages_key(group_id, day)},
+            UpdateExpression="ADD message_ids :ids",
+            ExpressionAttributeValues={":ids": ids},
+        )
+    return sum(map(len, late.values()))
+
+
+def should_pack(pointer: dict, added: int = 1) -> bool:
+    """Whether the ``added`` messages just counted make a pack attempt due."""
+    count = int(pointer.get("unpacked_count", 0))
+    if count < MESSAGE_BLOCK_SIZE and (
+        int(pointer.get("unpacked_bytes", 0)) < MESSAGE_BLOCK_BYTES
+    ):
+        return False
+    # A burst can fill a block before it settles, so retry only every few
+    # messages rather than querying the tail on each one
+    return count // PACK_RETRY_EVERY != (count - added) // PACK_RETRY_EVERY
+
+
+def pack_segment(table, segment: dict, now: int) -> int:
+    """Seal the settled part of the segment's tail into new blocks.
+
+    Only messages older than PACK_SETTLE_MS are packed, and a partial block
+    only once the segment has ended. Returns the number of blocks written;
+    a concurrent packer loses on the conditional put of the block id and
+    leaves the tail to the winner.
+    """
+    segment = dict(segment)
+    upper = now - PACK_SETTLE_MS
+    if segment.get("end_timestamp"):
+        upper = min(upper, int(segment["end_timestamp"]))
+
+    written = 0
+    while int(segment["packed_until"]) < upper:
+        packed, truncated = _pack_page(table, segment, upper)
+        written += packed
+        if not packed or not truncated:
+            break
+    return written
+
+
+def _pack_page(table, segment: dict, upper: int) -> Tuple[int, bool]:
+    """Pack one query page of the tail and advance ``segment`` past it."""
+    block_count = int(segment["block_count"])
+    response = query_group(
+        table,
+        segment["group_id"],
+        Key("send_timestamp").between(int(segment["packed_until"]) + 1, upper),
+        FilterExpression=Attr("is_message").eq(True),
+        **projection_params(*BLOCK_FIELDS),
+    )
+    items = response.get("Items", [])
+    truncated = "LastEvaluatedKey" in response
+    if truncated:
+        # Only pack up to where the page was cut, the rest stays in the tail
+        cutoff = response["LastEvaluatedKey"]["send_timestamp"]
+        items = [item for item in items if item["send_timestamp"] < cutoff]
+
+    blocks = []
+    current, current_bytes = [], 0
+    for position, item in enumerate(items):
+        current.append(item)
+        current_bytes += message_bytes(item)
+        full = (
+            len(current) >= MESSAGE_BLOCK_SIZE or current_bytes >= MESSAGE_BLOCK_BYTES
+        )
+        # Packing and the tail read resume after packed_until, so a block
+        # only ends where the next message is from a later millisecond
+        next_item = items[position + 1] if position + 1 < len(items) else None
+        if full and (
+            next_item is None or next_item["send_timestamp"] != item["send_timestamp"]
+        ):
+            blocks.append(current)
+            current, current_bytes = [], 0
+    if current and segment.get("end_timestamp") and not truncated:
+        blocks.append(current)
+    if not blocks:
+        return 0, truncated
+
+    last_timestamps = []
+    for offset, messages in enumerate(blocks):
+        try:
+            table.put_item(
+                Item={
+                    "id": block_id(segment["id"], block_count + offset),
+                    "segment_id": segment["id"],
+                    "is_message_block": True,
+                    "message_count": len(messages),
+                    "first_timestamp": int(messages[0]["send_timestamp"]),
+                    "last_timestamp": int(messages[-1]["send_timestamp"]),
+                    "data": encode_block(messages),
+                },
+                ConditionExpression="attribute_not_exists(id)",
+            )
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            logger.info("Segment %s is being packed concurrently", segment["id"])
+            break
+        last_timestamps.append(int(messages[-1]["send_timestamp"]))
+    if not last_timestamps:
+        return 0, truncated
+
+    packed = blocks[: len(last_timestamps)]
+    table.update_item(
+        Key={"id": segment["id"]},
+        UpdateExpression="SET block_count = :count, packed_until = :until, "
+        "block_last_timestamps = list_append(block_last_timestamps, :lasts)",
+        ConditionExpression="block_count = :previous",
+        ExpressionAttributeValues={
+            ":count": block_count + len(packed),
+            ":previous": block_count,
+            ":until": last_timestamps[-1],
+            ":lasts": last_timestamps,
+        },
+    )
+    segment["block_count"] = block_count + len(packed)
+    segment["packed_until"] = last_timestamps[-1]
+    try:
+        table.update_item(
+            Key={"id": open_segment_key(segment["group_id"])},
+            UpdateExpression="ADD unpacked_count :count, unpacked_bytes :bytes",
+            ConditionExpression="segment_id = :segment_id",
+            ExpressionAttributeValues={
+                ":segment_id": segment["id"],
+                ":count": -sum(len(messages) for messages in packed),
+                ":bytes": -sum(
+                    message_bytes(item) for messages in packed for item in messages
+                ),
+            },
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        # The recording has ended and the pointer is gone
+        pass
+    logger.info("Packed %d blocks of segment %s", len(packed), segment["id"])
+    return len(packed), truncated and len(packed) == len(blocks)
+
+
+def _batch_get(dynamodb, table_name: str, ids: List[str], *attributes) -> List[dict]:
+    items = []
+    for start in range(0, len(ids), BATCH_GET_KEYS):
+        request = {
+            table_name: {
+                "Keys": [
+                    {"id": item_id} for item_id in ids[start : start + BATCH_GET_KEYS]
+                ],
+                **projection_params(*attributes),
+            }
+        }
+        while request:
+            response = dynamodb.batch_get_item(RequestItems=request)
+            items.extend(response["Responses"].get(table_name, []))
+            request = response.get("UnprocessedKeys")
+    return items
+
+
+def _late_messages(dynamodb, table, segment, start_timestamp, end_timestamp):
+    """Listed late messages sent at or before ``packed_until``.
+
+    Later ones are read with the tail anyway.
+    """
+    if not int(segment.get("block_count", 0)):
+        return []
+    last = end_timestamp if end_timestamp is not None else segment["packed_until"]
+    days = range(int(start_timestamp) // DAY_MS, int(last) // DAY_MS + 1)
+    lists = _batch_get(
+        dynamodb,
+        table.name,
+        [late_messages_key(segment["group_id"], day) for day in days],
+        "message_ids",
+    )
+    ids = sorted({message_id for item in lists for message_id in item["message_ids"]})
+    return [
+        message
+        for message in _batch_get(dynamodb, table.name, ids, *BLOCK_FIELDS)
+        if message["send_timestamp"] <= int(segment["packed_until"])
+    ]
+
+
+def read_segment_messages(
+    dynamodb,
+    table,
+    segment_id: str,
+    segment: dict,
+    start_timestamp: int,
+    end_timestamp=None,
+) -> dict:
+    """Read a block layout segment as a query-shaped response.
+
+    Sealed blocks covering the range and the listed late messages are
+    fetched in batches; the tail after ``packed_until`` is queried like the
+    one-item-per-message layout.
+    """
+    last_timestamps = [int(t) for t in segment.get("block_last_timestamps", [])]
+    needed = [
+        block_id(segment_id, number)
+        for number, last in enumerate(last_timestamps)
+        if last >= start_timestamp
+    ]
+    messages = []
+    for block in _batch_get(dynamodb, table.name, needed, "id", "data"):
+        messages.extend(decode_block(block["data"]))
+    packed_ids = {message["id"] for message in messages}
+    messages.extend(
+        message
+        for message in _late_messages(
+            dynamodb, table, segment, start_timestamp, end_timestamp
+        )
+        if message["id"] not in packed_ids
+    )
+
+    # Image text is filled in after upload and may postdate the block
+    pending_images = [
+        message["id"]
+        for message in messages
+        if message["message_type"] == "image" and not message["content"]
+    ]
+    if pending_images:
+        contents = {
+            item["id"]: item.get("content", "")
+            for item in _batch_get(
+                dynamodb, table.name, pending_images, "id", "content"
+            )
+        }
+        for message in messages:
+            if message["id"] in contents:
+                message["content"] = contents[message["id"]]
+
+    messages = [
+        message
+        for message in messages
+        if message["send_timestamp"] >= start_timestamp
+        and (end_timestamp is None or message["send_timestamp"] <= end_timestamp)
+    ]
+    messages.sort(key=lambda message: message["send_timestamp"])
+
+    tail_start = max(start_timestamp, int(segment["packed_until"]) + 1)
+    if end_timestamp is not None:
+        if tail_start > end_timestamp:
+            return {"Items": messages}
+        time_condition = Key("send_timestamp").between(tail_start, end_timestamp)
+    else:
+        time_condition = Key("send_timestamp").gte(tail_start)
+    tail = query_group(
+        table,
+        segment["group_id"],
+        time_condition,
+        FilterExpression=Attr("is_message").eq(True),
+        **projection_params(*BLOCK_FIELDS),
+    )
+    response = {"Items": messages + tail.get("Items", [])}
+    if "LastEvaluatedKey" in tail:
+        response["LastEvaluatedKey"] = tail["LastEvaluatedKey"]
+    return response
@@ -0,0 +1,253 @@
+import json
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+import requests
+
+# Configure logger
+logger = logging.getLogger(__name__)
+logger.setLevel("INFO")
+
+METRICS_NAMESPACE = "Todam/Outbound"
+
+# Upper bounds (milliseconds) of the latency histogram buckets
+LATENCY_BUCKETS_MS = [50, 100, 250, 500, 1000, 2500, 5000, 10000, 20000, 30000]
+
+
+class UpstreamUnavailableError(Exception):
+    """Raised when a call is rejected locally instead of being sent upstream."""
+
+
+class CircuitOpenError(UpstreamUnavailableError):
+    pass
+
+
+class CircuitBreaker:
+    """Open after consecutive failures, allow a single probe after the reset timeout."""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and (
+                time.monotonic() - self.opened_at >= self.reset_timeout
+            ):
+                # Let exactly one probe through; others keep failing fast
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def retry_after(self) -> int:
+        remaining = self.reset_timeout - (time.monotonic() - self.opened_at)
+        return max(1, int(remaining))
+
+
+class RetryBudget:
+    """Token bucket that caps retries to a fraction of the request volume."""
+
+    def __init__(self, ratio: float = 0.1, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_withdraw(self) -> bool:
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class LatencyHistogram:
+    def __init__(self, buckets_ms: List[int] = LATENCY_BUCKETS_MS):
+        self.buckets_ms = buckets_ms
+        self.reset()
+
+    def reset(self) -> None:
+        # Last slot counts everything slower than the largest bucket
+        self.counts = [0] * (len(self.buckets_ms) + 1)
+
+    def observe(self, latency_ms: float) -> None:
+        for index, upper_bound in enumerate(self.buckets_ms):
+            if latency_ms <= upper_bound:
+                self.counts[index] += 1
+                return
+        self.counts[-1] += 1
+
+    def snapshot(self) -> Dict[str, List[int]]:
+        values, counts = [], []
+        bounds = self.buckets_ms + [self.buckets_ms[-1] * 2]
+        for upper_bound, count in zip(bounds, self.counts):
+            if count:
+                values.append(upper_bound)
+                counts.append(count)
+        return {"Values": values, "Counts": counts}
+
+
+class Endpoint:
+    """Outbound HTTP endpoint guarded by timeouts, a retry budget and a circuit breaker.
+
+    State lives at module scope, so it is only shared by the invocations one
+    warm Lambda container handles in turn: each container trips its own
+    breaker and a cold one starts closed. A container runs one invocation at
+    a time, so concurrency towards the upstream is capped with the function's
+    reserved concurrency rather than here.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        url: str,
+        connect_timeout: float = 3.05,
+        read_timeout: float = 20.0,
+        max_retries: int = 0,
+        breaker: Optional[CircuitBreaker] = None,
+        retry_budget: Optional[RetryBudget] = None,
+    ):
+        self.name = name
+        self.url = url
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.breaker = breaker or CircuitBreaker()
+        self.retry_budget = retry_budget or RetryBudget()
+        self.histogram = LatencyHistogram()
+        self.outcomes = {"success": 0, "failure": 0, "rejected": 0}
+        self.session = requests.Session()
+
+    def post(self, deadline_ms: Optional[int] = None, **kwargs) -> requests.Response:
+        """POST to the endpoint.
+
+        ``deadline_ms`` is the caller's remaining time budget (e.g.
+        ``context.get_remaining_time_in_millis()``); the read timeout is
+        shortened so the call never outlives the invocation.
+        """
+        if not self.breaker.allow_request():
+            self.outcomes["rejected"] += 1
+            self.publish_metrics()
+            raise CircuitOpenError(f"Circuit for {self.name} is open")
+
+        self.retry_budget.deposit()
+        attempt = 0
+        try:
+            while True:
+                try:
+                    response = self._send(deadline_ms, **kwargs)
+                except (requests.ConnectionError, requests.Timeout):
+                    if self._should_retry(attempt):
+                        attempt += 1
+                        continue
+                    self._record(overloaded=True)
+                    raise
+                except Exception:
+                    self._record(overloaded=True)
+                    raise
+
+                if response.status_code >= 500 or response.status_code == 429:
+                    if self._should_retry(attempt):
+                        attempt += 1
+                        continue
+                    self._record(overloaded=True)
+                    return response
+
+                self._record(overloaded=False)
+                return response
+        finally:
+            self.publish_metrics()
+
+    def _send(self, deadline_ms: Optional[int], **kwargs) -> requests.Response:
+        read_timeout = self.read_timeout
+        if deadline_ms is not None:
+            # Keep a second in hand for the handler to clean up
+            read_timeout = max(0.1, min(read_timeout, deadline_ms / 1000 - 1))
+        start = time.perf_counter()
+        try:
+            return self.session.post(
+                self.url, timeout=(self.connect_timeout, read_timeout), **kwargs
+            )
+        finally:
+            self.histogram.observe((time.perf_counter() - start) * 1000)
+
+    def _should_retry(self, attempt: int) -> bool:
+        return attempt < self.max_retries and self.retry_budget.try_withdraw()
+
+    def _record(self, overloaded: bool) -> None:
+        if overloaded:
+            self.breaker.record_failure()
+            self.outcomes["failure"] += 1
+        else:
+            self.breaker.record_success()
+            self.outcomes["success"] += 1
+
+    def publish_metrics(self) -> None:
+        """Log the metrics gathered since the last call in CloudWatch EMF."""
+        snapshot = self.histogram.snapshot()
+        if not snapshot["Values"] and not self.outcomes["rejected"]:
+            return
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": METRICS_NAMESPACE,
+                        "Dimensions": [["Endpoint"]],
+                        "Metrics": [
+                            {"Name": "Latency", "Unit": "Milliseconds"},
+                            {"Name": "Success", "Unit": "Count"},
+                            {"Name": "Failure", "Unit": "Count"},
+                            {"Name": "Rejected", "Unit": "Count"},
+                        ],
+                    }
+                ],
+            },
+            "Endpoint": self.name,
+            "Latency": snapshot,
+            "Success": self.outcomes["success"],
+            "Failure": self.outcomes["failure"],
+            "Rejected": self.outcomes["rejected"],
+            "CircuitState": self.breaker.state,
+        }
+        print(json.dumps(record))
+        self.histogram.reset()
+        self.outcomes = {"success": 0, "failure": 0, "rejected": 0}
+
+
+_endpoints: Dict[str, Endpoint] = {}
+
+
+def get_endpoint(name: str, url: str, **kwargs) -> Endpoint:
+    """Return the shared Endpoint for ``name``, creating it on first use."""
+    if name not in _endpoints:
+        _endpoints[name] = Endpoint(name, url, **kwargs)
+    return _endpoints[name]
@@ -0,0 +1,106 @@
+import cProfile
+import functools
+import gzip
+import io
+import logging
+import marshal
+import os
+import pickle
+import pstats
+import random
+import time
+import tracemalloc
+import uuid
+
+import boto3
+
+# Configure logger
+logger = logging.getLogger(__name__)
+logger.setLevel("INFO")
+
+# Fraction of invocations to profile; 0 disables profiling entirely
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_BUCKET = os.environ.get("PROFILE_BUCKET") or os.environ.get("S3_BUCKET")
+PROFILE_PREFIX = "profiles/"
+# Stack depth recorded per allocation
+TRACEMALLOC_FRAMES = int(os.environ.get("PROFILE_TRACEMALLOC_FRAMES", "10"))
+# Functions and allocation sites listed in the log summary
+SUMMARY_LINES = 10
+
+s3 = boto3.client("s3") if PROFILE_SAMPLE_RATE > 0 else None
+
+
+def profiled(handler):
+    """Profile a sampled share of ``handler`` invocations and upload the results.
+
+    Sampled invocations run under cProfile and tracemalloc. The pstats data
+    (``.prof.gz``, load with ``pstats.Stats`` after gunzip) and the pickled
+    allocation snapshot (``.tracemalloc.gz``, ``tracemalloc.Snapshot.load``)
+    are written to ``profiles/<function>/<date>/<request id>``. With
+    profiling disabled the handler is returned unwrapped.
+    """
+    if PROFILE_SAMPLE_RATE <= 0 or not PROFILE_BUCKET:
+        return handler
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        if random.random() >= PROFILE_SAMPLE_RATE:
+            return handler(event, context)
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        tracemalloc.reset_peak()
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            return profiler.runcall(handler, event, context)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            snapshot = tracemalloc.take_snapshot()
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+            try:
+                upload_profile(context, profiler, snapshot, elapsed_ms, peak_bytes)
+            except Exception:
+                # Profiling must never fail the invocation it observes
+                logger.warning("Failed to upload profile", exc_info=True)
+
+    return wrapper
+
+
+def upload_profile(context, profiler, snapshot, elapsed_ms, peak_bytes) -> None:
+    function_name = getattr(context, "function_name", "local")
+    request_id = getattr(context, "aws_request_id", None) or uuid.uuid4().hex
+    key = (
+        f"{PROFILE_PREFIX}{function_name}/{time.strftime('%Y/%m/%d', time.gmtime())}/"
+        f"{request_id}"
+    )
+
+    profiler.create_stats()
+    s3.put_object(
+        Bucket=PROFILE_BUCKET,
+        Key=f"{key}.prof.gz",
+        Body=gzip.compress(marshal.dumps(profiler.stats)),
+    )
+    s3.put_object(
+        Bucket=PROFILE_BUCKET,
+        Key=f"{key}.tracemalloc.gz",
+        Body=gzip.compress(pickle.dumps(snapshot)),
+    )
+
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(
+        SUMMARY_LINES
+    )
+    top_allocations = snapshot.statistics("lineno")[:SUMMARY_LINES]
+    logger.info(
+        "Profiled %s in %.1f ms, peak %d bytes traced, uploaded to %s\n%s\n%s",
+        function_name,
+        elapsed_ms,
+        peak_bytes,
+        key,
+        summary.getvalue(),
+        "\n".join(str(stat) for stat in top_allocations),
+    )
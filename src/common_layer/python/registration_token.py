@@ -0,0 +1,70 @@
+import base64
+import functools
+import hashlib
+import hmac
+import json
+import os
+import time
+
+import boto3
+
+# Verification links stay valid this long after the registration was applied
+TOKEN_TTL_MS = 24 * 3600 * 1000
+SECRET_ARN = os.environ.get("REGISTRATION_TOKEN_SECRET_ARN")
+
+secretsmanager = boto3.client("secretsmanager")
+
+
+class LinkExpiredError(ValueError):
+    """The link was genuine but has expired or been superseded."""
+
+
+@functools.lru_cache(maxsize=1)
+def get_signing_key() -> bytes:
+    """Fetch and cache the HMAC key from Secrets Manager."""
+    response = secretsmanager.get_secret_value(SecretId=SECRET_ARN)
+    return response["SecretString"].encode("utf-8")
+
+
+def _encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(payload: str) -> str:
+    return _encode(
+        hmac.new(get_signing_key(), payload.encode("utf-8"), hashlib.sha256).digest()
+    )
+
+
+def issue_token(user_id: str, email: str, issued_at: int) -> str:
+    """Sign the registration claims; ``issued_at`` is the apply timestamp in ms."""
+    payload = _encode(
+        json.dumps(
+            {"user_id": user_id, "email": email, "iat": issued_at},
+            separators=(",", ":"),
+        ).encode("utf-8")
+    )
+    return f"{payload}.{_sign(payload)}"
+
+
+def read_token(token: str, now: int = None) -> dict:
+    """Return the claims of a valid, unexpired token or raise ValueError."""
+    try:
+        payload, signature = token.split(".")
+    except (AttributeError, ValueError):
+        raise ValueError("Invalid verification code")
+    if not hmac.compare_digest(
+        signature.encode("utf-8"), _sign(payload).encode("utf-8")
+    ):
+        raise ValueError("Invalid verification code")
+
+    claims = json.loads(_decode(payload))
+    if now is None:
+        now = int(time.time() * 1000)
+    if now - claims["iat"] > TOKEN_TTL_MS:
+        raise LinkExpiredError("Verification code expired")
+    return claims
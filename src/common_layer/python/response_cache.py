@@ -0,0 +1,142 @@
+import hashlib
+import logging
+import os
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import boto3
+from capacity import track
+
+# Configure logger
+logger = logging.getLogger(__name__)
+logger.setLevel("INFO")
+
+CACHE_VERSION_TABLE_NAME = os.environ.get(
+    "CACHE_VERSION_TABLE", "todam_cache_version_table"
+)
+# Within this window a cached response is served without checking versions
+CACHE_TTL_SECONDS = float(os.environ.get("CACHE_TTL_SECONDS", "2"))
+CACHE_MAX_ENTRIES = 256
+
+dynamodb = boto3.resource("dynamodb")
+# Versions are bumped per write, so they count against the group
+track(dynamodb)
+version_table = dynamodb.Table(CACHE_VERSION_TABLE_NAME)
+
+ALL_SEGMENTS_SCOPE = "segments#*"
+
+
+def segments_scope(group_id: str) -> str:
+    return f"segments#{group_id}"
+
+
+def messages_scope(group_id: str) -> str:
+    return f"messages#{group_id}"
+
+
+def bump_versions(*scopes: str) -> None:
+    """Invalidate every cached response that depends on ``scopes``."""
+    for scope in scopes:
+        try:
+            version_table.update_item(
+                Key={"scope": scope},
+                UpdateExpression="ADD version :one",
+                ExpressionAttributeValues={":one": 1},
+            )
+        except Exception as e:
+            # Readers fall back to the TTL, so a missed bump only delays freshness
+            logger.error("Error bumping cache version for %s: %s", scope, e)
+
+
+def get_versions(scopes: List[str]) -> Tuple[int, ...]:
+    if len(scopes) == 1:
+        item = version_table.get_item(Key={"scope": scopes[0]}).get("Item", {})
+        return (int(item.get("version", 0)),)
+
+    response = dynamodb.batch_get_item(
+        RequestItems={
+            CACHE_VERSION_TABLE_NAME: {"Keys": [{"scope": s} for s in scopes]}
+        }
+    )
+    versions = {
+        item["scope"]: int(item["version"])
+        for item in response["Responses"].get(CACHE_VERSION_TABLE_NAME, [])
+    }
+    return tuple(versions.get(scope, 0) for scope in scopes)
+
+
+class CacheEntry:
+    def __init__(self, response: dict, etag: str, scopes: List[str], versions):
+        self.response = response
+        self.etag = etag
+        self.scopes = scopes
+        self.versions = versions
+        self.checked_at = time.monotonic()
+
+
+_entries: Dict[str, CacheEntry] = {}
+
+
+def compute_etag(body: str) -> str:
+    return '"' + hashlib.sha1(body.encode("utf-8")).hexdigest() + '"'
+
+
+def get_if_none_match(event: dict) -> Optional[str]:
+    headers = event.get("headers") or {}
+    for name, value in headers.items():
+        if name.lower() == "if-none-match":
+            return value
+    return None
+
+
+def _respond(entry: CacheEntry, if_none_match: Optional[str]) -> dict:
+    if if_none_match == entry.etag:
+        return {"statusCode": 304, "body": "", "headers": {"ETag": entry.etag}}
+    return entry.response
+
+
+def serve_cached(
+    event: dict,
+    cache_key: str,
+    build: Callable[[], Tuple[dict, Optional[List[str]]]],
+) -> dict:
+    """Serve a GET response through the container-local cache.
+
+    ``build`` computes the uncached response and returns it together with
+    the version scopes it depends on. Entries are revalidated against the
+    version table after CACHE_TTL_SECONDS and rebuilt when a writer has
+    bumped one of their scopes.
+    """
+    if_none_match = get_if_none_match(event)
+    entry = _entries.get(cache_key)
+    versions = None
+
+    if entry:
+        if time.monotonic() - entry.checked_at < CACHE_TTL_SECONDS:
+            logger.info("Serving %s from cache", cache_key)
+            return _respond(entry, if_none_match)
+        try:
+            # Read before rebuilding so a write racing the build is not masked
+            versions = get_versions(entry.scopes)
+        except Exception as e:
+            logger.error("Error reading cache versions: %s", e)
+        if versions is not None and versions == entry.versions:
+            entry.checked_at = time.monotonic()
+            logger.info("Revalidated cached %s", cache_key)
+            return _respond(entry, if_none_match)
+
+    response, scopes = build()
+    if response.get("statusCode") != 200 or not scopes:
+        return response
+    if not entry or scopes != entry.scopes:
+        # Scopes were unknown before the build; the entry lives for one TTL
+        # and is then rebuilt against versions read up front.
+        versions = None
+
+    etag = compute_etag(response["body"])
+    response.setdefault("headers", {})["ETag"] = etag
+
+    if cache_key not in _entries and len(_entries) >= CACHE_MAX_ENTRIES:
+        _entries.pop(next(iter(_entries)))
+    _entries[cache_key] = CacheEntry(response, etag, scopes, versions)
+    return _respond(_entries[cache_key], if_none_match)
@@ -0,0 +1,354 @@
+import bisect
+import hashlib
+import heapq
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional
+
+from boto3.dynamodb.conditions import Key
+from text_util import CJK_CHARACTERS, CJK_PATTERN
+
+TOKEN_PATTERN = re.compile(rf"[{CJK_CHARACTERS}]+|(?:(?![{CJK_CHARACTERS}])[^\W_])+")
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Upper bound on postings read per query term, so very common terms stay cheap
+MAX_POSTINGS_PER_TERM = 10000
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into index terms.
+
+    CJK runs have no spaces between words, so they are indexed as
+    overlapping character bigrams; a lone CJK character is kept as is.
+    Everything else is split into lower-cased words. NFKC folds full-width
+    letters and digits, common in Traditional Chinese input, to ASCII.
+    """
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text):
+        run = match.group()
+        if CJK_PATTERN.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i : i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
+
+
+def document_digest(term_freqs: Dict[str, int]) -> str:
+    """Fingerprint of an indexed document, to tell its versions apart."""
+    terms = "\n".join(f"{term}:{tf}" for term, tf in sorted(term_freqs.items()))
+    return hashlib.sha1(terms.encode("utf-8")).hexdigest()
+
+
+class InMemoryIndexStore:
+    """Index storage for local builds and tests."""
+
+    def __init__(self):
+        self._postings = defaultdict(dict)
+        self._stats = defaultdict(lambda: [0, 0])
+        self._documents = defaultdict(dict)
+        self._segments = defaultdict(dict)
+
+    def add_document(self, group_id, doc_id, send_timestamp, term_freqs, doc_len):
+        for term, tf in term_freqs.items():
+            self._postings[(group_id, term)][doc_id] = {
+                "doc_id": doc_id,
+                "tf": tf,
+                "doc_len": doc_len,
+                "send_timestamp": send_timestamp,
+            }
+        if doc_id not in self._documents[group_id]:
+            self._documents[group_id][doc_id] = document_digest(term_freqs)
+            self._stats[group_id][0] += 1
+            self._stats[group_id][1] += doc_len
+
+    def remove_document(self, group_id, doc_id, term_freqs, doc_len):
+        for term in term_freqs:
+            self._postings[(group_id, term)].pop(doc_id, None)
+        if self._documents[group_id].get(doc_id) == document_digest(term_freqs):
+            del self._documents[group_id][doc_id]
+            self._stats[group_id][0] -= 1
+            self._stats[group_id][1] -= doc_len
+
+    def postings(self, group_id, term) -> List[dict]:
+        return list(self._postings[(group_id, term)].values())[:MAX_POSTINGS_PER_TERM]
+
+    def stats(self, group_id):
+        return tuple(self._stats[group_id])
+
+    def put_segment(self, group_id, segment_id, start_timestamp, end_timestamp):
+        self._segments[group_id][segment_id] = {
+            "segment_id": segment_id,
+            "start_timestamp": int(start_timestamp),
+            "end_timestamp": int(end_timestamp) if end_timestamp else None,
+        }
+
+    def segments(self, group_id) -> List[dict]:
+        return sorted(
+            self._segments[group_id].values(), key=lambda s: s["start_timestamp"]
+        )
+
+
+class DynamoDBIndexStore:
+    """Index storage in a single DynamoDB table keyed by (pk, sk).
+
+    pk is ``<group_id>#t#<term>`` for postings (sk is the message id),
+    ``<group_id>#stats`` for corpus statistics, ``<group_id>#docs`` for the
+    messages counted in them (sk is the message id) and
+    ``<group_id>#segments`` for segment time spans (sk is the zero-padded
+    start timestamp).
+
+    Postings are plain puts and deletes, so replaying a stream record
+    rewrites the same items. The statistics are counters, so each change is
+    written in one transaction with its ``#docs`` marker and skipped when
+    the marker shows it was already applied.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def add_document(self, group_id, doc_id, send_timestamp, term_freqs, doc_len):
+        with self.table.batch_writer() as batch:
+            for term, tf in term_freqs.items():
+                batch.put_item(
+                    Item={
+                        "pk": f"{group_id}#t#{term}",
+                        "sk": doc_id,
+                        "tf": tf,
+                        "doc_len": doc_len,
+                        "send_timestamp": send_timestamp,
+                    }
+                )
+        marker = {
+            "Put": {
+                "TableName": self.table.name,
+                "Item": {
+                    "pk": f"{group_id}#docs",
+                    "sk": doc_id,
+                    "digest": document_digest(term_freqs),
+                    "doc_len": doc_len,
+                },
+                "ConditionExpression": "attribute_not_exists(pk)",
+            }
+        }
+        self._add_stats(group_id, marker, 1, doc_len)
+
+    def remove_document(self, group_id, doc_id, term_freqs, doc_len):
+        with self.table.batch_writer() as batch:
+            for term in term_freqs:
+                batch.delete_item(Key={"pk": f"{group_id}#t#{term}", "sk": doc_id})
+        marker = {
+            "Delete": {
+                "TableName": self.table.name,
+                "Key": {"pk": f"{group_id}#docs", "sk": doc_id},
+                # Only the version that was counted is subtracted again
+                "ConditionExpression": "digest = :h",
+                "ExpressionAttributeValues": {":h": document_digest(term_freqs)},
+            }
+        }
+        self._add_stats(group_id, marker, -1, -doc_len)
+
+    def _add_stats(self, group_id, marker, doc_count, total_len):
+        client = self.table.meta.client
+        try:
+            client.transact_write_items(
+                TransactItems=[
+                    marker,
+                    {
+                        "Update": {
+                            "TableName": self.table.name,
+                            "Key": {"pk": f"{group_id}#stats", "sk": "stats"},
+                            "UpdateExpression": "ADD doc_count :d, total_len :l",
+                            "ExpressionAttributeValues": {
+                                ":d": doc_count,
+                                ":l": total_len,
+                            },
+                        }
+                    },
+                ]
+            )
+        except client.exceptions.TransactionCanceledException as e:
+            reasons = e.response.get("CancellationReasons") or [{}]
+            if reasons[0].get("Code") != "ConditionalCheckFailed":
+                raise
+            # Already applied, e.g. by a retried stream batch
+
+    def postings(self, group_id, term) -> List[dict]:
+        params = {"KeyConditionExpression": Key("pk").eq(f"{group_id}#t#{term}")}
+        postings = []
+        while len(postings) < MAX_POSTINGS_PER_TERM:
+            response = self.table.query(**params)
+            postings.extend(
+                {
+                    "doc_id": item["sk"],
+                    "tf": int(item["tf"]),
+                    "doc_len": int(item["doc_len"]),
+                    "send_timestamp": int(item["send_timestamp"]),
+                }
+                for item in response.get("Items", [])
+            )
+            if "LastEvaluatedKey" not in response:
+                break
+            params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+        return postings[:MAX_POSTINGS_PER_TERM]
+
+    def stats(self, group_id):
+        item = self.table.get_item(Key={"pk": f"{group_id}#stats", "sk": "stats"}).get(
+            "Item", {}
+        )
+        return int(item.get("doc_count", 0)), int(item.get("total_len", 0))
+
+    def put_segment(self, group_id, segment_id, start_timestamp, end_timestamp):
+        item = {
+            "pk": f"{group_id}#segments",
+            "sk": f"{int(start_timestamp):015d}",
+            "segment_id": segment_id,
+            "start_timestamp": int(start_timestamp),
+        }
+        if end_timestamp:
+            item["end_timestamp"] = int(end_timestamp)
+        self.table.put_item(Item=item)
+
+    def segments(self, group_id) -> List[dict]:
+        params = {"KeyConditionExpression": Key("pk").eq(f"{group_id}#segments")}
+        segments = []
+        while True:
+            response = self.table.query(**params)
+            segments.extend(
+                {
+                    "segment_id": item["segment_id"],
+                    "start_timestamp": int(item["start_timestamp"]),
+                    "end_timestamp": (
+                        int(item["end_timestamp"]) if "end_timestamp" in item else None
+                    ),
+                }
+                for item in response.get("Items", [])
+            )
+            if "LastEvaluatedKey" not in response:
+                return segments
+            params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+class SearchIndex:
+    def __init__(self, store):
+        self.store = store
+
+    def index_message(self, group_id, doc_id, send_timestamp, content) -> None:
+        tokens = tokenize(content)
+        if tokens:
+            self.store.add_document(
+                group_id, doc_id, int(send_timestamp), Counter(tokens), len(tokens)
+            )
+
+    def unindex_message(self, group_id, doc_id, content) -> None:
+        tokens = tokenize(content)
+        if tokens:
+            self.store.remove_document(group_id, doc_id, Counter(tokens), len(tokens))
+
+    def index_segment(self, group_id, segment_id, start_timestamp, end_timestamp):
+        self.store.put_segment(group_id, segment_id, start_timestamp, end_timestamp)
+
+    def search(self, group_id: str, query: str, limit: int = 20) -> dict:
+        """Rank a group's messages against ``query`` with BM25.
+
+        Messages containing every query term rank ahead of partial matches.
+        Hits are also rolled up into segments by send time.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return {"messages": [], "segments": []}
+
+        doc_count, total_len = self.store.stats(group_id)
+        average_len = total_len / doc_count if doc_count else 1.0
+
+        scores: Dict[str, float] = defaultdict(float)
+        matched: Dict[str, int] = defaultdict(int)
+        timestamps: Dict[str, int] = {}
+        for term in terms:
+            postings = self.store.postings(group_id, term)
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1 + (max(doc_count, df) - df + 0.5) / (df + 0.5))
+            for posting in postings:
+                tf = posting["tf"]
+                norm = K1 * (1 - B + B * posting["doc_len"] / average_len)
+                scores[posting["doc_id"]] += idf * tf * (K1 + 1) / (tf + norm)
+                matched[posting["doc_id"]] += 1
+                timestamps[posting["doc_id"]] = posting["send_timestamp"]
+
+        top = heapq.nlargest(
+            limit, scores, key=lambda doc_id: (matched[doc_id], scores[doc_id])
+        )
+        messages = [
+            {
+                "message_id": doc_id,
+                "send_timestamp": timestamps[doc_id],
+                "score": round(scores[doc_id], 4),
+                "matched_terms": matched[doc_id],
+                "segment_id": None,
+            }
+            for doc_id in top
+        ]
+        return {
+            "messages": messages,
+            "segments": self._rank_segments(group_id, messages),
+        }
+
+    def _rank_segments(self, group_id: str, messages: List[dict]) -> List[dict]:
+        if not messages:
+            return []
+        segments = self.store.segments(group_id)
+        starts = [segment["start_timestamp"] for segment in segments]
+
+        ranked: Dict[str, dict] = {}
+        for message in messages:
+            segment = _find_segment(segments, starts, message["send_timestamp"])
+            if segment is None:
+                continue
+            message["segment_id"] = segment["segment_id"]
+            entry = ranked.setdefault(
+                segment["segment_id"], {**segment, "score": 0.0, "hit_count": 0}
+            )
+            entry["score"] = round(entry["score"] + message["score"], 4)
+            entry["hit_count"] += 1
+        return sorted(ranked.values(), key=lambda s: s["score"], reverse=True)
+
+
+def _find_segment(
+    segments: List[dict], starts: List[int], send_timestamp: int
+) -> Optional[dict]:
+    index = bisect.bisect_right(starts, send_timestamp) - 1
+    if index < 0:
+        return None
+    segment = segments[index]
+    end = segment["end_timestamp"]
+    if end is not None and send_timestamp > end:
+        return None
+    return segment
+
+
+def build_index(store, items: Iterable[dict]) -> SearchIndex:
+    """Build an index from todam_table items, e.g. an export or a table scan."""
+    index = SearchIndex(store)
+    for item in items:
+        if item.get("is_segment"):
+            index.index_segment(
+                item["group_id"],
+                item["segment_id"],
+                item["start_timestamp"],
+                item.get("end_timestamp"),
+            )
+        if item.get("is_message") and item.get("content"):
+            index.index_message(
+                item["group_id"], item["id"], item["send_timestamp"], item["content"]
+            )
+    return index
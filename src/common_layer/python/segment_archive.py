@@ -0,0 +1,40 @@
+"""S3 archives of resolved segments.
+
+An archive is a gzip-compressed JSON object ``{"segment": ..., "messages":
+[...]}``. The segment item keeps its key in ``archive_key`` once it is
+written, and its message items are expired from the table afterwards, so
+every reader of an archived segment's messages has to come here.
+"""
+
+import gzip
+import json
+from decimal import Decimal
+from typing import List
+
+ARCHIVE_PREFIX = "archive/"
+
+
+def archive_key_for(segment: dict) -> str:
+    return f"{ARCHIVE_PREFIX}{segment['group_id']}/{segment['segment_id']}.json.gz"
+
+
+def to_json_value(value):
+    if isinstance(value, Decimal):
+        return int(value) if value % 1 == 0 else float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def encode_archive(segment: dict, messages: List[dict]) -> bytes:
+    return gzip.compress(
+        json.dumps(
+            {"segment": segment, "messages": messages},
+            ensure_ascii=False,
+            default=to_json_value,
+        ).encode("utf-8")
+    )
+
+
+def read_archived_messages(s3, bucket: str, archive_key: str) -> List[dict]:
+    """Messages of an archived segment in ``send_timestamp`` order."""
+    body = s3.get_object(Bucket=bucket, Key=archive_key)["Body"].read()
+    return json.loads(gzip.decompress(body))["messages"]
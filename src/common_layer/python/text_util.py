@@ -0,0 +1,5 @@
+import re
+
+# Han (incl. extension A and compatibility), kana and hangul
+CJK_CHARACTERS = "\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\u3040-\u30ff\uac00-\ud7af"
+CJK_PATTERN = re.compile(rf"[{CJK_CHARACTERS}]")
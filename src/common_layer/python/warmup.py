@@ -0,0 +1,90 @@
+import functools
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict
+
+# Configure logger
+logger = logging.getLogger(__name__)
+logger.setLevel("INFO")
+
+# Also prime while the container initialises, e.g. for provisioned concurrency
+PRIME_ON_INIT = os.environ.get("PRIME_ON_INIT", "false").lower() == "true"
+# Sources of warm-up events; scheduled warmers send {"warmup": true} instead
+WARMUP_SOURCES = {"todam.warmup", "serverless-plugin-warmup"}
+
+Primers = Dict[str, Callable[[], object]]
+
+
+def is_warmup_event(event) -> bool:
+    return isinstance(event, dict) and (
+        event.get("warmup") is True or event.get("source") in WARMUP_SOURCES
+    )
+
+
+def dynamodb_primer(table) -> Callable[[], object]:
+    """Open a connection to the table's endpoint without reading any item."""
+    return lambda: table.meta.client.describe_endpoints()
+
+
+def s3_primer(client, bucket: str) -> Callable[[], object]:
+    return lambda: client.head_bucket(Bucket=bucket)
+
+
+def sqs_primer(client, queue_url: str) -> Callable[[], object]:
+    return lambda: client.get_queue_attributes(
+        QueueUrl=queue_url, AttributeNames=["QueueArn"]
+    )
+
+
+def ses_primer(client) -> Callable[[], object]:
+    return lambda: client.get_send_quota()
+
+
+def prime(primers: Primers) -> Dict[str, object]:
+    """Run every primer in parallel and report how long each one took.
+
+    A primer that fails is only logged: an AccessDenied response still
+    leaves an open TLS connection in the client's pool, which is the point.
+    """
+
+    def run(item):
+        name, primer = item
+        started = time.perf_counter()
+        try:
+            primer()
+        except Exception as e:
+            logger.info("Primer %s failed: %s", name, e)
+            return name, f"error: {type(e).__name__}"
+        return name, round((time.perf_counter() - started) * 1000, 1)
+
+    with ThreadPoolExecutor(max_workers=max(1, len(primers))) as executor:
+        timings = dict(executor.map(run, primers.items()))
+    logger.info("Primed in ms: %s", timings)
+    return timings
+
+
+def warmable(primers: Primers):
+    """Answer warm-up events by running ``primers`` instead of the handler.
+
+    Primers must be free of side effects: they only open connections and
+    fill read caches. With PRIME_ON_INIT they also run at import time.
+    """
+    if PRIME_ON_INIT:
+        prime(primers)
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            if is_warmup_event(event):
+                return {
+                    "statusCode": 200,
+                    "body": json.dumps({"warmup": True, "primed": prime(primers)}),
+                }
+            return handler(event, context)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,290 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import zlib
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import boto3
+
+# Set up logger
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+s3 = boto3.client("s3")
+
+bucket = os.environ["S3_BUCKET"]
+RAW_LOG_PREFIX = os.environ.get("RAW_LOG_PREFIX", "")
+RAW_LOG_SUFFIX = os.environ.get("RAW_LOG_SUFFIX", ".log")
+COMPACTED_PREFIX = "compacted/"
+DELETE_ORIGINALS = os.environ.get("DELETE_ORIGINALS", "true").lower() == "true"
+# Raw log keys start with the UTC time they were written, e.g. 2024-04-23-01-45-06
+HOUR_FORMAT = "%Y-%m-%d-%H"
+# Give late writes for the previous hour time to land before compacting it
+COMPACTION_DELAY = timedelta(minutes=10)
+# Scheduled runs also sweep this many earlier hours for originals that
+# landed after their hour was compacted, or that failed verification
+LATE_LOG_LOOKBACK_HOURS = int(os.environ.get("LATE_LOG_LOOKBACK_HOURS", "24"))
+# Uncompressed bytes per independently decompressible gzip block
+BLOCK_SIZE = 64 * 1024
+SPOOL_MAX_BYTES = 16 * 1024 * 1024
+NO_GROUP = "no_group"
+
+
+class BlockWriter:
+    """Write NDJSON records as a series of gzip members plus an offset index.
+
+    Concatenated gzip members form a valid gzip file, so the object can be
+    streamed whole, while each block can also be fetched alone with a
+    ranged GET using its offset and length.
+    """
+
+    def __init__(self):
+        self.output = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        self.block = bytearray()
+        self.block_keys: List[str] = []
+        self.block_timestamps: List[int] = []
+        self.blocks: List[dict] = []
+        self.records: Dict[str, int] = {}
+
+    def write(self, key: str, timestamp: int, record: dict) -> None:
+        self.block += (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        self.block_keys.append(key)
+        self.block_timestamps.append(timestamp)
+        if len(self.block) >= BLOCK_SIZE:
+            self._flush_block()
+
+    def _flush_block(self) -> None:
+        if not self.block:
+            return
+        compressor = zlib.compressobj(wbits=31)
+        data = compressor.compress(bytes(self.block)) + compressor.flush()
+        offset = self.output.tell()
+        self.output.write(data)
+        for key in self.block_keys:
+            self.records[key] = len(self.blocks)
+        self.blocks.append(
+            {
+                "offset": offset,
+                "length": len(data),
+                "first_timestamp": min(self.block_timestamps),
+                "last_timestamp": max(self.block_timestamps),
+            }
+        )
+        self.block = bytearray()
+        self.block_keys = []
+        self.block_timestamps = []
+
+    def close(self):
+        self._flush_block()
+        self.output.seek(0)
+        return self.output, {"blocks": self.blocks, "records": self.records}
+
+
+def compacted_keys(group_id: str, hour: datetime, part: int = 0):
+    """Keys of one compacted part; later parts hold originals that came late."""
+    base = f"{COMPACTED_PREFIX}{group_id}/{hour.strftime('%Y/%m/%d/%H')}"
+    if part:
+        base += f".{part}"
+    return f"{base}.ndjson.gz", f"{base}.index.json"
+
+
+def list_raw_logs(hour: datetime) -> Iterator[str]:
+    paginator = s3.get_paginator("list_objects_v2")
+    prefix = RAW_LOG_PREFIX + hour.strftime(HOUR_FORMAT)
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            if obj["Key"].endswith(RAW_LOG_SUFFIX):
+                yield obj["Key"]
+
+
+def read_json(key: str) -> Optional[dict]:
+    try:
+        return json.loads(s3.get_object(Bucket=bucket, Key=key)["Body"].read())
+    except s3.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+
+
+def load_indexes(group_id: str, hour: datetime) -> List[dict]:
+    """Indexes of the hour's completed parts, in part order."""
+    indexes = []
+    while True:
+        index = read_json(compacted_keys(group_id, hour, len(indexes))[1])
+        if index is None:
+            return indexes
+        indexes.append(index)
+
+
+def digest(record: dict) -> str:
+    return hashlib.sha256(
+        json.dumps(record, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def verify_compacted(data_key: str, expected: Dict[str, str]) -> bool:
+    """Re-read the compacted object and check every source log survived intact.
+
+    A block that fails to decompress, or a truncated last block, fails the
+    check instead of raising, so the originals are kept.
+    """
+    body = s3.get_object(Bucket=bucket, Key=data_key)["Body"]
+    decompressor = zlib.decompressobj(wbits=31)
+    in_member = False
+    found = {}
+    pending = b""
+    try:
+        for chunk in body.iter_chunks(chunk_size=BLOCK_SIZE):
+            while chunk:
+                pending += decompressor.decompress(chunk)
+                in_member = True
+                # Start a fresh decompressor at each gzip member boundary
+                chunk = decompressor.unused_data
+                if decompressor.eof:
+                    decompressor = zlib.decompressobj(wbits=31)
+                    in_member = False
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                record = json.loads(line)
+                found[record["key"]] = digest(record["log"])
+    except (zlib.error, ValueError, KeyError) as e:
+        logger.error("Cannot read back %s: %s", data_key, e)
+        return False
+    return not in_member and not pending and found == expected
+
+
+def delete_objects(keys: List[str]) -> None:
+    for start in range(0, len(keys), 1000):
+        s3.delete_objects(
+            Bucket=bucket,
+            Delete={
+                "Objects": [{"Key": key} for key in keys[start : start + 1000]],
+                "Quiet": True,
+            },
+        )
+
+
+def compact_hour(hour: datetime) -> dict:
+    """Roll the raw logs written during ``hour`` into per-group objects.
+
+    Logs are staged on disk as they are read and compacted one group at a
+    time, so only one group's output is spooled at once.
+    """
+    # group -> [(key, timestamp, offset, length)] of the staged logs
+    staged: Dict[str, List[Tuple[str, int, int, int]]] = defaultdict(list)
+    with tempfile.TemporaryFile() as staging:
+        for key in list_raw_logs(hour):
+            body = s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+            log = json.loads(body)
+            events = log.get("events") or [{}]
+            group_id = events[0].get("source", {}).get("groupId") or NO_GROUP
+            timestamp = events[0].get("timestamp", 0)
+            staged[group_id].append((key, timestamp, staging.tell(), len(body)))
+            staging.write(body)
+
+        summary = {
+            group_id: compact_group(group_id, hour, logs, staging)
+            for group_id, logs in staged.items()
+        }
+
+    logger.info("Compacted hour %s: %s", hour.strftime(HOUR_FORMAT), summary)
+    return summary
+
+
+def compact_group(group_id: str, hour: datetime, logs, staging) -> dict:
+    """Write the group's staged logs not yet compacted as the next part."""
+    indexes = load_indexes(group_id, hour)
+    compacted = {key for index in indexes for key in index["records"]}
+    if compacted:
+        # Originals of earlier parts survive if a run stopped before deleting
+        leftover = [key for key, *_ in logs if key in compacted]
+        if leftover and DELETE_ORIGINALS:
+            delete_objects(leftover)
+        logs = [entry for entry in logs if entry[0] not in compacted]
+    if not logs:
+        return {"logs": 0, "verified": True}
+
+    data_key, index_key = compacted_keys(group_id, hour, len(indexes))
+    writer = BlockWriter()
+    digests = {}
+    for key, timestamp, offset, length in logs:
+        staging.seek(offset)
+        log = json.loads(staging.read(length))
+        writer.write(key, timestamp, {"key": key, "log": log})
+        digests[key] = digest(log)
+    data, index = writer.close()
+    with data:
+        s3.upload_fileobj(
+            data,
+            bucket,
+            data_key,
+            ExtraArgs={"ContentType": "application/x-ndjson"},
+        )
+
+    if not verify_compacted(data_key, digests):
+        logger.error("Verification failed for %s, keeping originals", data_key)
+        return {"logs": len(digests), "verified": False}
+
+    # The index is written last; its presence marks a complete compaction
+    index["data_key"] = data_key
+    s3.put_object(
+        Bucket=bucket,
+        Key=index_key,
+        Body=json.dumps(index).encode("utf-8"),
+        ContentType="application/json",
+    )
+    if DELETE_ORIGINALS:
+        delete_objects(list(digests))
+    return {"logs": len(digests), "verified": True}
+
+
+def read_compacted_log(group_id: str, hour: datetime, key: str) -> dict:
+    """Fetch one original log from a compacted hour with a single ranged GET."""
+    for index in load_indexes(group_id, hour):
+        if key not in index["records"]:
+            continue
+        block = index["blocks"][index["records"][key]]
+        byte_range = f"bytes={block['offset']}-{block['offset'] + block['length'] - 1}"
+        data = s3.get_object(Bucket=bucket, Key=index["data_key"], Range=byte_range)[
+            "Body"
+        ].read()
+        for line in zlib.decompress(data, wbits=31).splitlines():
+            record = json.loads(line)
+            if record["key"] == key:
+                return record["log"]
+    raise KeyError(key)
+
+
+def lambda_handler(event, context):
+    logger.info("Lambda function started with event: %s", event)
+
+    # Scheduled runs compact the last full hour; backfills pass {"hour": "..."}
+    if event.get("hour"):
+        hour = datetime.strptime(event["hour"], HOUR_FORMAT).replace(
+            tzinfo=timezone.utc
+        )
+        late_hours = []
+    else:
+        hour = (
+            datetime.now(timezone.utc) - COMPACTION_DELAY - timedelta(hours=1)
+        ).replace(minute=0, second=0, microsecond=0)
+        # Without deletes every original would look late, so only sweep then
+        lookback = LATE_LOG_LOOKBACK_HOURS if DELETE_ORIGINALS else 0
+        late_hours = [hour - timedelta(hours=n) for n in range(1, lookback + 1)]
+
+    summary = compact_hour(hour)
+    late = {}
+    for late_hour in late_hours:
+        groups = compact_hour(late_hour)
+        if groups:
+            late[late_hour.strftime(HOUR_FORMAT)] = groups
+    return {
+        "statusCode": 200,
+        "body": json.dumps(
+            {"hour": hour.strftime(HOUR_FORMAT), "groups": summary, "late": late}
+        ),
+    }
@@ -4,6 +4,12 @@ import os
 
 import boto3
 import requests
+import response_cache
+from capacity import accounted, set_group, track
+from outbound import CircuitOpenError, UpstreamUnavailableError, get_endpoint
+from profiling import profiled
+from response_cache import ALL_SEGMENTS_SCOPE, bump_versions, segments_scope
+from warmup import dynamodb_primer, warmable
 
 # Set up logger
 logger = logging.getLogger()
@@ -15,8 +21,17 @@ API_URL = os.getenv(
     "https://d0e7i3hn2k.execute-api.us-west-2.amazonaws.com/api-gateway-for-intern?",
 )
 
+# Ticket creation is not idempotent, so never retry it
+create_ticket_endpoint = get_endpoint(
+    "create-ticket",
+    API_URL,
+    read_timeout=float(os.getenv("CREATE_TICKET_API_TIMEOUT", "25")),
+    max_retries=0,
+)
+
 # Connect to DynamoDB
 dynamodb = boto3.resource("dynamodb")
+track(dynamodb)
 table = dynamodb.Table("todam_table")
 
 # Set up boto3 client for SSM
@@ -33,10 +48,26 @@ def get_api_key():
 api_key = get_api_key()
 
 
-def api_create_ticket(payload: dict) -> dict:
+def api_create_ticket(payload: dict, deadline_ms: int = None) -> dict:
     """Send a POST request to create a ticket."""
     headers = {"x-api-key": api_key}
-    response = requests.post(API_URL, json=payload, headers=headers)
+    try:
+        response = create_ticket_endpoint.post(
+            json=payload, headers=headers, deadline_ms=deadline_ms
+        )
+    except CircuitOpenError as e:
+        logger.warning("Create ticket API call rejected: %s", e)
+        return {
+            "statusCode": 503,
+            "body": str(e),
+            "retry_after": create_ticket_endpoint.breaker.retry_after(),
+        }
+    except UpstreamUnavailableError as e:
+        logger.warning("Create ticket API call rejected: %s", e)
+        return {"statusCode": 503, "body": str(e), "retry_after": 1}
+    except requests.RequestException as e:
+        logger.error("Error calling create ticket API: %s", e)
+        return {"statusCode": 504, "body": str(e)}
     logger.info("Sent POST request to API with payload: %s", payload)
     try:
         return response.json()
@@ -45,6 +76,16 @@ def api_create_ticket(payload: dict) -> dict:
         return {"statusCode": 500, "body": "Invalid JSON response"}
 
 
+# The API key is already fetched from SSM while the container initialises
+PRIMERS = {
+    "todam_table": dynamodb_primer(table),
+    "cache_version_table": dynamodb_primer(response_cache.version_table),
+}
+
+
+@warmable(PRIMERS)
+@accounted
+@profiled
 def lambda_handler(event, context):
     """Lambda function to handle incoming requests."""
     logger.info("Lambda function started with event: %s", event)
@@ -67,23 +108,37 @@ def lambda_handler(event, context):
         logger.error("Missing segment_id")
         return {"statusCode": 400, "body": "Missing segment_id"}
 
-    result = api_create_ticket(payload=create_ticket_payload)
+    result = api_create_ticket(
+        payload=create_ticket_payload,
+        deadline_ms=context.get_remaining_time_in_millis() if context else None,
+    )
 
     if result.get("statusCode") != 200:
         logger.error("API call failed with response: %s", result)
+        headers = {"Content-Type": "application/json"}
+        if "retry_after" in result:
+            headers["Retry-After"] = str(result["retry_after"])
         return {
             "statusCode": result.get("statusCode"),
             "body": json.dumps(result),
-            "headers": {"Content-Type": "application/json"},
+            "headers": headers,
         }
 
     try:
-        table.update_item(
+        update_response = table.update_item(
             Key={"id": segment_id},
-            UpdateExpression="set is_resolved = :r",
-            ExpressionAttributeValues={":r": True},
+            # Resolved segments leave the indexes /segments reads and wait in
+            # the resolved status partition until they are archived
+            UpdateExpression="set is_resolved = :r, segment_status = :s "
+            "remove group_status",
+            ExpressionAttributeValues={":r": True, ":s": "resolved"},
+            ReturnValues="ALL_NEW",
         )
         logger.info("Successfully updated DynamoDB for segment_id: %s", segment_id)
+        group_id = update_response.get("Attributes", {}).get("group_id")
+        set_group(group_id)
+        if group_id:
+            bump_versions(segments_scope(group_id), ALL_SEGMENTS_SCOPE)
     except boto3.exceptions.Boto3Error as e:
         logger.error("Failed to update DynamoDB", exc_info=True)
         return {"statusCode": 500, "body": "Failed to update DynamoDB", "error": str(e)}
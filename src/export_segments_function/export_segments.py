@@ -0,0 +1,286 @@
+import json
+import logging
+import os
+import time
+import uuid
+import zlib
+
+import boto3
+from boto3.dynamodb.conditions import Attr, Key
+from dynamodb_util import projection_params
+from group_shards import group_index_key, iter_group
+from segment_archive import read_archived_messages, to_json_value
+
+# Set up logger
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+# Connect to AWS services
+dynamodb = boto3.resource("dynamodb")
+table = dynamodb.Table("todam_table")
+s3 = boto3.client("s3")
+lambda_client = boto3.client("lambda")
+
+bucket = os.environ["S3_BUCKET"]
+EXPORT_PREFIX = "exports/"
+EXPORT_URL_EXPIRES_IN = int(os.environ.get("EXPORT_URL_EXPIRES_IN", "3600"))
+SEGMENT_ATTRIBUTES = (
+    "id",
+    "segment_id",
+    "segment_name",
+    "start_timestamp",
+    "end_timestamp",
+    "is_resolved",
+)
+MESSAGE_ATTRIBUTES = (
+    "user_id",
+    "user_type",
+    "message_type",
+    "content",
+    "send_timestamp",
+)
+# S3 parts must be at least 5 MiB except the last one
+PART_SIZE = 8 * 1024 * 1024
+
+
+class GzipMultipartWriter:
+    """Gzip-compress written bytes and upload them to S3 part by part.
+
+    At most one part of compressed data is held in memory, so the export
+    size does not affect the memory footprint.
+    """
+
+    def __init__(self, bucket_name: str, key: str, part_size: int = PART_SIZE):
+        self.bucket_name = bucket_name
+        self.key = key
+        self.part_size = part_size
+        self.compressor = zlib.compressobj(wbits=31)  # 31 selects the gzip container
+        self.buffer = bytearray()
+        self.parts = []
+        self.upload_id = s3.create_multipart_upload(
+            Bucket=bucket_name,
+            Key=key,
+            ContentType="application/x-ndjson",
+        )["UploadId"]
+
+    def write(self, data: bytes) -> None:
+        self.buffer += self.compressor.compress(data)
+        if len(self.buffer) >= self.part_size:
+            self._upload_part()
+
+    def _upload_part(self) -> None:
+        part_number = len(self.parts) + 1
+        response = s3.upload_part(
+            Bucket=self.bucket_name,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=bytes(self.buffer),
+        )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+        self.buffer = bytearray()
+
+    def close(self) -> None:
+        self.buffer += self.compressor.flush()
+        self._upload_part()
+        s3.complete_multipart_upload(
+            Bucket=self.bucket_name,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={"Parts": self.parts},
+        )
+
+    def abort(self) -> None:
+        s3.abort_multipart_upload(
+            Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id
+        )
+
+
+def query_all(**query_params):
+    """Yield every item of a paginated query without materialising the result."""
+    while True:
+        response = table.query(**query_params)
+        yield from response.get("Items", [])
+        if "LastEvaluatedKey" not in response:
+            return
+        query_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def to_ndjson_line(record: dict) -> bytes:
+    return (
+        json.dumps(record, ensure_ascii=False, default=to_json_value) + "\n"
+    ).encode("utf-8")
+
+
+def status_key_for(key: str) -> str:
+    return key[: -len(".ndjson.gz")] + ".status.json"
+
+
+def write_status(key: str, status: str, **details) -> None:
+    """Record the export's state next to it for clients to poll."""
+    s3.put_object(
+        Bucket=bucket,
+        Key=status_key_for(key),
+        Body=json.dumps(
+            {"status": status, "updated_at": int(time.time() * 1000), **details}
+        ),
+        ContentType="application/json",
+    )
+
+
+def iter_segment_messages(group_id: str, segment: dict, segment_end):
+    """Yield a segment's messages from its archive or from the table."""
+    if segment.get("is_resolved"):
+        # Only resolved segments get archived; the index does not project
+        # archive_key, so it is read from the segment item
+        archive_key = (
+            table.get_item(
+                Key={"id": segment["id"]}, **projection_params("archive_key")
+            )
+            .get("Item", {})
+            .get("archive_key")
+        )
+        if archive_key:
+            return iter(read_archived_messages(s3, bucket, archive_key))
+    return iter_group(
+        table,
+        group_id,
+        Key("send_timestamp").between(segment["start_timestamp"], segment_end),
+        FilterExpression=Attr("is_message").eq(True),
+        **projection_params(*MESSAGE_ATTRIBUTES),
+    )
+
+
+def export_segments(group_id: str, start: int, end: int, key: str) -> dict:
+    """Stream every segment started in [start, end] and its messages to ``key``.
+
+    The status object moves to "completed" with the counts once the upload
+    is complete, or to "failed" if the export raised.
+    """
+    segment_count = 0
+    message_count = 0
+    try:
+        writer = GzipMultipartWriter(bucket, key)
+    except Exception as e:
+        write_status(key, "failed", error=str(e))
+        raise
+    try:
+        # Segment items are never sharded, they always live on shard 0
+        index_name, key_condition = group_index_key(group_id)
+        segments = query_all(
+            IndexName=index_name,
+            KeyConditionExpression=key_condition
+            & Key("send_timestamp").between(start, end),
+            FilterExpression=Attr("is_segment").eq(True),
+            **projection_params(*SEGMENT_ATTRIBUTES),
+        )
+        for segment in segments:
+            segment_end = segment.get("end_timestamp", end)
+            writer.write(
+                to_ndjson_line(
+                    {
+                        "type": "segment",
+                        "segment_id": segment["segment_id"],
+                        "segment_name": segment.get("segment_name"),
+                        "group_id": group_id,
+                        "start_timestamp": segment["start_timestamp"],
+                        "end_timestamp": segment.get("end_timestamp"),
+                        "is_resolved": segment.get("is_resolved", False),
+                    }
+                )
+            )
+            segment_count += 1
+
+            messages = iter_segment_messages(group_id, segment, segment_end)
+            for item in messages:
+                writer.write(
+                    to_ndjson_line(
+                        {
+                            "type": "message",
+                            "segment_id": segment["segment_id"],
+                            "user_id": item.get("user_id", "unknown_user_id"),
+                            "user_type": item.get("user_type", "unknown_user_type"),
+                            "message_type": item.get(
+                                "message_type", "unknown_message_type"
+                            ),
+                            "content": item.get("content", ""),
+                            "send_timestamp": item["send_timestamp"],
+                        }
+                    )
+                )
+                message_count += 1
+        writer.close()
+    except Exception as e:
+        logger.error("Export to %s failed, aborting upload", key, exc_info=True)
+        writer.abort()
+        write_status(key, "failed", error=str(e))
+        raise
+
+    logger.info(
+        "Exported %d segments and %d messages to %s",
+        segment_count,
+        message_count,
+        key,
+    )
+    counts = {"segment_count": segment_count, "message_count": message_count}
+    write_status(key, "completed", **counts)
+    return counts
+
+
+def lambda_handler(event, context):
+    logger.info("Lambda function started with event: %s", event)
+
+    # Asynchronous self-invocation that performs the actual export
+    if "export_job" in event:
+        job = event["export_job"]
+        return export_segments(job["group_id"], job["from"], job["to"], job["key"])
+
+    params = event.get("queryStringParameters") or {}
+    group_id = params.get("group_id")
+    if not group_id:
+        logger.error("Missing group_id in query parameters")
+        return {"statusCode": 400, "body": "Missing group_id in query parameters"}
+
+    try:
+        start = int(params.get("from", 0))
+        end = int(params.get("to", 2**63 - 1))
+    except ValueError:
+        logger.error("Invalid time range: %s", params)
+        return {"statusCode": 400, "body": "from and to must be integer timestamps"}
+
+    export_id = uuid.uuid4().hex
+    key = f"{EXPORT_PREFIX}{group_id}/{export_id}.ndjson.gz"
+
+    write_status(key, "running")
+    lambda_client.invoke(
+        FunctionName=context.function_name,
+        InvocationType="Event",
+        Payload=json.dumps(
+            {"export_job": {"group_id": group_id, "from": start, "to": end, "key": key}}
+        ),
+    )
+
+    # The URL becomes valid as soon as the upload is completed, which the
+    # status object reports as "completed" ("failed" if it never will be)
+    url, status_url = (
+        s3.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": bucket, "Key": object_key},
+            ExpiresIn=EXPORT_URL_EXPIRES_IN,
+        )
+        for object_key in (key, status_key_for(key))
+    )
+
+    logger.info("Started export %s for group %s", export_id, group_id)
+    return {
+        "statusCode": 202,
+        "body": json.dumps(
+            {
+                "export_id": export_id,
+                "url": url,
+                "status_url": status_url,
+                "expires_in": EXPORT_URL_EXPIRES_IN,
+            }
+        ),
+        "headers": {"Content-Type": "application/json"},
+    }
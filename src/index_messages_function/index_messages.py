@@ -0,0 +1,82 @@
+import logging
+import os
+
+import boto3
+from boto3.dynamodb.types import TypeDeserializer
+from search_index import DynamoDBIndexStore, SearchIndex
+
+# Set up logger
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+# Connect to DynamoDB
+dynamodb = boto3.resource("dynamodb")
+search_index_table = dynamodb.Table(
+    os.environ.get("SEARCH_INDEX_TABLE", "todam_search_index")
+)
+search_index = SearchIndex(DynamoDBIndexStore(search_index_table))
+
+deserializer = TypeDeserializer()
+
+
+def deserialize(image: dict) -> dict:
+    return {name: deserializer.deserialize(value) for name, value in image.items()}
+
+
+def is_indexable_message(item: dict) -> bool:
+    return bool(item.get("is_message") and item.get("group_id") and item.get("content"))
+
+
+def is_ttl_removal(record: dict) -> bool:
+    """Whether DynamoDB itself deleted the item, i.e. its TTL expired."""
+    identity = record.get("userIdentity") or {}
+    return (
+        record.get("eventName") == "REMOVE"
+        and identity.get("type") == "Service"
+        and identity.get("principalId") == "dynamodb.amazonaws.com"
+    )
+
+
+def apply_record(record: dict) -> None:
+    # Archived messages expire from the table but stay searchable
+    if is_ttl_removal(record):
+        return
+
+    old = deserialize(record["dynamodb"].get("OldImage", {}))
+    new = deserialize(record["dynamodb"].get("NewImage", {}))
+
+    if new.get("is_segment") and new.get("group_id"):
+        search_index.index_segment(
+            new["group_id"],
+            new["segment_id"],
+            new["start_timestamp"],
+            new.get("end_timestamp"),
+        )
+
+    # Parsed image text arrives as a MODIFY that fills in the content
+    if old.get("content") == new.get("content") and (
+        is_indexable_message(old) == is_indexable_message(new)
+    ):
+        return
+    if is_indexable_message(old):
+        search_index.unindex_message(old["group_id"], old["id"], old["content"])
+    if is_indexable_message(new):
+        search_index.index_message(
+            new["group_id"], new["id"], new["send_timestamp"], new["content"]
+        )
+
+
+def lambda_handler(event, context):
+    records = event.get("Records", [])
+    logger.info("Indexing %d stream records", len(records))
+
+    failures = []
+    for record in records:
+        try:
+            apply_record(record)
+        except Exception as e:
+            logger.error("Error indexing record %s: %s", record.get("eventID"), e)
+            failures.append({"itemIdentifier": record["dynamodb"]["SequenceNumber"]})
+
+    # Only the failed records are retried (ReportBatchItemFailures)
+    return {"batchItemFailures": failures}
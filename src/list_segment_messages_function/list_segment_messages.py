@@ -1,101 +1,269 @@
 import json
 import logging
-from typing import List
+import os
+import time
+from typing import List, Optional, Tuple
 
 import boto3
+import group_shards
+import message_blocks
+import response_cache
 from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+from capacity import accounted, set_group, track
+from dynamodb_util import projection_params
+from group_shards import query_group
+from profiling import profiled
+from response_cache import messages_scope, segments_scope, serve_cached
+from segment_archive import read_archived_messages
+from transcript import condense_messages
+from warmup import dynamodb_primer, s3_primer, warmable
 
 # Set up logger
 logger = logging.getLogger()
 logger.setLevel("INFO")
 
-# Connect to DynamoDB
+# Connect to AWS services
 dynamodb = boto3.resource("dynamodb")
+track(dynamodb)
 table = dynamodb.Table("todam_table")
+s3 = boto3.client("s3")
 
+bucket = os.environ.get("S3_BUCKET")
+SEGMENT_ATTRIBUTES = (
+    "group_id",
+    "start_timestamp",
+    "end_timestamp",
+    "is_end",
+    "archive_key",
+    *message_blocks.SEGMENT_BLOCK_ATTRIBUTES,
+)
+MESSAGE_ATTRIBUTES = (
+    "id",
+    "user_id",
+    "user_type",
+    "message_type",
+    "content",
+    "send_timestamp",
+)
 
-def format_and_condense_messages(messages: List[dict]) -> str:
-    formatted_messages = [
-        f'{message["user_type"]}: {message["content"]}' for message in messages
-    ]
-    return "\\n".join(formatted_messages)
+# Messages can be ingested this long after their send time, e.g. by a
+# retried ingest batch, so cursors never move past now minus this window
+CURSOR_SETTLE_MS = int(os.environ.get("CURSOR_SETTLE_MS", "60000"))
+# Sorts after every message id, so a bare timestamp cursor skips its millisecond
+LAST_ID = "\uffff"
 
 
-def lambda_handler(event, context):
-    logger.info("Lambda function started with event: %s", event)
+def parse_cursor(cursor: str) -> Tuple[int, str]:
+    """Parse a ``<send_timestamp>:<id>`` cursor, or a bare timestamp."""
+    timestamp, _, message_id = cursor.partition(":")
+    return int(timestamp), message_id if _ else LAST_ID
+
+
+def format_cursor(key: Tuple[int, str]) -> str:
+    timestamp, message_id = key
+    return str(timestamp) if message_id == LAST_ID else f"{timestamp}:{message_id}"
+
+
+def message_key(item: dict) -> Tuple[int, str]:
+    return int(item["send_timestamp"]), item.get("id", "")
+
+
+def format_and_condense_messages(
+    messages: List[dict], token_budget: Optional[int] = None
+) -> Tuple[str, dict]:
+    text, stats = condense_messages(messages, token_budget)
+    logger.info("Condensed transcript: %s", stats)
+    return text, stats
+
 
+def load_archived_messages(archive_key: str, start_timestamp: int) -> dict:
+    """Read an archived segment from S3 as a query-shaped response."""
+    return {
+        "Items": [
+            message
+            for message in read_archived_messages(s3, bucket, archive_key)
+            if message["send_timestamp"] >= start_timestamp
+        ]
+    }
+
+
+def build_segment_messages(event) -> Tuple[dict, Optional[List[str]]]:
+    """Build the uncached response and the cache scopes it depends on."""
     # Extract segment_id from query parameters
     segment_id = event["queryStringParameters"].get("segment_id")
     output_format = event["queryStringParameters"].get(
         "output"
     )  # Get the 'output' query parameter
 
+    # Optional delta-sync cursor: only messages after it are returned
+    since = event["queryStringParameters"].get("since")
+
     if not segment_id:
         logger.error("Missing segment_id in query parameters")
-        return {"statusCode": 400, "body": "Missing segment_id in query parameters"}
+        return {
+            "statusCode": 400,
+            "body": "Missing segment_id in query parameters",
+        }, None
+
+    if since is not None:
+        try:
+            since = parse_cursor(since)
+        except ValueError:
+            logger.error("Invalid since cursor: %s", since)
+            return {
+                "statusCode": 400,
+                "body": "since must be a cursor returned as next_cursor",
+            }, None
+
+    # output=text is only condensed when the caller asks for a token budget
+    token_budget = event["queryStringParameters"].get("max_tokens")
+    if token_budget is not None:
+        try:
+            token_budget = int(token_budget)
+        except ValueError:
+            token_budget = 0
+        if token_budget < 1:
+            logger.error("Invalid max_tokens: %s", event["queryStringParameters"])
+            return {
+                "statusCode": 400,
+                "body": "max_tokens must be a positive integer",
+            }, None
 
     # Retrieve the segment details from DynamoDB
     try:
-        segment_response = table.get_item(Key={"id": segment_id})
+        segment_response = table.get_item(
+            Key={"id": segment_id}, **projection_params(*SEGMENT_ATTRIBUTES)
+        )
         segment = segment_response.get("Item", {})
-        if not segment or not segment.get("is_end") or not segment.get("end_timestamp"):
+        is_complete = bool(segment.get("is_end") and segment.get("end_timestamp"))
+        # Open segments can only be followed incrementally through the cursor
+        if not segment or (not is_complete and since is None):
             logger.error(
                 "Segment not found or incomplete for segment_id: %s", segment_id
             )
-            return {"statusCode": 404, "body": "Segment not found or incomplete"}
+            return {"statusCode": 404, "body": "Segment not found or incomplete"}, None
     except boto3.exceptions.Boto3Error as e:
         logger.error("Error retrieving segment from DynamoDB: %s", e)
-        return {"statusCode": 500, "body": "Error retrieving segment from DynamoDB"}
+        return {
+            "statusCode": 500,
+            "body": "Error retrieving segment from DynamoDB",
+        }, None
+
+    set_group(segment["group_id"])
 
     # Query the messages using the timestamps and group_id
+    start_timestamp = int(segment["start_timestamp"])
+    if since is not None:
+        # Resume inclusively: other messages may share the cursor's millisecond
+        start_timestamp = max(start_timestamp, since[0])
+
+    if is_complete:
+        time_condition = Key("send_timestamp").between(
+            start_timestamp, segment["end_timestamp"]
+        )
+    else:
+        time_condition = Key("send_timestamp").gte(start_timestamp)
+
     message_query_params = {
-        "IndexName": "GroupTimeIndex",
-        "KeyConditionExpression": Key("group_id").eq(segment["group_id"])
-        & Key("send_timestamp").between(
-            segment["start_timestamp"], segment["end_timestamp"]
-        ),
         "FilterExpression": Attr("is_message").eq(
             True
         ),  # Filtering for is_message == True
+        **projection_params(*MESSAGE_ATTRIBUTES),
     }
 
     try:
-        # Execute the query on GSI
-        response = table.query(**message_query_params)
-    except boto3.exceptions.Boto3Error as e:
+        if is_complete and start_timestamp > segment["end_timestamp"]:
+            # The cursor is past the end, there is nothing left to read
+            response = {"Items": []}
+        elif segment.get("archive_key"):
+            # Messages of old resolved segments have been tiered out to S3
+            response = load_archived_messages(segment["archive_key"], start_timestamp)
+        elif "block_count" in segment:
+            # Sealed blocks plus the item query of the unpacked tail
+            response = message_blocks.read_segment_messages(
+                dynamodb,
+                table,
+                segment_id,
+                segment,
+                start_timestamp,
+                segment["end_timestamp"] if is_complete else None,
+            )
+        else:
+            # Execute the query on every GSI shard of the group
+            response = query_group(
+                table, segment["group_id"], time_condition, **message_query_params
+            )
+    except (boto3.exceptions.Boto3Error, ClientError) as e:
         logger.error("Error querying messages from DynamoDB: %s", e)
-        return {"statusCode": 500, "body": "Error querying messages from DynamoDB"}
+        return {
+            "statusCode": 500,
+            "body": "Error querying messages from DynamoDB",
+        }, None
+
+    scopes = [messages_scope(segment["group_id"]), segments_scope(segment["group_id"])]
+
+    items = response.get("Items", [])
+    next_cursor = None
+    if since is not None:
+        items = sorted(
+            (item for item in items if message_key(item) > since), key=message_key
+        )
+        next_key = message_key(items[-1]) if items else since
+        if "LastEvaluatedKey" in response:
+            # The page ended early; resume at the millisecond it was cut at
+            next_key = (int(response["LastEvaluatedKey"]["send_timestamp"]), "")
+        # Stay behind the ingest settle window so late messages are not
+        # skipped; the messages after it are returned again by the next call
+        settled = (int(time.time() * 1000) - CURSOR_SETTLE_MS, "")
+        next_cursor = format_cursor(max(since, min(next_key, settled)))
+    elif "LastEvaluatedKey" in response:
+        # The page ended early; the rest is read by passing this as since
+        cutoff = int(response["LastEvaluatedKey"]["send_timestamp"])
+        next_cursor = format_cursor((cutoff, ""))
 
     # Process the response to format it as required
     messages = [
         {
+            "id": item.get("id"),
             "user_id": item.get("user_id", "unknown_user_id"),
             "user_type": item.get("user_type", "unknown_user_type"),
             "message_type": item.get("message_type", "unknown_message_type"),
             "content": item.get("content", ""),
             "send_timestamp": int(item["send_timestamp"]),
         }
-        for item in response.get("Items", [])
+        for item in items
     ]
 
     if output_format == "text":
         # If output format is 'text', use the format_and_condense_messages function
-        formatted_text = format_and_condense_messages(messages)
+        formatted_text, stats = format_and_condense_messages(messages, token_budget)
         logger.info("Returning text format response")
+        headers = {
+            "Content-Type": "text/plain",
+            "X-Original-Tokens": str(stats["original_tokens"]),
+            "X-Condensed-Tokens": str(stats["condensed_tokens"]),
+            "X-Shrink-Ratio": str(stats["shrink_ratio"]),
+        }
+        if next_cursor is not None:
+            headers["X-Next-Cursor"] = str(next_cursor)
         return {
             "statusCode": 200,
             "body": formatted_text,
-            "headers": {"Content-Type": "text/plain"},
-        }
+            "headers": headers,
+        }, scopes
     else:
         # Create the response body for standard JSON output
         result = {
             "group_id": segment["group_id"],
             "segment_id": segment_id,
             "start_timestamp": int(segment["start_timestamp"]),
-            "end_timestamp": int(segment["end_timestamp"]),
+            "end_timestamp": (int(segment["end_timestamp"]) if is_complete else None),
             "messages": messages,
         }
+        if next_cursor is not None:
+            result["is_end"] = is_complete
+            result["next_cursor"] = next_cursor
 
         # Return the formatted response
         logger.info("Returning JSON format response")
@@ -103,4 +271,26 @@ def lambda_handler(event, context):
             "statusCode": 200,
             "body": json.dumps(result),
             "headers": {"Content-Type": "application/json"},
-        }
+        }, scopes
+
+
+PRIMERS = {
+    "todam_table": dynamodb_primer(table),
+    "s3": s3_primer(s3, bucket),
+    "cache_version_table": dynamodb_primer(response_cache.version_table),
+    "group_shard_table": dynamodb_primer(group_shards.group_shard_table),
+}
+
+
+@warmable(PRIMERS)
+@accounted
+@profiled
+def lambda_handler(event, context):
+    logger.info("Lambda function started with event: %s", event)
+
+    params = event.get("queryStringParameters") or {}
+    cache_key = "messages?" + "&".join(
+        f"{name}={params.get(name)}"
+        for name in ("segment_id", "output", "since", "max_tokens")
+    )
+    return serve_cached(event, cache_key, lambda: build_segment_messages(event))
@@ -0,0 +1,146 @@
+import math
+import re
+from typing import Dict, List, Optional, Tuple
+
+from text_util import CJK_PATTERN
+
+# Turns are separated by a literal backslash-n, as downstream prompts expect
+TURN_SEPARATOR = "\\n"
+# Consecutive messages of one speaker are joined into a single turn
+MESSAGE_SEPARATOR = " / "
+OMISSION_MARKER = "[... {count} turns omitted ...]"
+ELLIPSIS = "…"
+# Share of the budget kept for the opening turns; the rest goes to the latest
+HEAD_BUDGET_SHARE = 0.25
+# Sticker contents that only mark recording boundaries
+RECORDING_MARKERS = {"start recording", "end recording"}
+
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough LLM token count: one per CJK character, one per 4 other chars."""
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    if estimate_tokens(text) <= budget:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if estimate_tokens(text[:middle] + ELLIPSIS) <= budget:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low] + ELLIPSIS if low else ""
+
+
+def message_text(message: dict) -> str:
+    """The condensed text of one message, or "" when it carries nothing."""
+    content = WHITESPACE_PATTERN.sub(" ", message.get("content") or "").strip()
+    if message.get("message_type") == "sticker" or content in RECORDING_MARKERS:
+        return ""
+    if message.get("message_type") == "image":
+        return f"[image] {content}" if content else ""
+    return content
+
+
+def build_turns(messages: List[dict]) -> List[str]:
+    """Merge consecutive messages per speaker, dropping noise.
+
+    A message repeated within one turn, e.g. a resent question, is kept
+    once with a repeat count.
+    """
+    turns: List[Tuple[str, Dict[str, int]]] = []
+    for message in messages:
+        text = message_text(message)
+        if not text:
+            continue
+        speaker = message.get("user_type", "unknown_user_type")
+        if not turns or turns[-1][0] != speaker:
+            turns.append((speaker, {}))
+        texts = turns[-1][1]
+        texts[text] = texts.get(text, 0) + 1
+    return [
+        f"{speaker}: "
+        + MESSAGE_SEPARATOR.join(
+            text if count == 1 else f"{text} (x{count})"
+            for text, count in texts.items()
+        )
+        for speaker, texts in turns
+    ]
+
+
+def fit_turns(turns: List[str], budget: int) -> List[str]:
+    """Keep the opening turns and the most recent ones within ``budget`` tokens.
+
+    The opening usually states the problem and the end holds its latest
+    state, so turns are dropped from the middle and replaced with a marker.
+    """
+    costs = [estimate_tokens(turn + TURN_SEPARATOR) for turn in turns]
+    if sum(costs) <= budget:
+        return turns
+
+    remaining = budget - estimate_tokens(
+        OMISSION_MARKER.format(count=len(turns)) + TURN_SEPARATOR
+    )
+    head: List[str] = []
+    head_budget = int(remaining * HEAD_BUDGET_SHARE)
+    while len(head) < len(turns) and costs[len(head)] <= head_budget:
+        head_budget -= costs[len(head)]
+        remaining -= costs[len(head)]
+        head.append(turns[len(head)])
+    if not head and turns:
+        # A long opening turn is cut rather than lost
+        head.append(truncate_to_tokens(turns[0], head_budget))
+        remaining -= estimate_tokens(head[0] + TURN_SEPARATOR)
+
+    tail: List[str] = []
+    index = len(turns) - 1
+    while index >= len(head) and costs[index] <= remaining:
+        remaining -= costs[index]
+        tail.insert(0, turns[index])
+        index -= 1
+    if not tail and index >= len(head) and remaining > 0:
+        tail.insert(0, truncate_to_tokens(turns[index], remaining))
+        index -= 1
+
+    # Turns truncated to nothing are omitted as well
+    head = [turn for turn in head if turn]
+    tail = [turn for turn in tail if turn]
+    omitted = len(turns) - len(head) - len(tail)
+    marker = [OMISSION_MARKER.format(count=omitted)] if omitted else []
+    return head + marker + tail
+
+
+def condense_messages(
+    messages: List[dict], token_budget: Optional[int] = None
+) -> Tuple[str, dict]:
+    """Render messages as a compact transcript for LLM summarisation.
+
+    Returns the text and statistics comparing it with the plain rendering
+    of every message.
+    """
+    original = TURN_SEPARATOR.join(
+        f'{message.get("user_type")}: {message.get("content", "")}'
+        for message in messages
+    )
+    turns = build_turns(messages)
+    if token_budget:
+        turns = fit_turns(turns, token_budget)
+    text = TURN_SEPARATOR.join(turns)
+
+    stats = {
+        "original_chars": len(original),
+        "condensed_chars": len(text),
+        "original_tokens": estimate_tokens(original),
+        "condensed_tokens": estimate_tokens(text),
+    }
+    stats["shrink_ratio"] = (
+        round(1 - stats["condensed_chars"] / stats["original_chars"], 3)
+        if original
+        else 0.0
+    )
+    return text, stats
@@ -1,8 +1,20 @@
+import base64
+import heapq
 import json
 import logging
+import os
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
 
 import boto3
-from boto3.dynamodb.conditions import And, Attr
+import response_cache
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+from capacity import ALL_GROUPS, accounted, set_group, track
+from dynamodb_util import group_status_key, projection_params
+from profiling import profiled
+from response_cache import ALL_SEGMENTS_SCOPE, segments_scope, serve_cached
+from warmup import dynamodb_primer, warmable
 
 # Set up logger
 logger = logging.getLogger()
@@ -10,42 +22,289 @@ logger.setLevel("INFO")
 
 # Connect to DynamoDB
 dynamodb = boto3.resource("dynamodb")
+track(dynamodb)
 table = dynamodb.Table("todam_table")
 
+# Sparse index of segments, partitioned by segment_status and sorted by
+# start_timestamp; resolved segments sit in their own partition
+SEGMENT_STATUS_INDEX = "SegmentStatusStartIndex"
+# Sparse index of unresolved segments, partitioned by group_status and sorted
+# by start_timestamp, so a group's listing reads only its own segments
+SEGMENT_GROUP_INDEX = "SegmentGroupStatusIndex"
+# Each index is read once it is ACTIVE and backfill_segment_status has
+# given every older segment its keys. Until then group listings filter the
+# status index, and without that the table is scanned
+STATUS_READS_ENABLED = os.environ.get("SEGMENT_STATUS_READS_ENABLED", "false") == "true"
+GROUP_READS_ENABLED = os.environ.get("SEGMENT_GROUP_READS_ENABLED", "false") == "true"
+STATUSES = ("open", "ended")
+ORDERS = ("asc", "desc")
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+SEGMENT_ATTRIBUTES = (
+    "id",
+    "segment_id",
+    "segment_name",
+    "group_id",
+    "segment_status",
+    "start_timestamp",
+    "end_timestamp",
+)
 
-def lambda_handler(event, context):
-    logger.info("Lambda function started with event: %s", event)
 
-    # Always filter out segments that are not resolved
-    base_filter = Attr("is_segment").eq(True) & (
-        Attr("is_resolved").eq(False) | Attr("is_resolved").not_exists()
+def encode_cursor(cursor: dict) -> str:
+    data = json.dumps(
+        cursor,
+        separators=(",", ":"),
+        default=lambda value: int(value) if isinstance(value, Decimal) else value,
     )
+    return base64.urlsafe_b64encode(data.encode("utf-8")).decode("ascii")
 
-    # Check if query string parameters are present and contain group_id
-    group_id = (
-        event.get("queryStringParameters", {}).get("group_id")
-        if event.get("queryStringParameters")
-        else None
-    )
 
-    # Construct filter expression based on group_id presence
-    if group_id:
-        filter_expression = And(base_filter, Attr("group_id").eq(group_id))
-        logger.info("Filter expression constructed with group_id: %s", group_id)
-    else:
-        filter_expression = base_filter
-        logger.info("Filter expression constructed without group_id")
+def decode_cursor(token: str) -> dict:
+    """Decode a ``{"status": ..., "after": {status: key}}`` next_token."""
+    cursor = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+    if (
+        not isinstance(cursor, dict)
+        or cursor.get("status") not in STATUSES + ("all",)
+        or not isinstance(cursor.get("after"), dict)
+        or not set(cursor["after"]) <= set(STATUSES)
+    ):
+        raise ValueError("Invalid next_token")
+    return cursor
+
+
+def read_path(query: dict) -> Tuple[Optional[str], str]:
+    """Return the index a query reads, None for a scan, and its hash key."""
+    if query["group_id"] and GROUP_READS_ENABLED:
+        return SEGMENT_GROUP_INDEX, "group_status"
+    return (SEGMENT_STATUS_INDEX if STATUS_READS_ENABLED else None), "segment_status"
+
+
+def partition_value(status: str, query: dict) -> str:
+    _, hash_key = read_path(query)
+    if hash_key == "group_status":
+        return group_status_key(query["group_id"], status)
+    return status
+
+
+def index_key(status: str, item: dict, query: dict) -> dict:
+    """The key of ``item`` in the index the query reads, to resume after it."""
+    _, hash_key = read_path(query)
+    return {
+        "id": item["id"],
+        hash_key: partition_value(status, query),
+        "start_timestamp": item["start_timestamp"],
+    }
+
 
-    # Prepare the scan parameters with the constructed filter expression
-    scan_params = {"FilterExpression": filter_expression}
+def is_resume_key(status: str, key, query: dict) -> bool:
+    """Whether ``key`` is a key this query can resume ``status`` after."""
+    if not isinstance(key, dict) or not isinstance(key.get("id"), str):
+        return False
+    start_timestamp = key.get("start_timestamp")
+    if type(start_timestamp) is not int:
+        return False
+    if query["start"] is not None and start_timestamp < query["start"]:
+        return False
+    if query["end"] is not None and start_timestamp > query["end"]:
+        return False
+    return key == index_key(status, key, query)
 
+
+def parse_params(params: dict) -> Tuple[Optional[dict], Optional[str]]:
+    """Validate the query parameters, returning them or an error message."""
+    try:
+        start = int(params["from"]) if params.get("from") else None
+        end = int(params["to"]) if params.get("to") else None
+    except ValueError:
+        return None, "from and to must be integer timestamps in milliseconds"
+    if start is not None and end is not None and start > end:
+        return None, "from must not be after to"
     try:
-        # Execute the scan on the table
+        limit = int(params.get("limit") or DEFAULT_LIMIT)
+    except ValueError:
+        return None, "limit must be an integer"
+    if not 1 <= limit <= MAX_LIMIT:
+        return None, f"limit must be between 1 and {MAX_LIMIT}"
+
+    status = params.get("status") or "all"
+    if status not in STATUSES + ("all",):
+        return None, "status must be open, ended or all"
+    order = params.get("order") or "desc"
+    if order not in ORDERS:
+        return None, "order must be asc or desc"
+
+    if params.get("next_token"):
+        try:
+            token = decode_cursor(params["next_token"])
+        except ValueError:
+            return None, "Invalid next_token"
+        # A token only resumes the status listing it was returned for
+        if token["status"] != status:
+            return None, "next_token was returned for another status"
+        cursor = token["after"]
+    else:
+        cursor = {s: None for s in (STATUSES if status == "all" else (status,))}
+    query = {
+        "group_id": params.get("group_id"),
+        "status": status,
+        "start": start,
+        "end": end,
+        "limit": limit,
+        "order": order,
+        "cursor": cursor,
+    }
+    # Keys of another index, group or time range would fail the query
+    if not all(
+        key is None or is_resume_key(status, key, query)
+        for status, key in cursor.items()
+    ):
+        return None, "Invalid next_token"
+    return query, None
+
+
+def query_status(status: str, query: dict, exclusive_start_key) -> Tuple[list, bool]:
+    """Read up to ``limit`` segments of one status after the cursor.
+
+    Returns them in the requested order and whether the status has more.
+    """
+    index_name, hash_key = read_path(query)
+    start, end = query["start"], query["end"]
+    key_condition = Key(hash_key).eq(partition_value(status, query))
+    if start is not None and end is not None:
+        key_condition &= Key("start_timestamp").between(start, end)
+    elif start is not None:
+        key_condition &= Key("start_timestamp").gte(start)
+    elif end is not None:
+        key_condition &= Key("start_timestamp").lte(end)
+
+    filter_expression = Attr("is_resolved").ne(True)
+    if query["group_id"] and hash_key != "group_status":
+        # Only while SegmentGroupStatusIndex is not serving yet
+        filter_expression &= Attr("group_id").eq(query["group_id"])
+
+    query_params = {
+        "IndexName": index_name,
+        "KeyConditionExpression": key_condition,
+        "FilterExpression": filter_expression,
+        "ScanIndexForward": query["order"] == "asc",
+        "Limit": query["limit"],
+        **projection_params(*SEGMENT_ATTRIBUTES),
+    }
+    if exclusive_start_key:
+        query_params["ExclusiveStartKey"] = exclusive_start_key
+
+    items = []
+    while True:
+        response = table.query(**query_params)
+        items.extend(response.get("Items", []))
+        if "LastEvaluatedKey" not in response:
+            return items, False
+        if len(items) >= query["limit"]:
+            return items, True
+        query_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def scan_statuses(query: dict) -> Dict[str, Tuple[list, bool]]:
+    """Read the segments of every status in the cursor with one table scan.
+
+    Serves /segments until SegmentStatusStartIndex is serving, in the order
+    and with the resume keys the index would give.
+    """
+    statuses = list(query["cursor"])
+    filter_expression = Attr("is_segment").eq(True) & (
+        Attr("is_resolved").eq(False) | Attr("is_resolved").not_exists()
+    )
+    if len(statuses) == 1:
+        filter_expression &= Attr("is_end").eq(statuses[0] == "ended")
+    if query["group_id"]:
+        filter_expression &= Attr("group_id").eq(query["group_id"])
+    if query["start"] is not None:
+        filter_expression &= Attr("start_timestamp").gte(query["start"])
+    if query["end"] is not None:
+        filter_expression &= Attr("start_timestamp").lte(query["end"])
+
+    scan_params = {
+        "FilterExpression": filter_expression,
+        **projection_params(*SEGMENT_ATTRIBUTES, "is_end"),
+    }
+    by_status: Dict[str, list] = {status: [] for status in statuses}
+    while True:
         response = table.scan(**scan_params)
-        logger.info("DynamoDB scan response: %s", response)
+        for item in response.get("Items", []):
+            # Segments written before segment_status existed lack it
+            item["segment_status"] = "ended" if item.get("is_end") else "open"
+            if item["segment_status"] in by_status:
+                by_status[item["segment_status"]].append(item)
+        if "LastEvaluatedKey" not in response:
+            break
+        scan_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def position(item: dict) -> tuple:
+        return item["start_timestamp"], item["id"]
+
+    descending = query["order"] == "desc"
+    results = {}
+    for status, items in by_status.items():
+        items.sort(key=position, reverse=descending)
+        exclusive_start_key = query["cursor"][status]
+        if exclusive_start_key:
+            marker = position(exclusive_start_key)
+            items = [
+                item
+                for item in items
+                if (position(item) < marker if descending else position(item) > marker)
+            ]
+        results[status] = items[: query["limit"]], len(items) > query["limit"]
+    return results
+
+
+def build_segments(event_params: dict):
+    """Build the uncached response and the cache scopes it depends on."""
+    query, error = parse_params(event_params)
+    if error:
+        logger.error("Invalid query parameters: %s", error)
+        return {"statusCode": 400, "body": error}, None
+    group_id = query["group_id"]
+
+    try:
+        if read_path(query)[0] is None:
+            results = scan_statuses(query)
+        else:
+            results = {
+                status: query_status(status, query, exclusive_start_key)
+                for status, exclusive_start_key in query["cursor"].items()
+            }
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ValidationException" and any(
+            query["cursor"].values()
+        ):
+            logger.error("next_token rejected by DynamoDB: %s", e)
+            return {"statusCode": 400, "body": "Invalid next_token"}, None
+        logger.error("Error querying DynamoDB index: %s", e)
+        return {"statusCode": 500, "body": "Error querying DynamoDB index"}, None
     except boto3.exceptions.Boto3Error as e:
-        logger.error("Error scanning DynamoDB table: %s", e)
-        return {"statusCode": 500, "body": "Error scanning DynamoDB table"}
+        logger.error("Error querying DynamoDB index: %s", e)
+        return {"statusCode": 500, "body": "Error querying DynamoDB index"}, None
+
+    # Each status is already sorted, so merge them and keep the first page
+    descending = query["order"] == "desc"
+    merged = heapq.merge(
+        *(items for items, _ in results.values()),
+        key=lambda item: item["start_timestamp"],
+        reverse=descending,
+    )
+    page: List[dict] = [item for _, item in zip(range(query["limit"]), merged)]
+
+    # Resume every status after the last segment of it on this page
+    next_cursor = {}
+    for status, (items, has_more) in results.items():
+        returned = [item for item in page if item["segment_status"] == status]
+        if returned:
+            if has_more or len(returned) < len(items):
+                next_cursor[status] = index_key(status, returned[-1], query)
+        elif items or has_more:
+            next_cursor[status] = query["cursor"][status]
 
     # Process the response to format it as required
     segments = [
@@ -55,19 +314,53 @@ def lambda_handler(event, context):
             ),  # Default to "Unknown" if not found
             "segment_name": item.get("segment_name", "Unnamed"),  # Default to "Unnamed"
             "group_id": item.get("group_id", "No Group"),  # Default to "No Group"
+            "status": item["segment_status"],
+            "start_timestamp": int(item["start_timestamp"]),
+            "end_timestamp": (
+                int(item["end_timestamp"]) if item.get("end_timestamp") else None
+            ),
         }
-        for item in response.get("Items", [])
+        for item in page
     ]
 
     # Create the response body
     result = {
         "segments": segments,
+        "next_token": (
+            encode_cursor({"status": query["status"], "after": next_cursor})
+            if next_cursor
+            else None
+        ),
     }
 
     # Return the formatted response
     logger.info("Lambda function completed successfully")
+    scopes = [segments_scope(group_id) if group_id else ALL_SEGMENTS_SCOPE]
     return {
         "statusCode": 200,
         "body": json.dumps(result),
         "headers": {"Content-Type": "application/json"},
-    }
+    }, scopes
+
+
+PRIMERS = {
+    "todam_table": dynamodb_primer(table),
+    "cache_version_table": dynamodb_primer(response_cache.version_table),
+}
+
+
+@warmable(PRIMERS)
+@accounted
+@profiled
+def lambda_handler(event, context):
+    logger.info("Lambda function started with event: %s", event)
+
+    # group_id, from, to, status, order, limit and next_token are optional
+    params = event.get("queryStringParameters") or {}
+    set_group(params.get("group_id") or ALL_GROUPS)
+
+    cache_key = "segments?" + "&".join(
+        f"{name}={params.get(name)}"
+        for name in ("group_id", "from", "to", "status", "order", "limit", "next_token")
+    )
+    return serve_cached(event, cache_key, lambda: build_segments(params))
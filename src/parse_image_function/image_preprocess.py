@@ -0,0 +1,120 @@
+import io
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+import boto3
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it the original is parsed
+    Image = None
+
+# Set up logger
+logger = logging.getLogger(__name__)
+logger.setLevel("INFO")
+
+s3 = boto3.client("s3")
+
+IMAGE_PREPROCESS_ENABLED = (
+    os.environ.get("IMAGE_PREPROCESS_ENABLED", "false").lower() == "true"
+)
+IMAGE_MAX_DIMENSION = int(os.environ.get("IMAGE_MAX_DIMENSION", "1568"))
+IMAGE_OUTPUT_FORMAT = os.environ.get("IMAGE_OUTPUT_FORMAT", "JPEG").upper()
+IMAGE_OUTPUT_QUALITY = int(os.environ.get("IMAGE_OUTPUT_QUALITY", "85"))
+# Originals below this size in a format the parse API accepts are sent as-is
+IMAGE_PREPROCESS_MIN_BYTES = int(
+    os.environ.get("IMAGE_PREPROCESS_MIN_BYTES", str(512 * 1024))
+)
+# Spool downloads to disk past this size so memory stays bounded
+SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+DERIVATIVE_MARKER = ".derivative"
+PASSTHROUGH_EXTENSIONS = {".png", ".jpg", ".jpeg"}
+OUTPUT_EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}
+CONTENT_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+
+def is_derivative_key(key: str) -> bool:
+    return Path(key).stem.endswith(DERIVATIVE_MARKER)
+
+
+def derivative_key_for(key: str) -> str:
+    path = Path(key)
+    extension = OUTPUT_EXTENSIONS.get(IMAGE_OUTPUT_FORMAT, ".jpg")
+    return str(path.with_name(f"{path.stem}{DERIVATIVE_MARKER}{extension}"))
+
+
+def downsample_image(source, max_dimension: int) -> bytes:
+    """Decode ``source``, shrink it to fit ``max_dimension`` and re-encode it."""
+    with Image.open(source) as image:
+        # Lets the JPEG decoder skip detail we would throw away anyway
+        image.draft("RGB", (max_dimension, max_dimension))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+
+        if IMAGE_OUTPUT_FORMAT == "JPEG" and image.mode != "RGB":
+            # JPEG has no alpha channel; flatten onto white like chat clients do
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            rgba = image.convert("RGBA")
+            background.paste(rgba, mask=rgba.split()[-1])
+            image = background
+
+        output = io.BytesIO()
+        image.save(
+            output,
+            format=IMAGE_OUTPUT_FORMAT,
+            quality=IMAGE_OUTPUT_QUALITY,
+            optimize=True,
+        )
+        return output.getvalue()
+
+
+def prepare_image_for_parsing(bucket: str, key: str) -> str:
+    """Return the S3 key the parse API should read for ``key``.
+
+    When pre-processing is enabled, a right-sized derivative is written next
+    to the original and its key is returned. Any failure falls back to the
+    original key so parsing is never blocked by this stage.
+    """
+    if not IMAGE_PREPROCESS_ENABLED or Image is None or is_derivative_key(key):
+        return key
+
+    try:
+        head = s3.head_object(Bucket=bucket, Key=key)
+        original_size = head["ContentLength"]
+        extension = Path(key).suffix.lower()
+        if (
+            extension in PASSTHROUGH_EXTENSIONS
+            and original_size < IMAGE_PREPROCESS_MIN_BYTES
+        ):
+            logger.info("Image %s is small enough, skipping pre-processing", key)
+            return key
+
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES) as spool:
+            s3.download_fileobj(bucket, key, spool)
+            spool.seek(0)
+            derivative = downsample_image(spool, IMAGE_MAX_DIMENSION)
+
+        if extension in PASSTHROUGH_EXTENSIONS and len(derivative) >= original_size:
+            logger.info("Derivative of %s is not smaller, using original", key)
+            return key
+
+        derivative_key = derivative_key_for(key)
+        s3.put_object(
+            Bucket=bucket,
+            Key=derivative_key,
+            Body=derivative,
+            ContentType=CONTENT_TYPES.get(IMAGE_OUTPUT_FORMAT, "image/jpeg"),
+        )
+        logger.info(
+            "Stored derivative %s (%d -> %d bytes)",
+            derivative_key,
+            original_size,
+            len(derivative),
+        )
+        return derivative_key
+    except Exception as e:
+        logger.error("Error pre-processing image %s, using original: %s", key, e)
+        return key
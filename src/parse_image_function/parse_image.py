@@ -5,7 +5,10 @@ from pathlib import Path
 
 import boto3
 import requests
-from botocore.exceptions import BotoCoreError, ClientError
+from image_preprocess import prepare_image_for_parsing
+from outbound import UpstreamUnavailableError, get_endpoint
+from profiling import profiled
+from warmup import s3_primer, warmable
 
 # Set up logger
 logger = logging.getLogger()
@@ -14,85 +17,77 @@ logger.setLevel("INFO")
 
 s3 = boto3.client("s3")
 bucket = os.environ["S3_BUCKET"]
-sqs = boto3.client("sqs")
 todam_table_name = os.environ.get("TODAM_TABLE", "todam_table")
-parse_image_fifo_queue_url = os.environ["PARSE_IMAGE_FIFO_QUEUE_URL"]
 parse_image_api_url = os.environ["PARSE_IMAGE_API_URL"]
+parse_image_endpoint = get_endpoint(
+    "parse-image",
+    parse_image_api_url,
+    read_timeout=float(os.environ.get("PARSE_IMAGE_API_TIMEOUT", "20")),
+    max_retries=1,
+)
 
 IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".bmp", ".tiff"}
 
 
-def api_parse_image(payload: dict):
+def api_parse_image(payload: dict, deadline_ms: int = None):
     """Send a POST request to parse an image."""
     try:
         logger.info("============ Call API - parse image ===========")
         logger.info("Payload: %s", payload)
-        response = requests.post(parse_image_api_url, json=payload)
+        response = parse_image_endpoint.post(json=payload, deadline_ms=deadline_ms)
         response.raise_for_status()
         return {
             "statusCode": response.status_code,
             "body": response.json(),  # safely assuming the response is in JSON format
         }
+    except UpstreamUnavailableError as e:
+        logger.warning("Parse image API call rejected: %s", e)
+        return {"statusCode": 503, "body": str(e)}
     except requests.RequestException as e:
         logger.error("Error calling API: %s", e)
-        if hasattr(e, "response") and e.response:
+        if hasattr(e, "response") and e.response is not None:
             return {"statusCode": e.response.status_code, "body": str(e)}
         else:
             return {"statusCode": 500, "body": str(e)}
 
 
-def receive_message_from_sqs(queue_url: str) -> dict:
-    try:
-        response = sqs.receive_message(
-            QueueUrl=queue_url,
-            MaxNumberOfMessages=1,
-            VisibilityTimeout=30,
-            WaitTimeSeconds=5,
-        )
-        logger.info("Received message from SQS: %s", response)
-        return response
-    except (ClientError, BotoCoreError) as e:
-        logger.error("Error receiving message from SQS: %s", e)
-        raise Exception(f"Error receiving message from SQS: {e}")
+PRIMERS = {
+    "s3": s3_primer(s3, bucket),
+}
 
 
-def lambda_handler(event, context):
-    logger.info("Lambda function started")
-    logger.info("Parse Image FIFO SQS URL: %s", parse_image_fifo_queue_url)
+def parse_record(record: dict, context) -> bool:
+    """Parse the image of one queued request, False to have it retried."""
+    body = json.loads(record["body"])
+    logger.info("Message ID: %s", record["messageId"])
+    logger.info("Message Body: %s", body)
 
-    key = event["Records"][0]["s3"]["object"]["key"]
+    key = body["s3_object_key"]
     path = Path(key)
+    if path.stem != body.get("message_id"):
+        # LINE images are stored under their message id; anything else was
+        # not paired with this item
+        logger.error(
+            "Image %s does not belong to message %s", key, body.get("message_id")
+        )
+        return True
     file_extension = path.suffix.lower()
-
     if file_extension not in IMAGE_EXTENSIONS:
         logger.error("Unsupported file type: %s", file_extension)
-        return {"statusCode": 400, "body": json.dumps("Unsupported file type")}
-
-    logger.info("============ Receive message from SQS ===========")
-    response = receive_message_from_sqs(parse_image_fifo_queue_url)
-    messages = response.get("Messages", [])
-
-    if not messages:
-        logger.info("No messages to process")
-        return {"statusCode": 200, "body": json.dumps("No messages to process")}
+        return True
 
-    message = messages[0]
-    message_id = message["MessageId"]
-    receipt_handle = message["ReceiptHandle"]
-    body = json.loads(message["Body"])
-
-    logger.info("Received %d messages from SQS", len(messages))
-    logger.info("Message ID: %s", message_id)
-    logger.info("Message Body: %s", body)
+    parse_key = prepare_image_for_parsing(bucket, key)
 
     payload = {
         "s3_bucket_name": bucket,
-        "s3_object_key": key,
+        "s3_object_key": parse_key,
         "dynamodb_table_name": todam_table_name,
-        "dynamodb_item_id": body.get("dynamodb_item_id"),
+        "dynamodb_item_id": body["dynamodb_item_id"],
     }
 
-    result = api_parse_image(payload)
+    result = api_parse_image(
+        payload, deadline_ms=context.get_remaining_time_in_millis() if context else None
+    )
     logger.info("============ Call API - parse image ===========")
     logger.info("API response: %s", result)
 
@@ -101,18 +96,28 @@ def lambda_handler(event, context):
             result["body"].get("SendMessageResponse", {}).get("SendMessageResult", {})
         )
         if sendMessageResult.get("MessageId") is not None:
-            logger.info("============ Delete message from SQS ===========")
-            sqs.delete_message(
-                QueueUrl=parse_image_fifo_queue_url, ReceiptHandle=receipt_handle
-            )
-            logger.info("Message deleted from SQS")
-            return {
-                "statusCode": 200,
-                "body": json.dumps("Image parsing request sent successfully"),
-            }
-
-    logger.error("Failed to parse image or invalid response")
-    return {
-        "statusCode": result.get("statusCode", 500),
-        "body": json.dumps("Failed to parse image or invalid response"),
-    }
+            logger.info("Image parsing request sent successfully")
+            return True
+
+    if result["statusCode"] == 503:
+        logger.warning("Parse image API unavailable, message returned to the queue")
+    else:
+        logger.error("Failed to parse image or invalid response")
+    return False
+
+
+@warmable(PRIMERS)
+@profiled
+def lambda_handler(event, context):
+    """Parse the images of requests queued once both image and item exist.
+
+    Failed requests are reported back to the queue, which redelivers them
+    after the visibility timeout.
+    """
+    logger.info("Lambda function started")
+    failures = []
+    for record in event["Records"]:
+        # A FIFO batch must not be applied past a failed record
+        if failures or not parse_record(record, context):
+            failures.append({"itemIdentifier": record["messageId"]})
+    return {"batchItemFailures": failures}
@@ -5,8 +5,11 @@ TODAM_TABLE_NAME = os.environ.get("TODAM_TABLE", "todam_table")
 REGISTERED_USER_TABLE_NAME = "registered_user_table"
 VERIFY_REGISTRATION_API_URL = f"https://{os.environ.get('VERIFY_REGISTRATION_API_URL')}.execute-api.us-east-1.amazonaws.com/dev/verify-registration"
 PARSE_IMAGE_FIFO_QUEUE_URL = os.environ["PARSE_IMAGE_FIFO_QUEUE_URL"]
-PARSE_IMAGE_LAMBDA_FUNCTION_NAME = os.environ["PARSE_IMAGE_LAMBDA_FUNCTION_NAME"]
 S3_BUCKET = os.environ["S3_BUCKET"]
+# FIFO queue buffering line logs per group; unset processes each object inline
+INGEST_QUEUE_URL = os.environ.get("INGEST_QUEUE_URL")
+# New segments also keep their messages packed into compressed blocks
+MESSAGE_BLOCKS_ENABLED = os.environ.get("MESSAGE_BLOCKS_ENABLED", "false") == "true"
 
 # File paths
 STICKERS_JSON_PATH = "stickers.json"
@@ -14,5 +17,16 @@ STICKERS_JSON_PATH = "stickers.json"
 # Image extensions
 IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".bmp", ".tiff"}
 
+# Stem suffix of downsampled images written by the parse image function
+DERIVATIVE_MARKER = ".derivative"
+
+# Objects our own functions write to the bucket; they are not LINE webhooks
+INTERNAL_KEY_PREFIXES = (
+    "exports/",
+    "compacted/",
+    "archive/",
+    "profiles/",
+)
+
 # Email source
 EMAIL_SOURCE = "TODAM <ptqwe20020413@gmail.com>"
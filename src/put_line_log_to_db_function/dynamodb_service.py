@@ -1,10 +1,16 @@
 import logging
+import time
 
 import boto3
+import message_blocks
+from capacity import track
 from config import REGISTERED_USER_TABLE_NAME, TODAM_TABLE_NAME
+from dynamodb_util import group_status_key, projection_params
+from group_shards import group_index_key
 
 # Initialize AWS clients
 dynamodb = boto3.resource("dynamodb")
+track(dynamodb)
 todam_table = dynamodb.Table(TODAM_TABLE_NAME)
 registered_user_table = dynamodb.Table(REGISTERED_USER_TABLE_NAME)
 
@@ -12,6 +18,9 @@ registered_user_table = dynamodb.Table(REGISTERED_USER_TABLE_NAME)
 logger = logging.getLogger(__name__)
 logger.setLevel("INFO")
 
+# Unpaired image parse halves are dropped after a day
+IMAGE_PARSE_TTL_SECONDS = 24 * 60 * 60
+
 
 def put_item_to_todam_table(item):
     try:
@@ -22,6 +31,18 @@ def put_item_to_todam_table(item):
         raise
 
 
+def put_items_to_todam_table(items):
+    """Write a run of message items with batched requests."""
+    try:
+        with todam_table.batch_writer() as batch:
+            for item in items:
+                batch.put_item(Item=item)
+        logger.info("%d items put to %s table.", len(items), TODAM_TABLE_NAME)
+    except Exception as e:
+        logger.error("Error batch writing items to %s table: %s", TODAM_TABLE_NAME, e)
+        raise
+
+
 def get_registered_user(user_id):
     try:
         response = registered_user_table.get_item(Key={"user_id": user_id})
@@ -32,16 +53,111 @@ def get_registered_user(user_id):
 
 
 def query_todam_table(group_id):
+    """Return the open segments of a group with only the attributes we use."""
     try:
+        # Segment items are never sharded, they always live on shard 0
+        index_name, key_condition = group_index_key(group_id)
         response = todam_table.query(
-            IndexName="GroupTimeIndex",
-            KeyConditionExpression=boto3.dynamodb.conditions.Key("group_id").eq(
-                group_id
-            ),
+            IndexName=index_name,
+            KeyConditionExpression=key_condition,
             FilterExpression=boto3.dynamodb.conditions.Attr("is_segment").eq(True)
             & boto3.dynamodb.conditions.Attr("is_end").eq(False),
+            **projection_params("id", "segment_id", "start_timestamp"),
         )
         return response
     except Exception as e:
         logger.error("Error querying %s table: %s", TODAM_TABLE_NAME, e)
         raise
+
+
+def end_segment(item_id, end_timestamp, segment_name, group_id):
+    try:
+        todam_table.update_item(
+            Key={"id": item_id},
+            UpdateExpression="SET end_timestamp = :end, is_message = :false, "
+            "is_end = :true, segment_name = :name, segment_status = :ended, "
+            "group_status = :group_status",
+            ExpressionAttributeValues={
+                ":end": end_timestamp,
+                ":false": False,
+                ":true": True,
+                ":name": segment_name,
+                ":ended": "ended",
+                ":group_status": group_status_key(group_id, "ended"),
+            },
+        )
+        logger.info("Segment %s ended in %s table.", item_id, TODAM_TABLE_NAME)
+    except Exception as e:
+        logger.error("Error ending segment in %s table: %s", TODAM_TABLE_NAME, e)
+        raise
+
+
+def pair_image_parse(message_id, **attributes):
+    """Record one half of an image's parse request, return the pair once whole.
+
+    The image object and its message item arrive by different events in
+    either order. Each records its half under the LINE message id, and the
+    one that completes the item gets it back with the object key and the
+    message item id.
+    """
+    assignments = ", ".join(f"{name} = :{name}" for name in attributes)
+    try:
+        response = todam_table.update_item(
+            Key={"id": f"image_parse#{message_id}"},
+            UpdateExpression=f"SET {assignments}, message_id = :message_id, "
+            "expires_at = :ttl",
+            ExpressionAttributeValues={
+                **{f":{name}": value for name, value in attributes.items()},
+                ":message_id": message_id,
+                ":ttl": int(time.time()) + IMAGE_PARSE_TTL_SECONDS,
+            },
+            ReturnValues="ALL_NEW",
+        )
+    except Exception as e:
+        logger.error("Error pairing image parse of %s: %s", message_id, e)
+        raise
+    pair = response["Attributes"]
+    if "image_key" in pair and "dynamodb_item_id" in pair:
+        return pair
+    return None
+
+
+def open_segment_blocks(group_id, segment_id):
+    """Point the group's message counter at a new block layout segment."""
+    todam_table.put_item(Item=message_blocks.open_segment_item(group_id, segment_id))
+
+
+def record_segment_messages(group_id, items):
+    """Count the messages against the open segment and pack it when due."""
+    # Unlike packing this cannot catch up later, so a failure fails the batch
+    message_blocks.record_late_messages(
+        todam_table, group_id, items, int(time.time() * 1000)
+    )
+    try:
+        pointer = message_blocks.record_messages(todam_table, group_id, items)
+        if pointer and message_blocks.should_pack(pointer, len(items)):
+            pack_segment_blocks(pointer["segment_id"])
+    except Exception as e:
+        # The message items are complete without blocks; packing catches up later
+        logger.error("Error packing messages of group %s: %s", group_id, e)
+
+
+def close_segment_blocks(group_id, segment_id):
+    """Drop the group's counter and pack what has settled of the ended segment."""
+    try:
+        todam_table.delete_item(Key={"id": message_blocks.open_segment_key(group_id)})
+        pack_segment_blocks(segment_id)
+    except Exception as e:
+        logger.error("Error packing ended segment %s: %s", segment_id, e)
+
+
+def pack_segment_blocks(segment_id):
+    segment = todam_table.get_item(
+        Key={"id": segment_id},
+        ConsistentRead=True,
+        **projection_params(
+            "id", "group_id", "end_timestamp", *message_blocks.SEGMENT_BLOCK_ATTRIBUTES
+        ),
+    ).get("Item")
+    if segment and "block_count" in segment:
+        message_blocks.pack_segment(todam_table, segment, int(time.time() * 1000))
@@ -1,37 +1,58 @@
+import functools
 import json
 import logging
 import re
-import time
 import uuid
+from pathlib import Path
 from datetime import datetime
 
 import boto3
+from capacity import set_group
 from config import (
     IMAGE_EXTENSIONS,
+    MESSAGE_BLOCKS_ENABLED,
     PARSE_IMAGE_FIFO_QUEUE_URL,
-    PARSE_IMAGE_LAMBDA_FUNCTION_NAME,
     STICKERS_JSON_PATH,
     TODAM_TABLE_NAME,
 )
 from dynamodb_service import (
+    close_segment_blocks,
+    end_segment,
     get_registered_user,
+    open_segment_blocks,
+    pair_image_parse,
     put_item_to_todam_table,
+    put_items_to_todam_table,
     query_todam_table,
+    record_segment_messages,
 )
+from dynamodb_util import group_status_key
 from email_service import send_email
+from group_shards import choose_shard_key, record_write
+from message_blocks import new_segment_attributes
+from response_cache import (
+    ALL_SEGMENTS_SCOPE,
+    bump_versions,
+    messages_scope,
+    segments_scope,
+)
 from sqs_service import send_message_to_sqs
 from time_util import convert_timestamp_to_utc_plus_8
-from user_service import apply_registration, get_user_type_by_id
+from user_service import (
+    apply_registration,
+    get_user_type_by_id,
+    prefetch_user_types,
+)
 
 # Initialize AWS clients
 s3 = boto3.client("s3")
-lambda_client = boto3.client("lambda")
 
 # Configure logger
 logger = logging.getLogger(__name__)
 logger.setLevel("INFO")
 
 
+@functools.lru_cache(maxsize=1)
 def load_stickers():
     try:
         with open(STICKERS_JSON_PATH, "r") as f:
@@ -42,15 +63,27 @@ def load_stickers():
         raise
 
 
-def handle_image_message(event, key):
-    invoke_parse_image_lambda_payload = event
-    time.sleep(2)
-    lambda_client.invoke(
-        FunctionName=PARSE_IMAGE_LAMBDA_FUNCTION_NAME,
-        InvocationType="Event",
-        Payload=json.dumps(invoke_parse_image_lambda_payload),
+def request_image_parse(pair):
+    """Queue the parse of an image whose object and message item both exist."""
+    parse_image_message = {
+        "message_id": pair["message_id"],
+        "s3_object_key": pair["image_key"],
+        "dynamodb_table_name": TODAM_TABLE_NAME,
+        "dynamodb_item_id": pair["dynamodb_item_id"],
+    }
+    # One group per image, so a parse waiting on the API holds up no other
+    send_message_to_sqs(
+        PARSE_IMAGE_FIFO_QUEUE_URL,
+        message=parse_image_message,
+        message_group_id=pair["message_id"],
     )
-    logger.info("Invoked Parse Image Lambda: %s", PARSE_IMAGE_LAMBDA_FUNCTION_NAME)
+
+
+def handle_image_message(key):
+    # LINE images are stored under their message id
+    pair = pair_image_parse(Path(key).stem, image_key=key)
+    if pair:
+        request_image_parse(pair)
     return {
         "statusCode": 200,
         "body": json.dumps(
@@ -59,7 +92,25 @@ def handle_image_message(event, key):
     }
 
 
-def process_line_log(data):
+RECORDING_COMMANDS = ("start recording", "end recording")
+REGISTRATION_PATTERN = re.compile(r"/register (\S+@ecloudvalley.com)")
+
+
+class OpenSegments:
+    """A group's open segments, queried at most once per batch."""
+
+    def __init__(self, group_id):
+        self.group_id = group_id
+        self._items = None
+
+    @property
+    def items(self):
+        if self._items is None:
+            self._items = query_todam_table(self.group_id).get("Items", [])
+        return self._items
+
+
+def build_message_item(data):
     message = data["events"][0]["message"]
     message_type = message.get("type")
     message_id = message.get("id")
@@ -69,8 +120,9 @@ def process_line_log(data):
     user_id = source.get("userId")
     send_timestamp = data["events"][0].get("timestamp")
 
-    random_uuid = str(uuid.uuid4()).replace("-", "")
-    logger.info("Generated UUID: %s", random_uuid)
+    # Derived from the object key, so a retried batch overwrites its own items
+    item_id = uuid.uuid5(uuid.NAMESPACE_URL, data["s3_object_key"]).hex
+    logger.info("Generated UUID: %s", item_id)
 
     stickers = load_stickers()
 
@@ -90,15 +142,8 @@ def process_line_log(data):
                 content = "end recording"
                 break
 
-    if message_type == "image":
-        parse_image_message = {
-            "dynamodb_table_name": TODAM_TABLE_NAME,
-            "dynamodb_item_id": random_uuid,
-        }
-        send_message_to_sqs(PARSE_IMAGE_FIFO_QUEUE_URL, message=parse_image_message)
-
     item = {
-        "id": random_uuid,
+        "id": item_id,
         "s3_object_key": data["s3_object_key"],
         "message_type": message_type,
         "message_id": message_id,
@@ -110,7 +155,73 @@ def process_line_log(data):
         "is_segment": False,
         "is_message": True,
     }
-    put_item_to_todam_table(item)
+    if group_id:
+        item["group_shard"] = choose_shard_key(group_id, item_id)
+    return item
+
+
+def write_message_items(group_id, items):
+    if not items:
+        return
+    if len(items) == 1:
+        put_item_to_todam_table(items[0])
+    else:
+        put_items_to_todam_table(items)
+    if group_id:
+        record_write(group_id, len(items))
+        if MESSAGE_BLOCKS_ENABLED:
+            record_segment_messages(group_id, items)
+    bump_versions(messages_scope(group_id))
+    # The parser updates the item, so it may only run once the item exists
+    for item in items:
+        if item["message_type"] == "image" and item["message_id"]:
+            pair = pair_image_parse(item["message_id"], dynamodb_item_id=item["id"])
+            if pair:
+                request_image_parse(pair)
+
+
+def is_command(content):
+    return content in RECORDING_COMMANDS or bool(REGISTRATION_PATTERN.match(content))
+
+
+def process_line_log(data):
+    return process_line_log_batch([data])[0]
+
+
+def process_line_log_batch(batch):
+    """Ingest the logs of one group in send order with shared lookups.
+
+    Message items are written in runs. A recording or registration command
+    first flushes the run before it, so it sees every earlier message, and
+    the open segment and user lookups are shared by the whole batch.
+    """
+    batch = sorted(batch, key=lambda data: data["events"][0].get("timestamp") or 0)
+    group_id = batch[0]["events"][0]["source"].get("groupId")
+    set_group(group_id)
+    prefetch_user_types(data["events"][0]["source"].get("userId") for data in batch)
+    open_segments = OpenSegments(group_id)
+
+    responses = []
+    pending = []
+    for data in batch:
+        item = build_message_item(data)
+        pending.append(item)
+        if not is_command(item["content"]):
+            responses.append({"statusCode": 200, "body": json.dumps(item)})
+            continue
+        write_message_items(group_id, pending)
+        pending = []
+        responses.append(run_command(data, item, open_segments))
+    write_message_items(group_id, pending)
+    return responses
+
+
+def run_command(data, item, open_segments):
+    content = item["content"]
+    group_id = item["group_id"]
+    user_id = item["user_id"]
+    message_id = item["message_id"]
+    send_timestamp = item["send_timestamp"]
 
     if content == "start recording":
         user_response = get_registered_user(user_id)
@@ -125,8 +236,7 @@ def process_line_log(data):
                 "body": json.dumps("User is not registered or not verified."),
             }
 
-        response = query_todam_table(group_id)
-        items = response.get("Items", [])
+        items = open_segments.items
 
         if items:
             ongoing_segment = items[-1]
@@ -156,13 +266,22 @@ def process_line_log(data):
             "segment_id": uuid_no_hyphen_for_segment,
             "start_timestamp": send_timestamp,
             "group_id": group_id,
+            "group_shard": group_id,
             "message_id": message_id,
             "user_id": user_id,
             "send_timestamp": send_timestamp,
             "is_segment": True,
             "is_end": False,
+            "segment_status": "open",
+            "group_status": group_status_key(group_id, "open"),
         }
+        if MESSAGE_BLOCKS_ENABLED:
+            item.update(new_segment_attributes(send_timestamp))
         put_item_to_todam_table(item)
+        if MESSAGE_BLOCKS_ENABLED:
+            open_segment_blocks(group_id, uuid_no_hyphen_for_segment)
+        bump_versions(segments_scope(group_id), ALL_SEGMENTS_SCOPE)
+        items.append(item)
 
         user_email = user_response["Item"]["email"]
         email_subject = "Recording Started"
@@ -182,17 +301,20 @@ def process_line_log(data):
                 "body": json.dumps("User is not registered or not verified."),
             }
 
-        response = query_todam_table(group_id)
-        items = response.get("Items", [])
+        items = open_segments.items
         if items:
-            last_item = items[-1]
+            last_item = items.pop()
             last_item["end_timestamp"] = send_timestamp
-            last_item["is_message"] = False
-            last_item["is_end"] = True
             last_item["segment_name"] = (
                 f"{convert_timestamp_to_utc_plus_8(int(last_item['start_timestamp']))}_{convert_timestamp_to_utc_plus_8(int(last_item['end_timestamp']))}"
             )
-            put_item_to_todam_table(last_item)
+            # Only the projected attributes were read, so update in place
+            end_segment(
+                last_item["id"], send_timestamp, last_item["segment_name"], group_id
+            )
+            if MESSAGE_BLOCKS_ENABLED:
+                close_segment_blocks(group_id, last_item["id"])
+            bump_versions(segments_scope(group_id), ALL_SEGMENTS_SCOPE)
 
             user_email = user_response["Item"]["email"]
             email_subject = "Recording Ended"
@@ -208,7 +330,7 @@ def process_line_log(data):
             )
             send_email(user_email, email_subject, email_body)
 
-    registration_match = re.match(r"/register (\S+@ecloudvalley.com)", content)
+    registration_match = REGISTRATION_PATTERN.match(content)
     if registration_match:
         email = registration_match.group(1)
         apply_registration(user_id, email)
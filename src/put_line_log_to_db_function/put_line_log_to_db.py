@@ -1,10 +1,33 @@
 import json
 import logging
+from collections import defaultdict
 from pathlib import Path
 
 import boto3
-from config import IMAGE_EXTENSIONS, S3_BUCKET
-from line_log_util import handle_image_message, process_line_log
+import dynamodb_service
+import email_service
+import group_shards
+import line_log_util
+import response_cache
+import sqs_service
+import user_service
+from capacity import accounted
+from config import (
+    DERIVATIVE_MARKER,
+    IMAGE_EXTENSIONS,
+    INGEST_QUEUE_URL,
+    INTERNAL_KEY_PREFIXES,
+    PARSE_IMAGE_FIFO_QUEUE_URL,
+    S3_BUCKET,
+)
+from line_log_util import (
+    handle_image_message,
+    process_line_log,
+    process_line_log_batch,
+)
+from profiling import profiled
+from sqs_service import send_message_to_sqs
+from warmup import dynamodb_primer, s3_primer, ses_primer, sqs_primer, warmable
 
 s3 = boto3.client("s3")
 
@@ -12,19 +35,85 @@ s3 = boto3.client("s3")
 logger = logging.getLogger(__name__)
 logger.setLevel("INFO")
 
+# Every module holds its own boto3 client, each with its own connection pool
+PRIMERS = {
+    "s3": s3_primer(s3, S3_BUCKET),
+    "todam_table": dynamodb_primer(dynamodb_service.todam_table),
+    "registered_user_table_reads": dynamodb_primer(
+        dynamodb_service.registered_user_table
+    ),
+    "registered_user_table": dynamodb_primer(user_service.registered_user_table),
+    "cache_version_table": dynamodb_primer(response_cache.version_table),
+    "group_shard_table": dynamodb_primer(group_shards.group_shard_table),
+    "sqs": sqs_primer(sqs_service.sqs, PARSE_IMAGE_FIFO_QUEUE_URL),
+    "ses": ses_primer(email_service.ses_client),
+    "stickers": line_log_util.load_stickers,
+}
+if INGEST_QUEUE_URL:
+    PRIMERS["ingest_queue"] = sqs_primer(sqs_service.sqs, INGEST_QUEUE_URL)
 
+
+def ingest_group_batches(event):
+    """Process queued line logs as one micro-batch per group.
+
+    The FIFO queue keeps each group's logs in order. A failed group reports
+    all its records as failed, so later logs of the group are not applied
+    before the ones they follow.
+    """
+    batches = defaultdict(list)
+    for record in event["Records"]:
+        group = record["attributes"]["MessageGroupId"]
+        batches[group].append((record["messageId"], json.loads(record["body"])))
+
+    failures = []
+    for group, records in batches.items():
+        try:
+            process_line_log_batch([data for _, data in records])
+        except Exception as e:
+            logger.error("Error ingesting %d logs of %s: %s", len(records), group, e)
+            failures.extend({"itemIdentifier": message_id} for message_id, _ in records)
+    logger.info("Ingested %d groups, %d failed records", len(batches), len(failures))
+    return {"batchItemFailures": failures}
+
+
+def enqueue_line_log(data):
+    source = data["events"][0]["source"]
+    group = source.get("groupId") or source.get("userId") or "default_message_group_id"
+    send_message_to_sqs(INGEST_QUEUE_URL, message=data, message_group_id=group)
+    return {"statusCode": 200, "body": json.dumps("Queued for ingest")}
+
+
+@warmable(PRIMERS)
+@accounted
+@profiled
 def lambda_handler(event, context):
+    if event["Records"][0].get("eventSource") == "aws:sqs":
+        return ingest_group_batches(event)
+
     logger.info("Triggered by S3 Put event")
     logger.info("Event: %s", event)
 
     key = event["Records"][0]["s3"]["object"]["key"]
     path = Path(key)
     file_extension = path.suffix.lower()
+
+    if path.stem.endswith(DERIVATIVE_MARKER):
+        # Written by the parse image function itself, not a LINE upload
+        logger.info("Ignoring derived image: %s", key)
+        return {"statusCode": 200, "body": json.dumps("Ignored derived image")}
+
+    if key.startswith(INTERNAL_KEY_PREFIXES):
+        logger.info("Ignoring internal object: %s", key)
+        return {"statusCode": 200, "body": json.dumps("Ignored internal object")}
+
     obj = s3.get_object(Bucket=S3_BUCKET, Key=key)
 
     if file_extension in IMAGE_EXTENSIONS:
-        return handle_image_message(event, key)
+        return handle_image_message(key)
 
     data = json.loads(obj["Body"].read().decode("utf-8"))
     data["s3_object_key"] = key  # Add s3_object_key to data
+    if INGEST_QUEUE_URL and data.get("events"):
+        # Group bursts are written in batches by the queue consumer
+        return enqueue_line_log(data)
     return process_line_log(data)
@@ -1,13 +1,18 @@
 import os
-import uuid
+import time
 from datetime import datetime, timezone
+from typing import Dict, Iterable, Set, Tuple
 
 import boto3
 from botocore.exceptions import ClientError
+from capacity import track
+from dynamodb_util import projection_params
 from email_service import send_email
+from registration_token import issue_token
 
 # Initialize AWS clients
 dynamodb = boto3.resource("dynamodb")
+track(dynamodb)
 registered_user_table = dynamodb.Table("registered_user_table")
 verify_registration_api_url = f"https://{os.environ.get('VERIFY_REGISTRATION_API_URL')}.execute-api.us-east-1.amazonaws.com/dev/verify-registration"
 
@@ -17,46 +22,99 @@ import logging
 logger = logging.getLogger(__name__)
 logger.setLevel("INFO")
 
+# Minimum time between two verification emails to the same user
+APPLY_THROTTLE_MS = 60 * 1000
+# Verified users are cached this long. Unverified ones are not cached past
+# the batch that read them, so a user shows up as TAM right after verifying.
+USER_TYPE_TTL_SECONDS = int(os.environ.get("USER_TYPE_TTL_SECONDS", "60"))
 
-def apply_registration(user_id: str, email: str) -> None:
-    response = registered_user_table.get_item(Key={"user_id": user_id})
-    if "Item" in response:
-        if response["Item"].get("is_verified"):
-            logger.info("You have already registered.")
-            return
-
-        current_time_millis = int(datetime.now(timezone.utc).timestamp() * 1000)
-        if current_time_millis - response["Item"]["apply_timestamp"] < 60 * 1000:
-            logger.info(
-                "Please wait a moment before requesting a new verification email."
-            )
-            return
-
-    random_code = str(uuid.uuid4())
-    registration_url = (
-        verify_registration_api_url + f"?user_id={user_id}&code={random_code}"
-    )
+_user_types: Dict[str, Tuple[str, float]] = {}
+_unverified_in_batch: Set[str] = set()
 
-    email_body = f"Hi {email.split('@')[0]}, Please click on the link to complete your registration:\n {registration_url}"
-    email_subject = "Todam - Complete Your Registration"
 
-    current_time = datetime.now(timezone.utc)
-    unix_timestamp_millis = int(current_time.timestamp() * 1000)
+def apply_registration(user_id: str, email: str) -> None:
+    current_time_millis = int(datetime.now(timezone.utc).timestamp() * 1000)
     item = {
         "user_id": user_id,
         "email": email,
         "name": email.split("@")[0],
-        "apply_timestamp": unix_timestamp_millis,
-        "verification_code": random_code,
+        "apply_timestamp": current_time_millis,
         "is_verified": False,
     }
-    registered_user_table.put_item(Item=item)
+    try:
+        # One conditional put replaces the read-then-write checks: verified
+        # users and applications within the last minute are left untouched
+        registered_user_table.put_item(
+            Item=item,
+            ConditionExpression="attribute_not_exists(user_id) OR "
+            "(is_verified = :false AND apply_timestamp < :throttle)",
+            ExpressionAttributeValues={
+                ":false": False,
+                ":throttle": current_time_millis - APPLY_THROTTLE_MS,
+            },
+        )
+    except registered_user_table.meta.client.exceptions.ConditionalCheckFailedException:
+        logger.info(
+            "User %s is already registered or applied less than a minute ago.",
+            user_id,
+        )
+        return
     logger.info(f"User {email} has applied for registration")
 
+    token = issue_token(user_id, email, current_time_millis)
+    registration_url = verify_registration_api_url + f"?token={token}"
+
+    email_body = f"Hi {email.split('@')[0]}, Please click on the link to complete your registration:\n {registration_url}"
+    email_subject = "Todam - Complete Your Registration"
+
     send_email(email, email_subject, email_body)
 
 
 def get_user_type_by_id(user_id: str) -> str:
+    cached = _user_types.get(user_id)
+    if cached and time.monotonic() - cached[1] < USER_TYPE_TTL_SECONDS:
+        return cached[0]
+    if user_id in _unverified_in_batch:
+        return "Client"
     response = registered_user_table.get_item(Key={"user_id": user_id})
     item = response.get("Item")
-    return "TAM" if item and item.get("is_verified", False) else "Client"
+    if item and item.get("is_verified", False):
+        _user_types[user_id] = ("TAM", time.monotonic())
+        return "TAM"
+    return "Client"
+
+
+def prefetch_user_types(user_ids: Iterable[str]) -> None:
+    """Load the types of a batch's uncached ``user_ids`` with batched reads."""
+    now = time.monotonic()
+    _unverified_in_batch.clear()
+    missing = [
+        user_id
+        for user_id in set(user_ids)
+        if user_id
+        and not (
+            user_id in _user_types
+            and now - _user_types[user_id][1] < USER_TYPE_TTL_SECONDS
+        )
+    ]
+    # BatchGetItem accepts at most 100 keys per request
+    for start in range(0, len(missing), 100):
+        request = {
+            registered_user_table.name: {
+                "Keys": [
+                    {"user_id": user_id} for user_id in missing[start : start + 100]
+                ],
+                **projection_params("user_id", "is_verified"),
+            }
+        }
+        verified = {}
+        while request:
+            response = dynamodb.batch_get_item(RequestItems=request)
+            for item in response["Responses"].get(registered_user_table.name, []):
+                verified[item["user_id"]] = item.get("is_verified", False)
+            request = response.get("UnprocessedKeys")
+        for user_id in missing[start : start + 100]:
+            if verified.get(user_id):
+                _user_types[user_id] = ("TAM", now)
+            else:
+                _unverified_in_batch.add(user_id)
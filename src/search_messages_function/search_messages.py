@@ -0,0 +1,122 @@
+import json
+import logging
+import os
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+from dynamodb_util import projection_params
+from search_index import DynamoDBIndexStore, SearchIndex
+from segment_archive import read_archived_messages
+
+# Set up logger
+logger = logging.getLogger()
+logger.setLevel("INFO")
+
+# Connect to DynamoDB
+dynamodb = boto3.resource("dynamodb")
+search_index_table = dynamodb.Table(
+    os.environ.get("SEARCH_INDEX_TABLE", "todam_search_index")
+)
+search_index = SearchIndex(DynamoDBIndexStore(search_index_table))
+s3 = boto3.client("s3")
+bucket = os.environ.get("S3_BUCKET")
+
+TODAM_TABLE_NAME = "todam_table"
+table = dynamodb.Table(TODAM_TABLE_NAME)
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+def load_messages(message_ids):
+    """Fetch the display fields of the hit messages in BatchGetItem calls."""
+    messages = {}
+    for start in range(0, len(message_ids), 100):
+        request = {
+            TODAM_TABLE_NAME: {
+                "Keys": [
+                    {"id": message_id}
+                    for message_id in message_ids[start : start + 100]
+                ],
+                **projection_params(
+                    "id", "user_id", "user_type", "message_type", "content"
+                ),
+            }
+        }
+        while request:
+            response = dynamodb.batch_get_item(RequestItems=request)
+            for item in response["Responses"].get(TODAM_TABLE_NAME, []):
+                messages[item["id"]] = item
+            request = response.get("UnprocessedKeys")
+    return messages
+
+
+def load_archived_messages(hits, messages):
+    """Add the hits whose items TTL removed from their segments' S3 archives.
+
+    Archived segments keep their postings, but their message items expire
+    from the table, so their display fields only remain in the archive.
+    """
+    segment_ids = {
+        hit["segment_id"]
+        for hit in hits
+        if hit["message_id"] not in messages and hit["segment_id"]
+    }
+    for segment_id in segment_ids:
+        segment = table.get_item(
+            Key={"id": segment_id}, **projection_params("archive_key")
+        ).get("Item", {})
+        if not segment.get("archive_key"):
+            continue
+        for message in read_archived_messages(s3, bucket, segment["archive_key"]):
+            messages.setdefault(message["id"], message)
+    return messages
+
+
+def lambda_handler(event, context):
+    logger.info("Lambda function started with event: %s", event)
+    started = time.perf_counter()
+
+    params = event.get("queryStringParameters") or {}
+    group_id = params.get("group_id")
+    query = params.get("q", "").strip()
+    if not group_id or not query:
+        logger.error("Missing group_id or q in query parameters")
+        return {"statusCode": 400, "body": "Missing group_id or q in query parameters"}
+
+    try:
+        limit = min(int(params.get("limit", DEFAULT_LIMIT)), MAX_LIMIT)
+    except ValueError:
+        return {"statusCode": 400, "body": "limit must be an integer"}
+
+    try:
+        result = search_index.search(group_id, query, limit=limit)
+        details = load_messages([hit["message_id"] for hit in result["messages"]])
+        load_archived_messages(result["messages"], details)
+    except (boto3.exceptions.Boto3Error, ClientError) as e:
+        logger.error("Error searching messages: %s", e)
+        return {"statusCode": 500, "body": "Error searching messages"}
+
+    for hit in result["messages"]:
+        item = details.get(hit["message_id"], {})
+        hit["user_id"] = item.get("user_id", "unknown_user_id")
+        hit["user_type"] = item.get("user_type", "unknown_user_type")
+        hit["message_type"] = item.get("message_type", "unknown_message_type")
+        hit["content"] = item.get("content", "")
+
+    took_ms = round((time.perf_counter() - started) * 1000, 1)
+    logger.info("Search for %r in %s took %s ms", query, group_id, took_ms)
+    return {
+        "statusCode": 200,
+        "body": json.dumps(
+            {
+                "group_id": group_id,
+                "query": query,
+                "took_ms": took_ms,
+                "segments": result["segments"],
+                "messages": result["messages"],
+            },
+            ensure_ascii=False,
+        ),
+        "headers": {"Content-Type": "application/json"},
+    }
@@ -2,15 +2,41 @@ import json
 from datetime import datetime, timezone
 
 import boto3
+from capacity import accounted, track
+from profiling import profiled
+from registration_token import LinkExpiredError, get_signing_key, read_token
+from warmup import dynamodb_primer, warmable
 
 s3 = boto3.client("s3")
 ses_client = boto3.client("ses")
 dynamodb = boto3.resource("dynamodb")
+track(dynamodb)
 todam_table = dynamodb.Table("todam_table")
 registered_user_table = dynamodb.Table("registered_user_table")
 
 
+def verify_registration_token(token: str) -> bool:
+    """Verify a signed registration link with a single conditional write."""
+    claims = read_token(token)
+    try:
+        # A newer application supersedes links sent for earlier ones
+        registered_user_table.update_item(
+            Key={"user_id": claims["user_id"]},
+            UpdateExpression="SET is_verified = :val",
+            ConditionExpression="apply_timestamp = :iat AND email = :email",
+            ExpressionAttributeValues={
+                ":val": True,
+                ":iat": claims["iat"],
+                ":email": claims["email"],
+            },
+        )
+    except registered_user_table.meta.client.exceptions.ConditionalCheckFailedException:
+        raise LinkExpiredError("Verification link superseded by a newer application")
+    return True
+
+
 def verify_registration(user_id: str, code: str) -> bool:
+    """Verify a link with a stored code, as sent before signed tokens."""
     # Get user by user_id
     response = registered_user_table.get_item(Key={"user_id": user_id})
 
@@ -26,7 +52,11 @@ def verify_registration(user_id: str, code: str) -> bool:
 
     # Check if the registration time is within 24 hours
     if current_time - apply_timestamp > 24 * 3600 * 1000:  # 24 hours in milliseconds
-        raise ValueError("Verification code expired")
+        raise LinkExpiredError("Verification code expired")
+
+    # A newer application stores no code, its link is a signed token
+    if "verification_code" not in response["Item"]:
+        raise LinkExpiredError("Verification link superseded by a newer application")
 
     # Check if verification code matches
     if response["Item"]["verification_code"] != code:
@@ -41,13 +71,33 @@ def verify_registration(user_id: str, code: str) -> bool:
     return True
 
 
+PRIMERS = {
+    "registered_user_table": dynamodb_primer(registered_user_table),
+    "signing_key": get_signing_key,
+}
+
+
+@warmable(PRIMERS)
+@accounted
+@profiled
 def lambda_handler(event, context):
 
-    user_id = event["queryStringParameters"]["user_id"]
-    code = event["queryStringParameters"]["code"]
+    params = event.get("queryStringParameters") or {}
 
     # Verify registration
-    if verify_registration(user_id, code):
+    try:
+        if "token" in params:
+            verified = verify_registration_token(params["token"])
+        elif "user_id" in params and "code" in params:
+            verified = verify_registration(params["user_id"], params["code"])
+        else:
+            raise ValueError("Missing token in query parameters")
+    except LinkExpiredError as e:
+        return {"statusCode": 410, "body": json.dumps({"message": str(e)})}
+    except ValueError as e:
+        return {"statusCode": 400, "body": json.dumps({"message": str(e)})}
+
+    if verified:
         item = {"message": "Registration verified"}
     else:
         item = {"message": "Registration verification failed"}
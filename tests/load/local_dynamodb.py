@@ -0,0 +1,723 @@
+"""In-memory stand-in for the boto3 DynamoDB resource used by the handlers.
+
+It implements the subset of the Table API the handlers call, pages reads
+at 1 MB like DynamoDB does and meters read and write capacity units per
+caller-supplied label, so a load test can attribute them to endpoints.
+"""
+
+import bisect
+import copy
+import math
+import re
+import threading
+import time
+from collections import defaultdict
+from decimal import Decimal
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional, Sequence
+
+from botocore.exceptions import ClientError
+
+PAGE_BYTES = 1024 * 1024
+READ_UNIT_BYTES = 4096
+WRITE_UNIT_BYTES = 1024
+
+
+class ConditionalCheckFailedException(ClientError):
+    def __init__(self, operation_name: str):
+        super().__init__(
+            {
+                "Error": {
+                    "Code": "ConditionalCheckFailedException",
+                    "Message": "The conditional request failed",
+                }
+            },
+            operation_name,
+        )
+
+
+class CapacityMeter:
+    """Consumed capacity per label; the label is set per thread by the caller."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.read_units: Dict[str, float] = defaultdict(float)
+        self.write_units: Dict[str, float] = defaultdict(float)
+
+    @property
+    def label(self) -> str:
+        return getattr(self._local, "label", "unlabelled")
+
+    @label.setter
+    def label(self, value: str) -> None:
+        self._local.label = value
+
+    def add(self, read_units: float = 0.0, write_units: float = 0.0) -> None:
+        with self._lock:
+            self.read_units[self.label] += read_units
+            self.write_units[self.label] += write_units
+
+
+def to_dynamodb_value(value):
+    """Store numbers as Decimal, as the boto3 resource does."""
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, (int, float)):
+        return Decimal(str(value))
+    if isinstance(value, dict):
+        return {k: to_dynamodb_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_dynamodb_value(v) for v in value]
+    return value
+
+
+def value_size(value) -> int:
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, bool) or value is None:
+        return 1
+    if isinstance(value, Decimal):
+        digits = len(value.as_tuple().digits)
+        return math.ceil(digits / 2) + 1
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return 3 + sum(len(k) + value_size(v) + 1 for k, v in value.items())
+    if isinstance(value, (list, set)):
+        return 3 + sum(value_size(v) + 1 for v in value)
+    return len(str(value))
+
+
+def item_size(item: dict) -> int:
+    return sum(len(name) + value_size(value) for name, value in item.items())
+
+
+def read_units(size: int, consistent: bool = False) -> float:
+    units = max(1, math.ceil(size / READ_UNIT_BYTES))
+    return units if consistent else units / 2
+
+
+def write_units(size: int) -> float:
+    return max(1, math.ceil(size / WRITE_UNIT_BYTES))
+
+
+# --- Expression evaluation ------------------------------------------------
+
+
+class _Missing:
+    pass
+
+
+MISSING = _Missing()
+
+
+def _compare(operator: str, left, right) -> bool:
+    if left is MISSING or right is MISSING:
+        return operator == "<>"
+    try:
+        return {
+            "=": left == right,
+            "<>": left != right,
+            "<": left < right,
+            "<=": left <= right,
+            ">": left > right,
+            ">=": left >= right,
+        }[operator]
+    except TypeError:
+        return False
+
+
+def evaluate_condition(condition, item: dict) -> bool:
+    """Evaluate a boto3 ``Key``/``Attr`` condition object against ``item``."""
+    expression = condition.get_expression()
+    operator = expression["operator"]
+    values = expression["values"]
+
+    def resolve(value):
+        if hasattr(value, "name") and not hasattr(value, "get_expression"):
+            return item.get(value.name, MISSING)
+        return to_dynamodb_value(value)
+
+    if operator == "AND":
+        return all(evaluate_condition(value, item) for value in values)
+    if operator == "OR":
+        return any(evaluate_condition(value, item) for value in values)
+    if operator == "NOT":
+        return not evaluate_condition(values[0], item)
+    if operator == "attribute_exists":
+        return values[0].name in item
+    if operator == "attribute_not_exists":
+        return values[0].name not in item
+    left = resolve(values[0])
+    if operator == "BETWEEN":
+        return _compare(">=", left, resolve(values[1])) and _compare(
+            "<=", left, resolve(values[2])
+        )
+    if operator == "IN":
+        return left in [resolve(value) for value in values[1]]
+    if operator == "begins_with":
+        return isinstance(left, str) and left.startswith(resolve(values[1]))
+    if operator == "contains":
+        return left is not MISSING and resolve(values[1]) in left
+    return _compare(operator, left, resolve(values[1]))
+
+
+TOKEN_PATTERN = re.compile(r"\s*(<>|<=|>=|[=<>(),+\-]|[#:]?[A-Za-z_][\w.]*)")
+
+
+def _tokenize(expression: str) -> List[str]:
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = TOKEN_PATTERN.match(expression, position)
+        if not match:
+            raise ValueError(f"Cannot parse expression: {expression!r}")
+        tokens.append(match.group(1))
+        position = match.end()
+    return tokens
+
+
+class _StringCondition:
+    """Recursive-descent evaluator for ConditionExpression strings."""
+
+    def __init__(self, expression: str, names: dict, values: dict, item: dict):
+        self.tokens = _tokenize(expression)
+        self.position = 0
+        self.names = names or {}
+        self.values = values or {}
+        self.item = item
+
+    def peek(self) -> Optional[str]:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self) -> str:
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def name(self, token: str) -> str:
+        return self.names.get(token, token)
+
+    def operand(self):
+        token = self.take()
+        if token.startswith(":"):
+            return to_dynamodb_value(self.values[token])
+        return self.item.get(self.name(token), MISSING)
+
+    def evaluate(self) -> bool:
+        result = self.disjunction()
+        if self.peek() is not None:
+            raise ValueError(f"Unexpected token {self.peek()!r}")
+        return result
+
+    def disjunction(self) -> bool:
+        result = self.conjunction()
+        while self.peek() and self.peek().upper() == "OR":
+            self.take()
+            right = self.conjunction()
+            result = result or right
+        return result
+
+    def conjunction(self) -> bool:
+        result = self.negation()
+        while self.peek() and self.peek().upper() == "AND":
+            self.take()
+            right = self.negation()
+            result = result and right
+        return result
+
+    def negation(self) -> bool:
+        if self.peek() and self.peek().upper() == "NOT":
+            self.take()
+            return not self.negation()
+        return self.comparison()
+
+    def comparison(self) -> bool:
+        token = self.peek()
+        if token == "(":
+            self.take()
+            result = self.disjunction()
+            self.take()  # ")"
+            return result
+        if token in ("attribute_exists", "attribute_not_exists", "begins_with"):
+            self.take()
+            self.take()  # "("
+            path = self.name(self.take())
+            argument = None
+            if self.peek() == ",":
+                self.take()
+                argument = self.operand()
+            self.take()  # ")"
+            if token == "attribute_exists":
+                return path in self.item
+            if token == "attribute_not_exists":
+                return path not in self.item
+            value = self.item.get(path, MISSING)
+            return isinstance(value, str) and value.startswith(argument)
+        left = self.operand()
+        operator = self.take()
+        if operator.upper() == "BETWEEN":
+            low = self.operand()
+            self.take()  # AND
+            high = self.operand()
+            return _compare(">=", left, low) and _compare("<=", left, high)
+        return _compare(operator, left, self.operand())
+
+
+def evaluate_string_condition(expression, names, values, item) -> bool:
+    return _StringCondition(expression, names, values, item).evaluate()
+
+
+def condition_matcher(condition, params: dict) -> Callable[[dict], bool]:
+    """Match items against a condition object or a pre-built expression string."""
+    if isinstance(condition, str):
+        names = params.get("ExpressionAttributeNames")
+        values = params.get("ExpressionAttributeValues")
+        return lambda item: evaluate_string_condition(condition, names, values, item)
+    return lambda item: evaluate_condition(condition, item)
+
+
+def _split_top_level(text: str) -> List[str]:
+    parts, depth, current = [], 0, ""
+    for char in text:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        if char == "," and depth == 0:
+            parts.append(current.strip())
+            current = ""
+        else:
+            current += char
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+def apply_update(item: dict, expression: str, names: dict, values: dict) -> None:
+    """Apply a SET/ADD/REMOVE UpdateExpression to ``item`` in place."""
+    names = names or {}
+    values = {k: to_dynamodb_value(v) for k, v in (values or {}).items()}
+    clauses = re.split(r"\b(SET|ADD|REMOVE)\b", expression, flags=re.IGNORECASE)
+
+    def operand(token: str):
+        token = token.strip()
+        if token.startswith(":"):
+            return values[token]
+        match = re.fullmatch(r"if_not_exists\((.+),(.+)\)", token)
+        if match:
+            existing = item.get(names.get(match[1].strip(), match[1].strip()))
+            return existing if existing is not None else operand(match[2])
+        match = re.fullmatch(r"list_append\((.+),(.+)\)", token)
+        if match:
+            return operand(match[1]) + operand(match[2])
+        return item.get(names.get(token, token))
+
+    for action, body in zip(clauses[1::2], clauses[2::2]):
+        for part in _split_top_level(body):
+            if action.upper() == "SET":
+                path, value = (side.strip() for side in part.split("=", 1))
+                path = names.get(path, path)
+                match = re.fullmatch(r"(.+?)\s*([+-])\s*(.+)", value)
+                if match and not value.startswith(("if_not_exists", "list_append")):
+                    left, right = operand(match[1]), operand(match[3])
+                    item[path] = left + right if match[2] == "+" else left - right
+                else:
+                    item[path] = operand(value)
+            elif action.upper() == "ADD":
+                path, value = part.split()
+                path = names.get(path, path)
+                if isinstance(values[value], (set, frozenset)):
+                    item[path] = set(item.get(path, set())) | values[value]
+                else:
+                    item[path] = item.get(path, Decimal(0)) + values[value]
+            else:
+                item.pop(names.get(part, part), None)
+
+
+def project(item: dict, expression: Optional[str], names: Optional[dict]) -> dict:
+    if not expression:
+        return copy.deepcopy(item)
+    names = names or {}
+    attributes = [names.get(a.strip(), a.strip()) for a in expression.split(",")]
+    return {a: copy.deepcopy(item[a]) for a in attributes if a in item}
+
+
+# --- Tables ---------------------------------------------------------------
+
+
+class LocalIndex:
+    def __init__(self, hash_key: str, range_key: str, projection: Sequence[str]):
+        self.hash_key = hash_key
+        self.range_key = range_key
+        # None projects every attribute
+        self.projection = projection
+        self.partitions: Dict[object, List[tuple]] = defaultdict(list)
+
+    def entry(self, item: dict, key_name: str):
+        if self.hash_key not in item or self.range_key not in item:
+            return None
+        return item[self.hash_key], (item[self.range_key], item[key_name])
+
+    def projected(self, item: dict, key_name: str) -> dict:
+        if self.projection is None:
+            return item
+        keep = set(self.projection) | {self.hash_key, self.range_key, key_name}
+        return {name: value for name, value in item.items() if name in keep}
+
+
+class LocalTable:
+    def __init__(
+        self,
+        name: str,
+        key_name: str,
+        meter: CapacityMeter,
+        indexes: Optional[Dict[str, LocalIndex]] = None,
+        call_latency_ms: float = 0.0,
+    ):
+        self.name = name
+        self.table_name = name
+        self.key_name = key_name
+        self.meter = meter
+        self.indexes = indexes or {}
+        self.call_latency_ms = call_latency_ms
+        self.items: Dict[object, dict] = {}
+        self.order: List[object] = []
+        self.lock = threading.RLock()
+        self.meta = SimpleNamespace(
+            client=SimpleNamespace(
+                exceptions=SimpleNamespace(
+                    ConditionalCheckFailedException=ConditionalCheckFailedException
+                ),
+                describe_endpoints=lambda: {"Endpoints": []},
+            )
+        )
+
+    def _wait(self) -> None:
+        if self.call_latency_ms:
+            time.sleep(self.call_latency_ms / 1000)
+
+    def _consumed(self, units: float, params: dict, kind: str) -> dict:
+        if kind == "read":
+            self.meter.add(read_units=units)
+        else:
+            self.meter.add(write_units=units)
+        if params.get("ReturnConsumedCapacity") in ("TOTAL", "INDEXES"):
+            return {
+                "ConsumedCapacity": {"TableName": self.name, "CapacityUnits": units}
+            }
+        return {}
+
+    def _index_add(self, item: dict) -> None:
+        for index in self.indexes.values():
+            entry = index.entry(item, self.key_name)
+            if entry:
+                bisect.insort(index.partitions[entry[0]], entry[1])
+
+    def _index_remove(self, item: dict) -> None:
+        for index in self.indexes.values():
+            entry = index.entry(item, self.key_name)
+            if entry:
+                partition = index.partitions[entry[0]]
+                position = bisect.bisect_left(partition, entry[1])
+                if position < len(partition) and partition[position] == entry[1]:
+                    partition.pop(position)
+
+    def _index_write_units(self, item: Optional[dict]) -> float:
+        if not item:
+            return 0
+        return sum(
+            write_units(item_size(index.projected(item, self.key_name)))
+            for index in self.indexes.values()
+            if index.entry(item, self.key_name)
+        )
+
+    def _check(self, params: dict, item: dict, operation: str) -> None:
+        condition = params.get("ConditionExpression")
+        if condition is None:
+            return
+        if isinstance(condition, str):
+            passed = evaluate_string_condition(
+                condition,
+                params.get("ExpressionAttributeNames"),
+                params.get("ExpressionAttributeValues"),
+                item,
+            )
+        else:
+            passed = evaluate_condition(condition, item)
+        if not passed:
+            raise ConditionalCheckFailedException(operation)
+
+    def load(self, items) -> None:
+        """Bulk insert seed data without metering."""
+        with self.lock:
+            for item in items:
+                self._store(to_dynamodb_value(item))
+
+    def _store(self, item: dict) -> Optional[dict]:
+        key = item[self.key_name]
+        old = self.items.get(key)
+        if old is not None:
+            self._index_remove(old)
+        else:
+            self.order.append(key)
+        self.items[key] = item
+        self._index_add(item)
+        return old
+
+    def put_item(self, Item, **params):
+        self._wait()
+        item = to_dynamodb_value(Item)
+        with self.lock:
+            self._check(params, self.items.get(item[self.key_name], {}), "PutItem")
+            old = self._store(item)
+        units = max(write_units(item_size(item)), write_units(item_size(old or {})))
+        units += self._index_write_units(old) + self._index_write_units(item)
+        return self._consumed(units, params, "write")
+
+    def get_item(self, Key, **params):
+        self._wait()
+        item = self.items.get(to_dynamodb_value(Key[self.key_name]))
+        response = self._consumed(
+            read_units(item_size(item or {}), params.get("ConsistentRead", False)),
+            params,
+            "read",
+        )
+        if item is not None:
+            response["Item"] = project(
+                item,
+                params.get("ProjectionExpression"),
+                params.get("ExpressionAttributeNames"),
+            )
+        return response
+
+    def delete_item(self, Key, **params):
+        self._wait()
+        key = to_dynamodb_value(Key[self.key_name])
+        with self.lock:
+            item = self.items.get(key, {})
+            self._check(params, item, "DeleteItem")
+            if key in self.items:
+                self._index_remove(self.items.pop(key))
+                self.order.remove(key)
+        units = write_units(item_size(item)) + self._index_write_units(item)
+        return self._consumed(units, params, "write")
+
+    def update_item(self, Key, UpdateExpression, **params):
+        self._wait()
+        key = to_dynamodb_value(Key[self.key_name])
+        with self.lock:
+            old = self.items.get(key)
+            self._check(params, old or {}, "UpdateItem")
+            item = copy.deepcopy(old) if old else {self.key_name: key}
+            apply_update(
+                item,
+                UpdateExpression,
+                params.get("ExpressionAttributeNames"),
+                params.get("ExpressionAttributeValues"),
+            )
+            self._store(item)
+        units = max(write_units(item_size(item)), write_units(item_size(old or {})))
+        units += self._index_write_units(old) + self._index_write_units(item)
+        response = self._consumed(units, params, "write")
+        return_values = params.get("ReturnValues", "NONE")
+        if return_values in ("ALL_NEW", "UPDATED_NEW"):
+            response["Attributes"] = copy.deepcopy(item)
+        elif return_values in ("ALL_OLD", "UPDATED_OLD") and old:
+            response["Attributes"] = copy.deepcopy(old)
+        return response
+
+    def _page(self, candidates, params: dict, last_key) -> dict:
+        """Read candidates up to 1 MB or Limit, then filter and project."""
+        filter_expression = params.get("FilterExpression")
+        matches = filter_expression is not None and condition_matcher(
+            filter_expression, params
+        )
+        limit = params.get("Limit")
+        items, read_bytes, evaluated, last = [], 0, 0, None
+        for candidate in candidates:
+            read_bytes += item_size(candidate)
+            evaluated += 1
+            last = candidate
+            if filter_expression is None or matches(candidate):
+                items.append(
+                    project(
+                        candidate,
+                        params.get("ProjectionExpression"),
+                        params.get("ExpressionAttributeNames"),
+                    )
+                )
+            if read_bytes >= PAGE_BYTES or (limit and evaluated >= limit):
+                break
+        else:
+            last = None
+
+        response = self._consumed(
+            read_units(read_bytes, params.get("ConsistentRead", False)),
+            params,
+            "read",
+        )
+        response.update(
+            {"Items": items, "Count": len(items), "ScannedCount": evaluated}
+        )
+        if last is not None:
+            response["LastEvaluatedKey"] = last_key(last)
+        return response
+
+    def scan(self, **params):
+        self._wait()
+        start = 0
+        if "ExclusiveStartKey" in params:
+            start = self.order.index(params["ExclusiveStartKey"][self.key_name]) + 1
+        keys = self.order[start:]
+        candidates = (self.items[key] for key in keys if key in self.items)
+        return self._page(
+            candidates, params, lambda item: {self.key_name: item[self.key_name]}
+        )
+
+    def query(self, KeyConditionExpression, **params):
+        self._wait()
+        _validate_key_condition(KeyConditionExpression, params)
+        matches = condition_matcher(KeyConditionExpression, params)
+        index = self.indexes[params["IndexName"]]
+        hash_value = _hash_value(KeyConditionExpression, index.hash_key, params)
+        partition = list(index.partitions.get(hash_value, []))
+        if params.get("ScanIndexForward") is False:
+            partition.reverse()
+        if "ExclusiveStartKey" in params:
+            start = params["ExclusiveStartKey"]
+            if not matches(start):
+                raise ClientError(
+                    {
+                        "Error": {
+                            "Code": "ValidationException",
+                            "Message": "The provided starting key does not "
+                            "match the range key predicate",
+                        }
+                    },
+                    "Query",
+                )
+            marker = (
+                to_dynamodb_value(start[index.range_key]),
+                start[self.key_name],
+            )
+            partition = [
+                entry
+                for entry in partition
+                if (
+                    entry > marker
+                    if params.get("ScanIndexForward", True)
+                    else entry < marker
+                )
+            ]
+        candidates = (
+            index.projected(self.items[key], self.key_name)
+            for _, key in partition
+            if matches(self.items[key])
+        )
+        return self._page(
+            candidates,
+            params,
+            lambda item: {
+                self.key_name: item[self.key_name],
+                index.hash_key: item[index.hash_key],
+                index.range_key: item[index.range_key],
+            },
+        )
+
+
+def _between_bounds(condition, params: dict):
+    """Yield the (low, high) bounds of every BETWEEN in a key condition."""
+    if isinstance(condition, str):
+        tokens = _tokenize(condition)
+        values = params.get("ExpressionAttributeValues") or {}
+        for position, token in enumerate(tokens):
+            if token.upper() == "BETWEEN":
+                yield values[tokens[position + 1]], values[tokens[position + 3]]
+        return
+    expression = condition.get_expression()
+    if expression["operator"] == "AND":
+        for value in expression["values"]:
+            yield from _between_bounds(value, params)
+    elif expression["operator"] == "BETWEEN":
+        yield tuple(expression["values"][1:])
+
+
+def _validate_key_condition(condition, params: dict) -> None:
+    for low, high in _between_bounds(condition, params):
+        if to_dynamodb_value(low) > to_dynamodb_value(high):
+            raise ClientError(
+                {
+                    "Error": {
+                        "Code": "ValidationException",
+                        "Message": "Invalid KeyConditionExpression: The BETWEEN "
+                        "operator requires upper bound to be greater than or "
+                        "equal to lower bound",
+                    }
+                },
+                "Query",
+            )
+
+
+def _hash_value(condition, hash_key: str, params: dict):
+    if isinstance(condition, str):
+        tokens = _tokenize(condition)
+        names = params.get("ExpressionAttributeNames") or {}
+        values = params.get("ExpressionAttributeValues") or {}
+        for position, token in enumerate(tokens[:-2]):
+            if names.get(token, token) == hash_key and tokens[position + 1] == "=":
+                return to_dynamodb_value(values[tokens[position + 2]])
+        return None
+    expression = condition.get_expression()
+    if expression["operator"] == "AND":
+        for value in expression["values"]:
+            found = _hash_value(value, hash_key, params)
+            if found is not None:
+                return found
+        return None
+    values = expression["values"]
+    if expression["operator"] == "=" and values[0].name == hash_key:
+        return to_dynamodb_value(values[1])
+    return None
+
+
+class LocalDynamoDB:
+    """Plays the role of ``boto3.resource("dynamodb")``."""
+
+    def __init__(self, meter: CapacityMeter, call_latency_ms: float = 0.0):
+        self.meter = meter
+        self.call_latency_ms = call_latency_ms
+        self.tables: Dict[str, LocalTable] = {}
+        self.meta = SimpleNamespace(client=SimpleNamespace())
+
+    def create_table(self, name, key_name, indexes=None) -> LocalTable:
+        self.tables[name] = LocalTable(
+            name, key_name, self.meter, indexes, self.call_latency_ms
+        )
+        return self.tables[name]
+
+    def Table(self, name: str) -> LocalTable:
+        return self.tables[name]
+
+    def batch_get_item(self, RequestItems, **params):
+        if self.call_latency_ms:
+            time.sleep(self.call_latency_ms / 1000)
+        responses = {}
+        for name, request in RequestItems.items():
+            table = self.tables[name]
+            found = []
+            for key in request["Keys"]:
+                item = table.items.get(to_dynamodb_value(key[table.key_name]))
+                self.meter.add(read_units=read_units(item_size(item or {})))
+                if item is not None:
+                    found.append(
+                        project(
+                            item,
+                            request.get("ProjectionExpression"),
+                            request.get("ExpressionAttributeNames"),
+                        )
+                    )
+            responses[name] = found
+        return {"Responses": responses, "UnprocessedKeys": {}}
@@ -0,0 +1,418 @@
+"""Seeded local stand-ins for the AWS services and an API Gateway emulator.
+
+The real handler modules are imported with ``boto3.resource`` and
+``boto3.client`` patched, so every table and client they create at import
+time talks to the in-memory stack instead of AWS.
+"""
+
+import base64
+import contextlib
+import importlib
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional, Tuple
+from unittest import mock
+
+from tests.load.local_dynamodb import CapacityMeter, LocalDynamoDB, LocalIndex
+
+SRC_PATH = Path(__file__).resolve().parents[2] / "src"
+COMMON_LAYER_PATH = SRC_PATH / "common_layer" / "python"
+
+# Mirrors the GroupShardTimeIndex projection in template.yaml
+GROUP_SHARD_INDEX_ATTRIBUTES = (
+    "group_id",
+    "user_id",
+    "user_type",
+    "message_type",
+    "content",
+    "is_message",
+    "is_segment",
+    "is_end",
+    "is_resolved",
+    "segment_id",
+    "segment_name",
+    "start_timestamp",
+    "end_timestamp",
+)
+SEGMENT_STATUS_INDEX_ATTRIBUTES = (
+    "group_id",
+    "segment_id",
+    "segment_name",
+    "end_timestamp",
+    "is_resolved",
+)
+# Mirrors the SegmentGroupStatusIndex projection in template.yaml
+SEGMENT_GROUP_INDEX_ATTRIBUTES = SEGMENT_STATUS_INDEX_ATTRIBUTES + ("segment_status",)
+
+# "blocks" also packs each segment's messages the way put-log does
+MESSAGE_LAYOUTS = ("items", "blocks")
+
+# (method, path) -> (function directory, handler module)
+ROUTES = {
+    ("GET", "/segments"): ("list_segments_function", "list_segments"),
+    ("GET", "/messages"): (
+        "list_segment_messages_function",
+        "list_segment_messages",
+    ),
+    ("POST", "/tickets"): ("create_ticket_function", "create_ticket"),
+    ("GET", "/verify-registration"): (
+        "verify_registration_function",
+        "verify_registration",
+    ),
+}
+
+PHRASES = [
+    "印表機無法連線，請協助確認",
+    "VPN 連不上，錯誤代碼 809",
+    "請問帳號被鎖定要怎麼解除？",
+    "The deployment failed with AccessDenied on s3:PutObject",
+    "已經重開機了，還是一樣",
+    "Could you share the CloudWatch log group name?",
+    "好的，我這邊再試一次",
+    "EC2 instance i-0abc123 is stuck in pending",
+    "謝謝，問題解決了",
+    "Please attach a screenshot of the error",
+]
+
+
+class LocalS3:
+    def __init__(self):
+        self.objects: Dict[Tuple[str, str], bytes] = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[(Bucket, Key)] = Body if isinstance(Body, bytes) else Body.read()
+        return {"ETag": '"local"'}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        data = self.objects[(Bucket, Key)]
+        return {
+            "Body": SimpleNamespace(read=lambda: data),
+            "ContentLength": len(data),
+        }
+
+    def head_bucket(self, Bucket):
+        return {}
+
+
+class LocalSecretsManager:
+    def get_secret_value(self, SecretId):
+        return {"SecretString": "local-registration-secret"}
+
+
+class LocalSSM:
+    def get_parameter(self, Name, WithDecryption=False):
+        return {"Parameter": {"Name": Name, "Value": "local-api-key"}}
+
+
+class FakeTicketEndpoint:
+    """Replaces the external ticket API with a fixed response delay."""
+
+    def __init__(self, latency_ms: float):
+        self.latency_ms = latency_ms
+
+    def post(self, json=None, headers=None, deadline_ms=None):
+        time.sleep(self.latency_ms / 1000)
+        ticket = {"statusCode": 200, "ticket_id": uuid.uuid4().hex[:8]}
+        return SimpleNamespace(json=lambda: ticket)
+
+
+class LocalStack:
+    def __init__(
+        self,
+        groups: int = 20,
+        segments_per_group: int = 50,
+        messages_per_segment: int = 40,
+        users: int = 200,
+        dynamodb_latency_ms: float = 3.0,
+        ticket_api_latency_ms: float = 300.0,
+        seed: int = 0,
+        message_layout: str = "items",
+    ):
+        if message_layout not in MESSAGE_LAYOUTS:
+            raise ValueError(f"Unknown message layout: {message_layout}")
+        self.message_layout = message_layout
+        self.meter = CapacityMeter()
+        self.dynamodb = LocalDynamoDB(self.meter, dynamodb_latency_ms)
+        self.s3 = LocalS3()
+        self.ticket_api_latency_ms = ticket_api_latency_ms
+        self.random = random.Random(seed)
+        self.todam_table = self.dynamodb.create_table(
+            "todam_table",
+            "id",
+            {
+                "GroupShardTimeIndex": LocalIndex(
+                    "group_shard", "send_timestamp", GROUP_SHARD_INDEX_ATTRIBUTES
+                ),
+                "SegmentStatusStartIndex": LocalIndex(
+                    "segment_status", "start_timestamp", SEGMENT_STATUS_INDEX_ATTRIBUTES
+                ),
+                "SegmentGroupStatusIndex": LocalIndex(
+                    "group_status", "start_timestamp", SEGMENT_GROUP_INDEX_ATTRIBUTES
+                ),
+            },
+        )
+        self.registered_user_table = self.dynamodb.create_table(
+            "registered_user_table", "user_id"
+        )
+        self.dynamodb.create_table("todam_cache_version_table", "scope")
+        self.dynamodb.create_table("todam_group_shard_table", "group_id")
+        self.dynamodb.create_table("todam_search_index", "pk")
+
+        self.group_ids: List[str] = []
+        self.segment_ids: List[str] = []
+        # (user_id, email, apply_timestamp) of users with a pending link
+        self.registrations: List[Tuple[str, str, int]] = []
+        self._seed(groups, segments_per_group, messages_per_segment, users)
+        if message_layout == "blocks":
+            self._pack_segments()
+
+    def _seed(self, groups, segments_per_group, messages_per_segment, users):
+        rng = self.random
+        now = int(time.time() * 1000)
+        user_ids = [f"U{uuid.UUID(int=rng.getrandbits(128)).hex}" for _ in range(users)]
+        user_items = []
+        for index, user_id in enumerate(user_ids):
+            email = f"user{index}@ecloudvalley.com"
+            apply_timestamp = now - rng.randint(0, 3600 * 1000)
+            verified = index % 10 == 0
+            user_items.append(
+                {
+                    "user_id": user_id,
+                    "email": email,
+                    "name": f"user{index}",
+                    "apply_timestamp": apply_timestamp,
+                    "is_verified": verified,
+                }
+            )
+            if not verified:
+                self.registrations.append((user_id, email, apply_timestamp))
+        self.registered_user_table.load(user_items)
+
+        items = []
+        for _ in range(groups):
+            group_id = f"C{uuid.UUID(int=rng.getrandbits(128)).hex}"
+            self.group_ids.append(group_id)
+            members = rng.sample(user_ids, min(len(user_ids), 6))
+            timestamp = now - 90 * 24 * 3600 * 1000
+            for segment_index in range(segments_per_group):
+                segment_id = uuid.UUID(int=rng.getrandbits(128)).hex
+                start = timestamp
+                for _ in range(messages_per_segment):
+                    timestamp += rng.randint(5, 600) * 1000
+                    items.append(
+                        self._message(group_id, rng.choice(members), timestamp)
+                    )
+                timestamp += 1000
+                # The newest segment of a group is still being recorded
+                is_end = segment_index < segments_per_group - 1
+                segment = {
+                    "id": segment_id,
+                    "segment_id": segment_id,
+                    "s3_object_key": f"{time.strftime('%Y-%m-%d-%H-%M-%S')}.log",
+                    "start_timestamp": start,
+                    "group_id": group_id,
+                    "group_shard": group_id,
+                    "message_id": str(rng.getrandbits(60)),
+                    "user_id": members[0],
+                    "send_timestamp": start,
+                    "is_segment": True,
+                    "is_end": is_end,
+                    "segment_status": "ended" if is_end else "open",
+                }
+                segment["group_status"] = f"{group_id}#{segment['segment_status']}"
+                if is_end:
+                    segment["end_timestamp"] = timestamp
+                    segment["segment_name"] = f"segment-{segment_index}"
+                    segment["is_resolved"] = rng.random() < 0.7
+                    if segment["is_resolved"]:
+                        segment["segment_status"] = "resolved"
+                        del segment["group_status"]
+                    self.segment_ids.append(segment_id)
+                items.append(segment)
+                timestamp += rng.randint(3600, 48 * 3600) * 1000
+        self.todam_table.load(items)
+
+    def _pack_segments(self) -> None:
+        """Pack every seeded segment with the put-log function's packer."""
+        now = int(time.time() * 1000)
+        segments = [
+            item for item in self.todam_table.items.values() if item.get("is_segment")
+        ]
+        with local_handlers(self):
+            message_blocks = sys.modules["message_blocks"]
+            self.meter.label = "seed"
+            for segment in segments:
+                segment = {
+                    **segment,
+                    **message_blocks.new_segment_attributes(segment["start_timestamp"]),
+                }
+                seeded = [segment]
+                if not segment["is_end"]:
+                    # The recording segment's counter covers every message since
+                    tail = [
+                        item
+                        for item in self.todam_table.items.values()
+                        if item.get("is_message")
+                        and item["group_id"] == segment["group_id"]
+                        and item["send_timestamp"] >= segment["start_timestamp"]
+                    ]
+                    pointer = message_blocks.open_segment_item(
+                        segment["group_id"], segment["id"]
+                    )
+                    pointer["unpacked_count"] = len(tail)
+                    pointer["unpacked_bytes"] = sum(
+                        map(message_blocks.message_bytes, tail)
+                    )
+                    seeded.append(pointer)
+                self.todam_table.load(seeded)
+                message_blocks.pack_segment(
+                    self.todam_table, self.todam_table.items[segment["id"]], now
+                )
+
+    def _message(self, group_id: str, user_id: str, timestamp: int) -> dict:
+        rng = self.random
+        roll = rng.random()
+        if roll < 0.05:
+            message_type, content = "sticker", ""
+        elif roll < 0.15:
+            message_type = "image"
+            content = " ".join(rng.choice(PHRASES) for _ in range(rng.randint(3, 12)))
+        else:
+            message_type = "text"
+            content = " ".join(rng.choice(PHRASES) for _ in range(rng.randint(1, 3)))
+        item_id = uuid.UUID(int=rng.getrandbits(128)).hex
+        return {
+            "id": item_id,
+            "s3_object_key": f"{time.strftime('%Y-%m-%d-%H-%M-%S')}-{item_id[:6]}.log",
+            "message_type": message_type,
+            "message_id": str(rng.getrandbits(60)),
+            "content": content,
+            "group_id": group_id,
+            "group_shard": group_id,
+            "user_id": user_id,
+            "user_type": "TAM" if rng.random() < 0.3 else "Client",
+            "send_timestamp": timestamp,
+            "is_segment": False,
+            "is_message": True,
+        }
+
+    def client(self, service_name: str, *args, **kwargs):
+        if service_name == "s3":
+            return self.s3
+        if service_name == "ssm":
+            return LocalSSM()
+        if service_name == "secretsmanager":
+            return LocalSecretsManager()
+        # SES, SQS and Lambda are not on the read path
+        return mock.MagicMock(name=f"{service_name}-client")
+
+    def resource(self, service_name: str, *args, **kwargs):
+        assert service_name == "dynamodb", service_name
+        return self.dynamodb
+
+
+def _is_src_module(module) -> bool:
+    path = getattr(module, "__file__", None) or ""
+    return path.startswith(str(SRC_PATH))
+
+
+@contextlib.contextmanager
+def local_handlers(stack: LocalStack, env: Optional[Dict[str, str]] = None):
+    """Import the routed handlers against ``stack`` and yield them by route.
+
+    Handler modules already imported elsewhere, e.g. by unit tests, are set
+    aside and restored afterwards, so both sets can coexist in one process.
+    """
+    saved_modules = {
+        name: module for name, module in sys.modules.items() if _is_src_module(module)
+    }
+    for name in saved_modules:
+        del sys.modules[name]
+    saved_path = list(sys.path)
+    environment = {
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "S3_BUCKET": "todam-local",
+        "PROFILE_SAMPLE_RATE": "0",
+        "PRIME_ON_INIT": "false",
+        "GROUP_SHARD_READS_ENABLED": "true",
+        "SEGMENT_STATUS_READS_ENABLED": "true",
+        "SEGMENT_GROUP_READS_ENABLED": "true",
+        "REGISTRATION_TOKEN_SECRET_ARN": "local-registration-secret",
+        **(env or {}),
+    }
+    try:
+        sys.path[:0] = [str(COMMON_LAYER_PATH)] + [
+            str(SRC_PATH / function_dir) for function_dir, _ in ROUTES.values()
+        ]
+        with mock.patch.dict(os.environ, environment), mock.patch(
+            "boto3.resource", stack.resource
+        ), mock.patch("boto3.client", stack.client):
+            handlers = {}
+            for route, (_, module_name) in ROUTES.items():
+                module = importlib.import_module(module_name)
+                if module_name == "create_ticket":
+                    module.create_ticket_endpoint = FakeTicketEndpoint(
+                        stack.ticket_api_latency_ms
+                    )
+                handlers[route] = module.lambda_handler
+        yield handlers
+    finally:
+        for name, module in list(sys.modules.items()):
+            if _is_src_module(module):
+                del sys.modules[name]
+        sys.modules.update(saved_modules)
+        sys.path[:] = saved_path
+
+
+class LambdaContext:
+    def __init__(self, function_name: str, timeout_ms: int = 30000):
+        self.function_name = function_name
+        self.aws_request_id = uuid.uuid4().hex
+        self._deadline = time.monotonic() + timeout_ms / 1000
+
+    def get_remaining_time_in_millis(self) -> int:
+        return int((self._deadline - time.monotonic()) * 1000)
+
+
+class LocalGateway:
+    """Turn HTTP-style calls into API Gateway proxy events for the handlers."""
+
+    def __init__(self, handlers: Dict[Tuple[str, str], Callable]):
+        self.handlers = handlers
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        query: Optional[Dict[str, str]] = None,
+        body: Optional[dict] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> dict:
+        handler = self.handlers.get((method, path))
+        if handler is None:
+            return {"statusCode": 404, "body": "No route"}
+        event = {
+            "resource": path,
+            "path": path,
+            "httpMethod": method,
+            "headers": headers or {},
+            "queryStringParameters": query or None,
+            "body": json.dumps(body) if body is not None else None,
+            "isBase64Encoded": False,
+            "requestContext": {
+                "stage": "dev",
+                "requestId": uuid.uuid4().hex,
+                "httpMethod": method,
+                "path": f"/dev{path}",
+            },
+        }
+        response = handler(event, LambdaContext(path.strip("/")))
+        if response.get("isBase64Encoded"):
+            response = {**response, "body": base64.b64decode(response["body"])}
+        return response
@@ -0,0 +1,257 @@
+"""Drive a concurrent request mix through the local gateway and report per endpoint.
+
+    python -m tests.load.run_load_test --duration 30 --concurrency 16 \\
+        --mix segments=3,messages=5,text=1,tickets=0.5,verify=0.5
+
+Reported latencies include the simulated DynamoDB and ticket API delays,
+read units follow DynamoDB's 4 KB rounding for eventually consistent reads.
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from tests.load.local_stack import (
+    MESSAGE_LAYOUTS,
+    LocalGateway,
+    LocalStack,
+    local_handlers,
+)
+
+DEFAULT_MIX = "segments=3,messages=5,text=1,tickets=0.5,verify=0.5"
+
+
+def request_makers(stack: LocalStack, rng: random.Random) -> Dict[str, Callable]:
+    """Build a random request for each named request kind."""
+
+    def verification_link():
+        # Signed with the handlers' own registration_token module
+        issue_token = sys.modules["registration_token"].issue_token
+        return {"token": issue_token(*rng.choice(stack.registrations))}
+
+    return {
+        "segments": lambda: (
+            "GET",
+            "/segments",
+            {"group_id": rng.choice(stack.group_ids)},
+            None,
+        ),
+        "all_segments": lambda: ("GET", "/segments", {}, None),
+        "messages": lambda: (
+            "GET",
+            "/messages",
+            {"segment_id": rng.choice(stack.segment_ids)},
+            None,
+        ),
+        "text": lambda: (
+            "GET",
+            "/messages",
+            {"segment_id": rng.choice(stack.segment_ids), "output": "text"},
+            None,
+        ),
+        "tickets": lambda: (
+            "POST",
+            "/tickets",
+            None,
+            {
+                "segment_id": rng.choice(stack.segment_ids),
+                "ticket_subject": "Load test",
+                "ticket_description": "Created by the local load test",
+                "department_id": "1",
+            },
+        ),
+        "verify": lambda: (
+            "GET",
+            "/verify-registration",
+            verification_link(),
+            None,
+        ),
+    }
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_load_test(
+    stack: LocalStack,
+    mix: Dict[str, float],
+    concurrency: int = 8,
+    duration: float = 10.0,
+    max_requests: int = 0,
+    seed: int = 0,
+    env: Dict[str, str] = None,
+) -> Dict[str, dict]:
+    """Run the mix for ``duration`` seconds (or ``max_requests``) and summarise."""
+    rng = random.Random(seed)
+    unknown = set(mix) - set(request_makers(stack, rng))
+    if unknown:
+        raise ValueError(f"Unknown request kinds: {sorted(unknown)}")
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+    issued = 0
+    issued_lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    with local_handlers(stack, env) as handlers:
+        gateway = LocalGateway(handlers)
+        makers = request_makers(stack, rng)
+
+        def worker():
+            nonlocal issued
+            while time.monotonic() < deadline:
+                with issued_lock:
+                    if max_requests and issued >= max_requests:
+                        return
+                    issued += 1
+                    kind = rng.choices(kinds, weights)[0]
+                    method, path, query, body = makers[kind]()
+                stack.meter.label = kind
+                started = time.perf_counter()
+                try:
+                    status = gateway.request(method, path, query, body)["statusCode"]
+                except Exception:
+                    status = 599
+                latencies[kind].append((time.perf_counter() - started) * 1000)
+                statuses[kind][status] += 1
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for _ in range(concurrency):
+                executor.submit(worker)
+        elapsed = time.monotonic() - started
+
+    report = {}
+    for kind in kinds:
+        values = sorted(latencies[kind])
+        count = len(values)
+        report[kind] = {
+            "requests": count,
+            "errors": sum(n for s, n in statuses[kind].items() if s >= 500),
+            "statuses": dict(statuses[kind]),
+            "throughput_rps": round(count / elapsed, 1) if elapsed else 0.0,
+            "p50_ms": round(percentile(values, 0.50), 1),
+            "p90_ms": round(percentile(values, 0.90), 1),
+            "p99_ms": round(percentile(values, 0.99), 1),
+            "max_ms": round(values[-1], 1) if values else 0.0,
+            "read_units": round(stack.meter.read_units[kind], 1),
+            "read_units_per_request": (
+                round(stack.meter.read_units[kind] / count, 2) if count else 0.0
+            ),
+            "write_units": round(stack.meter.write_units[kind], 1),
+        }
+    return report
+
+
+def format_report(report: Dict[str, dict]) -> str:
+    columns = (
+        ("endpoint", 13),
+        ("requests", 9),
+        ("errors", 7),
+        ("rps", 8),
+        ("p50_ms", 8),
+        ("p90_ms", 8),
+        ("p99_ms", 8),
+        ("max_ms", 8),
+        ("RCU/req", 9),
+        ("RCU", 10),
+        ("WCU", 8),
+    )
+    lines = ["".join(name.rjust(width) for name, width in columns)]
+    for kind, row in report.items():
+        values = (
+            kind,
+            row["requests"],
+            row["errors"],
+            row["throughput_rps"],
+            row["p50_ms"],
+            row["p90_ms"],
+            row["p99_ms"],
+            row["max_ms"],
+            row["read_units_per_request"],
+            row["read_units"],
+            row["write_units"],
+        )
+        lines.append(
+            "".join(str(v).rjust(width) for v, (_, width) in zip(values, columns))
+        )
+    return "\n".join(lines)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-requests", type=int, default=0)
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--segments-per-group", type=int, default=50)
+    parser.add_argument("--messages-per-segment", type=int, default=40)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--dynamodb-latency-ms", type=float, default=3.0)
+    parser.add_argument("--ticket-api-latency-ms", type=float, default=300.0)
+    parser.add_argument(
+        "--cache-ttl",
+        default="2",
+        help="CACHE_TTL_SECONDS for the response cache; 0 revalidates every request",
+    )
+    parser.add_argument(
+        "--message-layout",
+        choices=MESSAGE_LAYOUTS,
+        default="items",
+        help="seed one item per message, or also pack them into blocks",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print the raw report")
+    args = parser.parse_args(argv)
+
+    started = time.monotonic()
+    stack = LocalStack(
+        groups=args.groups,
+        segments_per_group=args.segments_per_group,
+        messages_per_segment=args.messages_per_segment,
+        users=args.users,
+        dynamodb_latency_ms=args.dynamodb_latency_ms,
+        ticket_api_latency_ms=args.ticket_api_latency_ms,
+        seed=args.seed,
+        message_layout=args.message_layout,
+    )
+    print(
+        f"Seeded {len(stack.todam_table.items)} todam_table items in "
+        f"{time.monotonic() - started:.1f}s"
+    )
+
+    report = run_load_test(
+        stack,
+        parse_mix(args.mix),
+        concurrency=args.concurrency,
+        duration=args.duration,
+        max_requests=args.max_requests,
+        seed=args.seed,
+        env={"CACHE_TTL_SECONDS": args.cache_ttl},
+    )
+    print(json.dumps(report, indent=2) if args.json else format_report(report))
+
+
+if __name__ == "__main__":
+    main()
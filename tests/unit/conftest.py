@@ -0,0 +1,23 @@
+import os
+import sys
+from pathlib import Path
+
+SRC_PATH = Path(__file__).resolve().parents[2] / "src"
+
+# Lambda layers are mounted on the import path at runtime; mirror that here
+sys.path.insert(0, str(SRC_PATH / "common_layer" / "python"))
+
+# Handlers create boto3 clients at import time
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+# Read paths as they are once every staged index is serving; the tests of
+# the fallbacks switch them off explicitly
+os.environ.setdefault("GROUP_SHARD_READS_ENABLED", "true")
+os.environ.setdefault("SEGMENT_STATUS_READS_ENABLED", "true")
+os.environ.setdefault("SEGMENT_GROUP_READS_ENABLED", "true")
+
+
+def add_function_path(function_dir: str) -> None:
+    """Make the flat modules of a Lambda function importable."""
+    path = str(SRC_PATH / function_dir)
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,213 @@
+import json
+import os
+from unittest import mock
+
+import pytest
+from boto3.dynamodb.types import TypeSerializer
+
+from tests.load.local_dynamodb import CapacityMeter, LocalDynamoDB, LocalIndex
+from tests.load.local_stack import (
+    GROUP_SHARD_INDEX_ATTRIBUTES,
+    SEGMENT_STATUS_INDEX_ATTRIBUTES,
+)
+from tests.unit.conftest import add_function_path
+
+os.environ.setdefault("S3_BUCKET", "todam-local")
+add_function_path("archive_segments_function")
+add_function_path("index_messages_function")
+add_function_path("search_messages_function")
+
+import archive_segments  # noqa: E402
+import group_shards  # noqa: E402
+import index_messages  # noqa: E402
+import search_index  # noqa: E402
+import search_messages  # noqa: E402
+import segment_archive  # noqa: E402
+
+CUTOFF = 10_000
+
+
+def segment(segment_id, start, end, **attributes):
+    return {
+        "id": segment_id,
+        "segment_id": segment_id,
+        "group_id": "G1",
+        "group_shard": "G1",
+        "send_timestamp": start,
+        "start_timestamp": start,
+        "end_timestamp": end,
+        "is_segment": True,
+        "is_end": True,
+        **attributes,
+    }
+
+
+def message(send_timestamp):
+    return {
+        "id": f"m{send_timestamp}",
+        "group_id": "G1",
+        "group_shard": "G1",
+        "user_id": "U1",
+        "user_type": "Client",
+        "message_type": "text",
+        "content": f"message {send_timestamp}",
+        "send_timestamp": send_timestamp,
+        "is_message": True,
+    }
+
+
+@pytest.fixture()
+def table(monkeypatch):
+    table = LocalDynamoDB(CapacityMeter()).create_table(
+        "todam_table",
+        "id",
+        {
+            "GroupShardTimeIndex": LocalIndex(
+                "group_shard", "send_timestamp", GROUP_SHARD_INDEX_ATTRIBUTES
+            ),
+            "SegmentStatusStartIndex": LocalIndex(
+                "segment_status", "start_timestamp", SEGMENT_STATUS_INDEX_ATTRIBUTES
+            ),
+        },
+    )
+    monkeypatch.setattr(archive_segments, "table", table)
+    monkeypatch.setattr(group_shards, "get_shard_count", lambda group_id: 1)
+    return table
+
+
+@pytest.mark.parametrize("status_reads", [True, False])
+def test_finds_only_old_resolved_segments_that_are_not_archived(
+    table, monkeypatch, status_reads
+):
+    monkeypatch.setattr(archive_segments, "STATUS_READS_ENABLED", status_reads)
+    table.load(
+        [
+            segment("S1", 1000, 2000, is_resolved=True, segment_status="resolved"),
+            segment("S2", 3000, 4000, segment_status="ended"),
+            segment("S3", 5000, 6000, is_resolved=True, archived_at=7000),
+            # Started before the cutoff but still ran past it
+            segment("S4", 9000, 11000, is_resolved=True, segment_status="resolved"),
+            segment("S5", 12000, 13000, is_resolved=True, segment_status="resolved"),
+            segment(
+                "S6",
+                1500,
+                2500,
+                is_resolved=True,
+                segment_status="resolved",
+                archive_key="archive/G1/S6.json.gz",
+            ),
+        ]
+    )
+
+    found = list(archive_segments.find_archivable_segments(CUTOFF))
+
+    assert [item["id"] for item in found] == ["S1", "S6"]
+    assert found[1]["archive_key"] == "archive/G1/S6.json.gz"
+
+
+def test_archive_segment_moves_messages_to_s3(table):
+    resolved = segment(
+        "S1", 1000, 2000, is_resolved=True, segment_status="resolved", block_count=1
+    )
+    table.load(
+        [resolved, {"id": "S1#block#0"}]
+        + [message(timestamp) for timestamp in (1000, 1500, 2000, 2500)]
+    )
+
+    with mock.patch.object(archive_segments, "s3") as s3:
+        archived = archive_segments.archive_segment(
+            next(archive_segments.find_archivable_segments(CUTOFF))
+        )
+
+    assert archived == 3
+    body = s3.put_object.call_args.kwargs["Body"]
+    s3.get_object.return_value = {"Body": mock.Mock(read=mock.Mock(return_value=body))}
+    messages = segment_archive.read_archived_messages(s3, "b", "archive/G1/S1.json.gz")
+    assert [m["id"] for m in messages] == ["m1000", "m1500", "m2000"]
+
+    item = table.items["S1"]
+    assert item["archive_key"] == "archive/G1/S1.json.gz"
+    assert "archived_at" in item
+    assert "segment_status" not in item
+    assert all("expires_at" in table.items[f"m{t}"] for t in (1000, 1500, 2000))
+    assert "expires_at" in table.items["S1#block#0"]
+    assert "expires_at" not in table.items["m2500"]
+    assert list(archive_segments.find_archivable_segments(CUTOFF)) == []
+
+
+def stream_record(event_name, image, **record):
+    serializer = TypeSerializer()
+    return {
+        "eventName": event_name,
+        "dynamodb": {
+            "OldImage": {name: serializer.serialize(v) for name, v in image.items()}
+        },
+        **record,
+    }
+
+
+def test_expired_messages_stay_searchable(monkeypatch):
+    index = search_index.SearchIndex(search_index.InMemoryIndexStore())
+    index.index_message("G1", "m1000", 1000, "message 1000")
+    monkeypatch.setattr(index_messages, "search_index", index)
+    expired = stream_record(
+        "REMOVE",
+        message(1000),
+        userIdentity={"type": "Service", "principalId": "dynamodb.amazonaws.com"},
+    )
+
+    index_messages.apply_record(expired)
+    assert index.search("G1", "message")["messages"]
+
+    index_messages.apply_record(stream_record("REMOVE", message(1000)))
+    assert not index.search("G1", "message")["messages"]
+
+
+def test_archived_hits_are_read_from_the_archive(monkeypatch):
+    dynamodb = LocalDynamoDB(CapacityMeter())
+    table = dynamodb.create_table(
+        "todam_table",
+        "id",
+        {
+            "GroupShardTimeIndex": LocalIndex(
+                "group_shard", "send_timestamp", GROUP_SHARD_INDEX_ATTRIBUTES
+            ),
+            "SegmentStatusStartIndex": LocalIndex(
+                "segment_status", "start_timestamp", SEGMENT_STATUS_INDEX_ATTRIBUTES
+            ),
+        },
+    )
+    resolved = segment("S1", 1000, 2000, is_resolved=True, segment_status="resolved")
+    messages = [message(timestamp) for timestamp in (1000, 1500)]
+    table.load([resolved] + messages)
+    index = search_index.build_index(
+        search_index.InMemoryIndexStore(), [resolved] + messages
+    )
+    objects = {}
+    s3 = mock.Mock()
+    s3.put_object.side_effect = lambda Key, Body, **kwargs: objects.update({Key: Body})
+    s3.get_object.side_effect = lambda Key, **kwargs: {
+        "Body": mock.Mock(read=mock.Mock(return_value=objects[Key]))
+    }
+    monkeypatch.setattr(archive_segments, "table", table)
+    monkeypatch.setattr(archive_segments, "s3", s3)
+    monkeypatch.setattr(group_shards, "get_shard_count", lambda group_id: 1)
+    monkeypatch.setattr(search_messages, "dynamodb", dynamodb)
+    monkeypatch.setattr(search_messages, "table", table)
+    monkeypatch.setattr(search_messages, "s3", s3)
+    monkeypatch.setattr(search_messages, "search_index", index)
+
+    archive_segments.archive_segment(
+        next(archive_segments.find_archivable_segments(CUTOFF))
+    )
+    # TTL removes the message items once the grace period is over
+    for item in messages:
+        table.delete_item(Key={"id": item["id"]})
+    response = search_messages.lambda_handler(
+        {"queryStringParameters": {"group_id": "G1", "q": "message 1500"}}, None
+    )
+
+    hit = json.loads(response["body"])["messages"][0]
+    assert hit["message_id"] == "m1500"
+    assert hit["content"] == "message 1500"
+    assert hit["user_id"] == "U1"
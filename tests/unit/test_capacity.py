@@ -0,0 +1,127 @@
+import json
+
+import boto3
+from botocore.stub import Stubber
+
+import capacity
+import group_shards
+import response_cache
+
+
+def tracked_table():
+    dynamodb = boto3.resource("dynamodb", region_name="us-east-1")
+    capacity.track(dynamodb)
+    table = dynamodb.Table("todam_table")
+    return table, Stubber(dynamodb.meta.client)
+
+
+def test_calls_request_capacity_and_are_accounted_per_group(capsys):
+    table, stubber = tracked_table()
+    stubber.add_response(
+        "get_item",
+        {
+            "Item": {"group_id": {"S": "G1"}},
+            "ConsumedCapacity": {"TableName": "todam_table", "CapacityUnits": 0.5},
+        },
+        {
+            "TableName": "todam_table",
+            "Key": {"id": "S1"},
+            "ReturnConsumedCapacity": "TOTAL",
+        },
+    )
+    stubber.add_response(
+        "update_item",
+        {"ConsumedCapacity": {"TableName": "todam_table", "CapacityUnits": 2.0}},
+    )
+
+    @capacity.accounted
+    def handler(event, context):
+        table.get_item(Key={"id": "S1"})
+        # The segment read above is charged to the group it revealed
+        capacity.set_group("G1")
+        table.update_item(
+            Key={"id": "S1"},
+            UpdateExpression="SET is_resolved = :r",
+            ExpressionAttributeValues={":r": True},
+        )
+        return "done"
+
+    with stubber:
+        assert handler({}, None) == "done"
+
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    usage = {
+        record["Operation"]: (
+            record["GroupId"],
+            record["ReadCapacityUnits"],
+            record["WriteCapacityUnits"],
+        )
+        for record in records
+    }
+    assert usage == {"GetItem": ("G1", 0.5, 0.0), "UpdateItem": ("G1", 0.0, 2.0)}
+    assert records[0]["_aws"]["CloudWatchMetrics"][0]["Namespace"] == "Todam/DynamoDB"
+    assert capacity.drain() == {}
+
+
+def test_calls_of_several_groups_stay_apart():
+    table, stubber = tracked_table()
+    for units in (1.0, 3.0):
+        stubber.add_response(
+            "query",
+            {
+                "Items": [],
+                "ConsumedCapacity": {
+                    "TableName": "todam_table",
+                    "CapacityUnits": units,
+                },
+            },
+        )
+
+    with stubber:
+        for group_id in ("G1", "G2"):
+            capacity.set_group(group_id)
+            table.query(
+                IndexName="GroupShardTimeIndex",
+                KeyConditionExpression="group_shard = :g",
+                ExpressionAttributeValues={":g": group_id},
+            )
+
+    assert capacity.drain() == {
+        ("G1", "todam_table", "Query"): [1.0, 0.0, 1],
+        ("G2", "todam_table", "Query"): [3.0, 0.0, 1],
+    }
+
+
+def test_shard_and_cache_version_calls_are_accounted(monkeypatch):
+    monkeypatch.setattr(group_shards, "_shard_counts", {})
+    shard_stubber = Stubber(group_shards.dynamodb.meta.client)
+    shard_stubber.add_response(
+        "get_item",
+        {
+            "ConsumedCapacity": {
+                "TableName": "todam_group_shard_table",
+                "CapacityUnits": 0.5,
+            }
+        },
+    )
+    version_stubber = Stubber(response_cache.dynamodb.meta.client)
+    version_stubber.add_response(
+        "update_item",
+        {
+            "ConsumedCapacity": {
+                "TableName": "todam_cache_version_table",
+                "CapacityUnits": 1.0,
+            }
+        },
+    )
+
+    capacity.drain()
+    capacity.set_group("G1")
+    with shard_stubber, version_stubber:
+        group_shards.choose_shard_key("G1", "m1")
+        response_cache.bump_versions(response_cache.messages_scope("G1"))
+
+    assert capacity.drain() == {
+        ("G1", "todam_group_shard_table", "GetItem"): [0.5, 0.0, 1],
+        ("G1", "todam_cache_version_table", "UpdateItem"): [0.0, 1.0, 1],
+    }
@@ -0,0 +1,187 @@
+import io
+import json
+import os
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+from botocore.exceptions import ClientError
+
+from tests.unit.conftest import add_function_path
+
+os.environ.setdefault("S3_BUCKET", "todam-local")
+add_function_path("compact_line_logs_function")
+
+import compact_line_logs  # noqa: E402
+
+HOUR = datetime(2024, 4, 23, 1, tzinfo=timezone.utc)
+
+
+class FakeS3:
+    """The subset of the S3 client the compaction job calls."""
+
+    exceptions = SimpleNamespace(ClientError=ClientError)
+
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+
+    def upload_fileobj(self, fileobj, bucket, key, ExtraArgs=None):
+        self.objects[key] = fileobj.read()
+
+    def get_object(self, Bucket, Key, Range=None):
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        data = self.objects[Key]
+        if Range:
+            start, end = map(int, Range[len("bytes=") :].split("-"))
+            data = data[start : end + 1]
+        stream = io.BytesIO(data)
+        return {
+            "Body": SimpleNamespace(
+                read=stream.read,
+                iter_chunks=lambda chunk_size: iter(
+                    lambda: stream.read(chunk_size), b""
+                ),
+            )
+        }
+
+    def get_paginator(self, operation):
+        keys = sorted(self.objects)
+        return SimpleNamespace(
+            paginate=lambda Bucket, Prefix: [
+                {"Contents": [{"Key": key} for key in keys if key.startswith(Prefix)]}
+            ]
+        )
+
+    def delete_objects(self, Bucket, Delete):
+        for obj in Delete["Objects"]:
+            self.objects.pop(obj["Key"], None)
+
+
+@pytest.fixture()
+def s3(monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(compact_line_logs, "s3", s3)
+    monkeypatch.setattr(compact_line_logs, "BLOCK_SIZE", 512)
+    return s3
+
+
+def raw_log(s3, key, group_id, text):
+    log = {
+        "events": [
+            {
+                "message": {"type": "text", "text": text},
+                "source": {"groupId": group_id},
+                "timestamp": 1713836706000,
+            }
+        ]
+    }
+    s3.objects[key] = json.dumps(log).encode("utf-8")
+    return log
+
+
+def test_compaction_round_trips_and_deletes_originals(s3):
+    logs = {
+        f"2024-04-23-01-{n:02d}-00.log": raw_log(
+            s3, f"2024-04-23-01-{n:02d}-00.log", f"G{n % 2}", "印表機" * 40
+        )
+        for n in range(20)
+    }
+
+    summary = compact_line_logs.compact_hour(HOUR)
+
+    assert summary == {
+        "G0": {"logs": 10, "verified": True},
+        "G1": {"logs": 10, "verified": True},
+    }
+    assert not any(key in s3.objects for key in logs)
+    index = json.loads(s3.objects["compacted/G1/2024/04/23/01.index.json"])
+    assert len(index["blocks"]) > 1
+    for key, log in logs.items():
+        group_id = log["events"][0]["source"]["groupId"]
+        assert compact_line_logs.read_compacted_log(group_id, HOUR, key) == log
+
+
+def test_corrupt_block_fails_verification_and_keeps_originals(s3):
+    key = "2024-04-23-01-00-00.log"
+    raw_log(s3, key, "G1", "hello")
+    upload = s3.upload_fileobj
+
+    def corrupt_upload(fileobj, bucket, data_key, ExtraArgs=None):
+        upload(fileobj, bucket, data_key, ExtraArgs)
+        data = s3.objects[data_key]
+        s3.objects[data_key] = data[:10] + bytes(len(data) - 20) + data[-10:]
+
+    with mock.patch.object(s3, "upload_fileobj", corrupt_upload):
+        summary = compact_line_logs.compact_hour(HOUR)
+
+    assert summary == {"G1": {"logs": 1, "verified": False}}
+    assert key in s3.objects
+    assert "compacted/G1/2024/04/23/01.index.json" not in s3.objects
+
+
+def test_truncated_upload_fails_verification(s3):
+    key = "2024-04-23-01-00-00.log"
+    raw_log(s3, key, "G1", "hello " * 50)
+    upload = s3.upload_fileobj
+
+    def truncated_upload(fileobj, bucket, data_key, ExtraArgs=None):
+        upload(fileobj, bucket, data_key, ExtraArgs)
+        s3.objects[data_key] = s3.objects[data_key][:-8]
+
+    with mock.patch.object(s3, "upload_fileobj", truncated_upload):
+        summary = compact_line_logs.compact_hour(HOUR)
+
+    assert summary == {"G1": {"logs": 1, "verified": False}}
+    assert key in s3.objects
+
+
+def test_tampered_record_fails_verification(s3):
+    key = "2024-04-23-01-00-00.log"
+    raw_log(s3, key, "G1", "hello")
+
+    with mock.patch.object(compact_line_logs, "digest", side_effect=["a", "b"]):
+        summary = compact_line_logs.compact_hour(HOUR)
+
+    assert summary == {"G1": {"logs": 1, "verified": False}}
+    assert key in s3.objects
+
+
+def test_late_originals_are_compacted_into_a_new_part(s3):
+    first = raw_log(s3, "2024-04-23-01-00-00.log", "G1", "first")
+    compact_line_logs.compact_hour(HOUR)
+    late = raw_log(s3, "2024-04-23-01-59-59.log", "G1", "late")
+
+    with mock.patch.object(compact_line_logs, "datetime") as clock:
+        clock.now.return_value = datetime(2024, 4, 23, 3, 30, tzinfo=timezone.utc)
+        body = json.loads(compact_line_logs.lambda_handler({}, None)["body"])
+
+    assert body["late"] == {"2024-04-23-01": {"G1": {"logs": 1, "verified": True}}}
+    assert "compacted/G1/2024/04/23/01.1.index.json" in s3.objects
+    assert "2024-04-23-01-59-59.log" not in s3.objects
+    read = compact_line_logs.read_compacted_log
+    assert read("G1", HOUR, "2024-04-23-01-00-00.log") == first
+    assert read("G1", HOUR, "2024-04-23-01-59-59.log") == late
+
+
+def test_groups_are_spooled_one_at_a_time(s3):
+    for n in range(6):
+        raw_log(s3, f"2024-04-23-01-00-0{n}.log", f"G{n}", "hello")
+    open_writers = []
+    writer_class = compact_line_logs.BlockWriter
+
+    class TrackedWriter(writer_class):
+        def __init__(self):
+            super().__init__()
+            open_writers.append(self)
+            assert sum(not writer.output.closed for writer in open_writers) == 1
+
+    with mock.patch.object(compact_line_logs, "BlockWriter", TrackedWriter):
+        compact_line_logs.compact_hour(HOUR)
+
+    assert len(open_writers) == 6
+    assert all(writer.output.closed for writer in open_writers)
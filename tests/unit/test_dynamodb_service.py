@@ -0,0 +1,118 @@
+import os
+
+import pytest
+
+from tests.load.local_dynamodb import CapacityMeter, LocalDynamoDB, LocalIndex
+from tests.load.local_stack import GROUP_SHARD_INDEX_ATTRIBUTES
+from tests.unit.conftest import add_function_path
+
+os.environ.setdefault("PARSE_IMAGE_FIFO_QUEUE_URL", "https://sqs.local/parse.fifo")
+os.environ.setdefault("S3_BUCKET", "todam-local")
+add_function_path("put_line_log_to_db_function")
+
+import dynamodb_service  # noqa: E402
+import group_shards  # noqa: E402
+from dynamodb_util import projection_params  # noqa: E402
+
+
+def segment(segment_id, start_timestamp, **attributes):
+    return {
+        "id": segment_id,
+        "segment_id": segment_id,
+        "group_id": "G1",
+        "group_shard": "G1",
+        "send_timestamp": start_timestamp,
+        "start_timestamp": start_timestamp,
+        "s3_object_key": f"{segment_id}.log",
+        "is_segment": True,
+        "is_end": False,
+        **attributes,
+    }
+
+
+@pytest.fixture()
+def table(monkeypatch):
+    dynamodb = LocalDynamoDB(CapacityMeter())
+    table = dynamodb.create_table(
+        "todam_table",
+        "id",
+        {
+            "GroupTimeIndex": LocalIndex("group_id", "send_timestamp", None),
+            "GroupShardTimeIndex": LocalIndex(
+                "group_shard", "send_timestamp", GROUP_SHARD_INDEX_ATTRIBUTES
+            ),
+        },
+    )
+    monkeypatch.setattr(dynamodb_service, "todam_table", table)
+    return table
+
+
+def test_projection_params_use_placeholders_for_reserved_words():
+    assert projection_params("name", "data") == {
+        "ProjectionExpression": "#p0, #p1",
+        "ExpressionAttributeNames": {"#p0": "name", "#p1": "data"},
+    }
+
+
+def test_open_segment_query_returns_only_projected_attributes(table):
+    table.load(
+        [
+            segment("S1", 100, is_end=True, end_timestamp=200),
+            segment("S2", 300),
+            {
+                "id": "M1",
+                "group_id": "G1",
+                "group_shard": "G1",
+                "send_timestamp": 310,
+                "is_message": True,
+            },
+        ]
+    )
+
+    items = dynamodb_service.query_todam_table("G1")["Items"]
+
+    assert items == [{"id": "S2", "segment_id": "S2", "start_timestamp": 300}]
+
+
+def test_open_segments_are_found_before_the_group_shard_backfill(table, monkeypatch):
+    monkeypatch.setattr(group_shards, "SHARD_READS_ENABLED", False)
+    legacy = segment("S1", 100)
+    del legacy["group_shard"]
+    table.load([legacy])
+
+    items = dynamodb_service.query_todam_table("G1")["Items"]
+
+    assert [item["id"] for item in items] == ["S1"]
+
+
+def test_end_segment_updates_the_segment_in_place(table):
+    table.load([segment("S1", 100, segment_status="open")])
+
+    dynamodb_service.end_segment("S1", 200, "printer offline", "G1")
+
+    item = table.items["S1"]
+    assert item["is_end"] is True
+    assert item["is_message"] is False
+    assert item["end_timestamp"] == 200
+    assert item["segment_name"] == "printer offline"
+    assert item["segment_status"] == "ended"
+    assert item["group_status"] == "G1#ended"
+    # Attributes the update does not name are kept
+    assert item["s3_object_key"] == "S1.log"
+
+
+@pytest.mark.parametrize("image_first", [True, False])
+def test_image_parse_is_paired_by_whichever_half_arrives_last(table, image_first):
+    halves = [{"image_key": "jpg/123.jpg"}, {"dynamodb_item_id": "M1"}]
+    if not image_first:
+        halves.reverse()
+
+    first, second = (
+        dynamodb_service.pair_image_parse("123", **half) for half in halves
+    )
+
+    assert first is None
+    assert second["image_key"] == "jpg/123.jpg"
+    assert second["dynamodb_item_id"] == "M1"
+    assert second["message_id"] == "123"
+    assert "expires_at" in table.items["image_parse#123"]
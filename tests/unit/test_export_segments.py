@@ -0,0 +1,150 @@
+import gzip
+import json
+import os
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+from tests.unit.conftest import add_function_path
+
+os.environ.setdefault("S3_BUCKET", "todam-local")
+add_function_path("export_segments_function")
+
+import export_segments  # noqa: E402
+
+
+@pytest.fixture()
+def s3():
+    with mock.patch.object(export_segments, "s3") as s3:
+        s3.create_multipart_upload.return_value = {"UploadId": "upload-1"}
+        s3.upload_part.side_effect = lambda **kwargs: {
+            "ETag": f"etag-{kwargs['PartNumber']}"
+        }
+        yield s3
+
+
+def uploaded_parts(s3):
+    return [call.kwargs["Body"] for call in s3.upload_part.call_args_list]
+
+
+def statuses(s3):
+    return [
+        json.loads(call.kwargs["Body"])
+        for call in s3.put_object.call_args_list
+        if call.kwargs["Key"].endswith(".status.json")
+    ]
+
+
+def test_writer_uploads_parts_of_at_least_part_size(s3):
+    writer = export_segments.GzipMultipartWriter("bucket", "key", part_size=1024)
+    lines = [os.urandom(300).hex().encode() + b"\n" for _ in range(400)]
+    for line in lines:
+        writer.write(line)
+    writer.close()
+
+    parts = uploaded_parts(s3)
+    assert len(parts) > 2
+    assert all(len(part) >= 1024 for part in parts[:-1])
+    assert gzip.decompress(b"".join(parts)) == b"".join(lines)
+    assert s3.complete_multipart_upload.call_args.kwargs["MultipartUpload"] == {
+        "Parts": [
+            {"ETag": f"etag-{number}", "PartNumber": number}
+            for number in range(1, len(parts) + 1)
+        ]
+    }
+
+
+def test_query_all_follows_pages():
+    pages = [
+        {"Items": [{"id": "a"}], "LastEvaluatedKey": {"id": "a"}},
+        {"Items": [{"id": "b"}]},
+    ]
+    with mock.patch.object(export_segments, "table") as table:
+        table.query.side_effect = pages
+        items = list(export_segments.query_all(IndexName="index"))
+
+    assert items == [{"id": "a"}, {"id": "b"}]
+    assert table.query.call_args_list[1].kwargs["ExclusiveStartKey"] == {"id": "a"}
+
+
+def segment(segment_id, start, end):
+    return {
+        "segment_id": segment_id,
+        "start_timestamp": Decimal(start),
+        "end_timestamp": Decimal(end),
+    }
+
+
+def test_export_streams_segments_and_marks_completion(s3):
+    messages = [{"content": "hi", "send_timestamp": Decimal(150)}]
+    with mock.patch.object(
+        export_segments, "query_all", return_value=iter([segment("S1", 100, 200)])
+    ), mock.patch.object(export_segments, "iter_group", return_value=iter(messages)):
+        counts = export_segments.export_segments(
+            "G1", 0, 1000, "exports/G1/x.ndjson.gz"
+        )
+
+    assert counts == {"segment_count": 1, "message_count": 1}
+    records = gzip.decompress(b"".join(uploaded_parts(s3))).decode().splitlines()
+    assert [json.loads(record)["type"] for record in records] == ["segment", "message"]
+    assert statuses(s3)[-1]["status"] == "completed"
+    assert s3.put_object.call_args.kwargs["Key"] == "exports/G1/x.status.json"
+
+
+def test_archived_segments_are_exported_from_s3(s3):
+    archive = {"messages": [{"id": "m150", "content": "hi", "send_timestamp": 150}]}
+    s3.get_object.return_value = {
+        "Body": mock.Mock(
+            read=mock.Mock(
+                return_value=gzip.compress(json.dumps(archive).encode("utf-8"))
+            )
+        )
+    }
+    resolved = {**segment("S1", 100, 200), "id": "S1", "is_resolved": True}
+    with mock.patch.object(
+        export_segments, "query_all", return_value=iter([resolved])
+    ), mock.patch.object(export_segments, "table") as table, mock.patch.object(
+        export_segments, "iter_group"
+    ) as iter_group:
+        table.get_item.return_value = {"Item": {"archive_key": "archive/G1/S1.json.gz"}}
+        counts = export_segments.export_segments(
+            "G1", 0, 1000, "exports/G1/x.ndjson.gz"
+        )
+
+    iter_group.assert_not_called()
+    assert counts == {"segment_count": 1, "message_count": 1}
+    records = gzip.decompress(b"".join(uploaded_parts(s3))).decode().splitlines()
+    assert json.loads(records[1])["content"] == "hi"
+
+
+def test_failed_export_aborts_upload_and_marks_failure(s3):
+    with mock.patch.object(
+        export_segments, "query_all", side_effect=RuntimeError("throttled")
+    ):
+        with pytest.raises(RuntimeError):
+            export_segments.export_segments("G1", 0, 1000, "exports/G1/x.ndjson.gz")
+
+    s3.abort_multipart_upload.assert_called_once()
+    s3.complete_multipart_upload.assert_not_called()
+    assert statuses(s3) == [
+        {"status": "failed", "error": "throttled", "updated_at": mock.ANY}
+    ]
+
+
+def test_request_returns_export_and_status_urls(s3):
+    s3.generate_presigned_url.side_effect = lambda _, Params, ExpiresIn: Params["Key"]
+    with mock.patch.object(export_segments, "lambda_client") as lambda_client:
+        response = export_segments.lambda_handler(
+            {"queryStringParameters": {"group_id": "G1"}},
+            SimpleNamespace(function_name="todam-export-segments"),
+        )
+
+    body = json.loads(response["body"])
+    assert response["statusCode"] == 202
+    assert body["url"].endswith(f"{body['export_id']}.ndjson.gz")
+    assert body["status_url"].endswith(f"{body['export_id']}.status.json")
+    assert statuses(s3) == [{"status": "running", "updated_at": mock.ANY}]
+    job = json.loads(lambda_client.invoke.call_args.kwargs["Payload"])["export_job"]
+    assert job["key"] == body["url"]
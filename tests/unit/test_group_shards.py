@@ -0,0 +1,114 @@
+import json
+import threading
+import time
+from unittest import mock
+
+import boto3
+import pytest
+from boto3.dynamodb.conditions import Attr, ConditionExpressionBuilder, Key
+from botocore.awsrequest import AWSResponse
+
+from tests.load.local_dynamodb import CapacityMeter, LocalDynamoDB
+
+import group_shards  # noqa: E402
+
+MINUTE = 28_000_000
+
+
+@pytest.fixture()
+def shard_table(monkeypatch):
+    table = LocalDynamoDB(CapacityMeter()).create_table(
+        "todam_group_shard_table", "group_id"
+    )
+    monkeypatch.setattr(group_shards, "group_shard_table", table)
+    monkeypatch.setattr(group_shards, "SHARD_WRITES_PER_SECOND", 10)
+    group_shards._shard_counts.clear()
+    group_shards._pending_writes.clear()
+    group_shards._finished_minutes.clear()
+    return table
+
+
+def write(group_id, count, now):
+    with mock.patch.object(group_shards.time, "time", return_value=now):
+        for _ in range(count):
+            group_shards.record_write(group_id)
+
+
+def test_rate_counts_the_previous_minute_early_in_the_next(shard_table):
+    # 15 writes/s through the previous minute, 5 s into the current one
+    shard_table.load([{"group_id": f"G1#rate#{MINUTE - 1}", "write_count": 900}])
+
+    write("G1", 80, MINUTE * 60 + 5)
+
+    assert shard_table.items["G1"]["shard_count"] == 2
+
+
+def test_short_burst_does_not_shard(shard_table):
+    write("G1", 80, MINUTE * 60 + 5)
+
+    assert "G1" not in shard_table.items
+
+
+class RawBody:
+    def __init__(self, data):
+        self.data = data
+
+    def stream(self, **kwargs):
+        yield self.data
+
+
+def test_concurrent_shard_queries_keep_their_own_placeholders(monkeypatch):
+    # A real client, so the expressions go through boto3's serializer
+    table = boto3.resource(
+        "dynamodb",
+        region_name="us-east-1",
+        aws_access_key_id="local",
+        aws_secret_access_key="local",
+    ).Table("todam_table")
+    requests = []
+    lock = threading.Lock()
+
+    def send(request, **kwargs):
+        with lock:
+            requests.append(json.loads(request.body))
+        return AWSResponse(request.url, 200, {}, RawBody(b'{"Items": [], "Count": 0}'))
+
+    table.meta.client.meta.events.register("before-send.dynamodb.Query", send)
+    monkeypatch.setattr(group_shards, "get_shard_count", lambda group_id: 8)
+    # Widen the window in which concurrent builds interleave
+    build_name = ConditionExpressionBuilder._build_name_placeholder
+
+    def slow_build_name(self, *args, **kwargs):
+        time.sleep(0.002)
+        return build_name(self, *args, **kwargs)
+
+    monkeypatch.setattr(
+        ConditionExpressionBuilder, "_build_name_placeholder", slow_build_name
+    )
+
+    group_shards.query_group(
+        table,
+        "G1",
+        Key("send_timestamp").between(100, 200),
+        FilterExpression=Attr("is_message").eq(True),
+    )
+
+    assert len(requests) == 8
+    shards = set()
+    for request in requests:
+        names = request["ExpressionAttributeNames"]
+        values = request["ExpressionAttributeValues"]
+
+        def resolve(expression):
+            for placeholder, name in names.items():
+                expression = expression.replace(placeholder, name)
+            for placeholder, value in values.items():
+                expression = expression.replace(placeholder, json.dumps(value))
+            return expression
+
+        key_condition = resolve(request["KeyConditionExpression"])
+        assert key_condition.startswith('(group_shard = {"S": "G1')
+        assert 'send_timestamp BETWEEN {"N": "100"} AND {"N": "200"}' in key_condition
+        assert resolve(request["FilterExpression"]) == 'is_message = {"BOOL": true}'
+        shards.add(values[request["KeyConditionExpression"].split()[2]]["S"])
+    assert shards == {group_shards.shard_key("G1", shard) for shard in range(8)}
@@ -0,0 +1,101 @@
+import io
+import os
+from unittest import mock
+
+import pytest
+from PIL import Image
+
+from tests.unit.conftest import add_function_path
+
+os.environ.setdefault("PARSE_IMAGE_FIFO_QUEUE_URL", "https://sqs.local/parse.fifo")
+os.environ.setdefault("S3_BUCKET", "todam-local")
+add_function_path("parse_image_function")
+add_function_path("put_line_log_to_db_function")
+
+import image_preprocess  # noqa: E402
+import put_line_log_to_db  # noqa: E402
+
+
+def encode_image(size, image_format="JPEG", mode="RGB", orientation=None):
+    image = Image.new(mode, size, (200, 30, 30, 128)[: len(mode)])
+    output = io.BytesIO()
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    image.save(output, format=image_format, exif=exif)
+    return output.getvalue()
+
+
+@pytest.fixture()
+def s3():
+    with mock.patch.object(image_preprocess, "s3") as s3, mock.patch.multiple(
+        image_preprocess,
+        IMAGE_PREPROCESS_ENABLED=True,
+        IMAGE_MAX_DIMENSION=100,
+        IMAGE_PREPROCESS_MIN_BYTES=0,
+    ):
+        yield s3
+
+
+def serve(s3, data):
+    s3.head_object.return_value = {"ContentLength": len(data)}
+    s3.download_fileobj.side_effect = lambda bucket, key, spool: spool.write(data)
+
+
+def stored_image(s3):
+    return Image.open(io.BytesIO(s3.put_object.call_args.kwargs["Body"]))
+
+
+def test_downsamples_and_applies_exif_orientation(s3):
+    # Orientation 6 is a portrait photo stored rotated by 90 degrees
+    serve(s3, encode_image((800, 400), orientation=6))
+
+    key = image_preprocess.prepare_image_for_parsing("bucket", "jpg/photo.jpg")
+
+    assert key == "jpg/photo.derivative.jpg"
+    assert stored_image(s3).size == (50, 100)
+
+
+def test_flattens_transparent_images_to_jpeg(s3):
+    serve(s3, encode_image((300, 300), image_format="PNG", mode="RGBA"))
+
+    key = image_preprocess.prepare_image_for_parsing("bucket", "jpg/sticker.gif")
+
+    assert key == "jpg/sticker.derivative.jpg"
+    assert stored_image(s3).mode == "RGB"
+
+
+def test_small_images_are_sent_as_is(s3):
+    data = encode_image((80, 60))
+    serve(s3, data)
+
+    with mock.patch.object(
+        image_preprocess, "IMAGE_PREPROCESS_MIN_BYTES", len(data) + 1
+    ):
+        key = image_preprocess.prepare_image_for_parsing("bucket", "jpg/small.jpg")
+
+    assert key == "jpg/small.jpg"
+    s3.download_fileobj.assert_not_called()
+
+
+def test_falls_back_to_original_without_pillow_or_on_errors(s3):
+    with mock.patch.object(image_preprocess, "Image", None):
+        assert image_preprocess.prepare_image_for_parsing("b", "a.png") == "a.png"
+    s3.head_object.assert_not_called()
+
+    serve(s3, b"not an image")
+    assert image_preprocess.prepare_image_for_parsing("b", "a.png") == "a.png"
+    s3.put_object.assert_not_called()
+
+
+def test_derivatives_are_not_processed_or_ingested_again(s3):
+    key = image_preprocess.derivative_key_for("jpg/photo.png")
+
+    assert image_preprocess.prepare_image_for_parsing("bucket", key) == key
+    s3.head_object.assert_not_called()
+
+    event = {"Records": [{"s3": {"object": {"key": key}}}]}
+    with mock.patch.object(put_line_log_to_db, "s3") as put_log_s3:
+        response = put_line_log_to_db.lambda_handler(event, None)
+    assert "derived" in response["body"]
+    put_log_s3.get_object.assert_not_called()
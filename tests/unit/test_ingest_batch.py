@@ -0,0 +1,187 @@
+import json
+import os
+from unittest import mock
+
+import pytest
+
+from tests.unit.conftest import add_function_path
+
+os.environ.setdefault("PARSE_IMAGE_FIFO_QUEUE_URL", "https://sqs.local/parse.fifo")
+os.environ.setdefault("S3_BUCKET", "todam-local")
+add_function_path("put_line_log_to_db_function")
+
+import line_log_util  # noqa: E402
+import put_line_log_to_db  # noqa: E402
+
+
+def line_log(text, timestamp, group_id="G1", user_id="U1"):
+    return {
+        "s3_object_key": f"{group_id}-{timestamp}.log",
+        "events": [
+            {
+                "message": {"type": "text", "id": str(timestamp), "text": text},
+                "source": {"groupId": group_id, "userId": user_id},
+                "timestamp": timestamp,
+            }
+        ],
+    }
+
+
+def sqs_event(*logs):
+    return {
+        "Records": [
+            {
+                "eventSource": "aws:sqs",
+                "messageId": f"m{index}",
+                "attributes": {
+                    "MessageGroupId": data["events"][0]["source"]["groupId"]
+                },
+                "body": json.dumps(data),
+            }
+            for index, data in enumerate(logs)
+        ]
+    }
+
+
+@pytest.fixture()
+def services():
+    names = (
+        "put_item_to_todam_table",
+        "put_items_to_todam_table",
+        "get_registered_user",
+        "query_todam_table",
+        "end_segment",
+        "bump_versions",
+        "record_write",
+        "send_email",
+        "prefetch_user_types",
+        "send_message_to_sqs",
+        "pair_image_parse",
+    )
+    lookups = {
+        "load_stickers": mock.Mock(return_value={}),
+        "get_user_type_by_id": mock.Mock(return_value="Client"),
+        "choose_shard_key": mock.Mock(side_effect=lambda group_id, item_id: group_id),
+    }
+    with mock.patch.multiple(
+        line_log_util, **{name: mock.DEFAULT for name in names}, **lookups
+    ):
+        yield line_log_util
+
+
+def test_group_burst_is_written_in_one_batch_in_send_order(services):
+    ret = put_line_log_to_db.lambda_handler(
+        sqs_event(line_log("b", 20), line_log("a", 10), line_log("c", 30)), None
+    )
+
+    assert ret == {"batchItemFailures": []}
+    (items,), _ = services.put_items_to_todam_table.call_args
+    assert [item["content"] for item in items] == ["a", "b", "c"]
+    services.prefetch_user_types.assert_called_once()
+    services.bump_versions.assert_called_once()
+    services.put_item_to_todam_table.assert_not_called()
+
+
+def test_images_are_queued_for_parsing_after_their_items_are_written(services):
+    image = line_log("", 20)
+    image["events"][0]["message"]["type"] = "image"
+    services.pair_image_parse.side_effect = lambda message_id, **half: {
+        "message_id": message_id,
+        "image_key": f"jpg/{message_id}.jpg",
+        **half,
+    }
+    calls = mock.Mock()
+    calls.attach_mock(services.put_items_to_todam_table, "put_items")
+    calls.attach_mock(services.pair_image_parse, "pair_image_parse")
+    calls.attach_mock(services.send_message_to_sqs, "send_message_to_sqs")
+
+    put_line_log_to_db.lambda_handler(
+        sqs_event(line_log("a", 10), image, line_log("b", 30)), None
+    )
+
+    assert [call[0] for call in calls.mock_calls] == [
+        "put_items",
+        "pair_image_parse",
+        "send_message_to_sqs",
+    ]
+    (items,), _ = services.put_items_to_todam_table.call_args
+    _, kwargs = services.send_message_to_sqs.call_args
+    assert kwargs["message"]["dynamodb_item_id"] == items[1]["id"]
+    assert kwargs["message"]["s3_object_key"] == "jpg/20.jpg"
+    assert kwargs["message_group_id"] == "20"
+    services.record_write.assert_called_once_with("G1", 3)
+
+
+def test_image_is_queued_only_once_its_object_is_paired(services):
+    image = line_log("", 20)
+    image["events"][0]["message"]["type"] = "image"
+    services.pair_image_parse.return_value = None
+
+    put_line_log_to_db.lambda_handler(sqs_event(image), None)
+
+    services.pair_image_parse.assert_called_once()
+    services.send_message_to_sqs.assert_not_called()
+
+
+def test_uploaded_image_is_queued_when_its_item_was_written_first(services):
+    services.pair_image_parse.return_value = {
+        "message_id": "20",
+        "image_key": "jpg/20.jpg",
+        "dynamodb_item_id": "M1",
+    }
+    event = {"Records": [{"s3": {"object": {"key": "jpg/20.jpg"}}}]}
+
+    with mock.patch.object(put_line_log_to_db, "s3"):
+        put_line_log_to_db.lambda_handler(event, None)
+
+    services.pair_image_parse.assert_called_once_with("20", image_key="jpg/20.jpg")
+    message = services.send_message_to_sqs.call_args.kwargs["message"]
+    assert message["s3_object_key"] == "jpg/20.jpg"
+    assert message["dynamodb_item_id"] == "M1"
+
+
+def test_commands_share_the_open_segment_lookup(services):
+    services.get_registered_user.return_value = {
+        "Item": {"is_verified": True, "email": "tam@ecloudvalley.com"}
+    }
+    services.query_todam_table.return_value = {"Items": []}
+
+    put_line_log_to_db.lambda_handler(
+        sqs_event(
+            line_log("before", 10),
+            line_log("start recording", 20),
+            line_log("during", 30),
+            line_log("end recording", 40),
+        ),
+        None,
+    )
+
+    services.query_todam_table.assert_called_once_with("G1")
+    segment = services.put_item_to_todam_table.call_args_list[0].args[0]
+    assert segment["is_segment"] and segment["start_timestamp"] == 20
+    services.end_segment.assert_called_once()
+    assert services.end_segment.call_args.args[:2] == (segment["id"], 40)
+    # Each command flushed the messages before it
+    runs = [c.args[0] for c in services.put_items_to_todam_table.call_args_list]
+    assert [[item["content"] for item in run] for run in runs] == [
+        ["before", "start recording"],
+        ["during", "end recording"],
+    ]
+
+
+def test_failed_group_reports_all_its_records(services):
+    services.put_items_to_todam_table.side_effect = [RuntimeError("throttled"), None]
+
+    ret = put_line_log_to_db.lambda_handler(
+        sqs_event(
+            line_log("a", 10, group_id="G1"),
+            line_log("b", 20, group_id="G2"),
+            line_log("c", 30, group_id="G1"),
+            line_log("d", 40, group_id="G2"),
+        ),
+        None,
+    )
+
+    assert ret == {
+        "batchItemFailures": [{"itemIdentifier": "m0"}, {"itemIdentifier": "m2"}]
+    }
@@ -0,0 +1,230 @@
+import gzip
+import json
+import time
+from decimal import Decimal
+from unittest import mock
+
+import pytest
+
+from tests.load.local_stack import LocalGateway, LocalStack, local_handlers
+from tests.unit.conftest import add_function_path
+
+add_function_path("list_segment_messages_function")
+
+import group_shards  # noqa: E402
+import list_segment_messages  # noqa: E402
+import response_cache  # noqa: E402
+
+
+def message_item(send_timestamp, content):
+    return {
+        "id": f"m{send_timestamp}",
+        "user_id": "U1",
+        "user_type": "Client",
+        "message_type": "text",
+        "content": content,
+        "send_timestamp": Decimal(send_timestamp),
+    }
+
+
+@pytest.fixture()
+def table():
+    response_cache._entries.clear()
+    with mock.patch.object(list_segment_messages, "table") as table:
+        with mock.patch.object(group_shards, "get_shard_count", return_value=1):
+            yield table
+
+
+def call_handler(**params):
+    return list_segment_messages.lambda_handler({"queryStringParameters": params}, None)
+
+
+def test_open_segment_requires_cursor(table):
+    table.get_item.return_value = {
+        "Item": {"group_id": "G1", "start_timestamp": Decimal(100), "is_end": False}
+    }
+
+    assert call_handler(segment_id="S1")["statusCode"] == 404
+
+
+@pytest.mark.parametrize("max_tokens", ["0", "-5", "many"])
+def test_rejects_max_tokens_below_one(table, max_tokens):
+    response = call_handler(segment_id="S1", output="text", max_tokens=max_tokens)
+
+    assert response["statusCode"] == 400
+    table.get_item.assert_not_called()
+
+
+def test_since_returns_only_new_messages(table):
+    table.get_item.return_value = {
+        "Item": {"group_id": "G1", "start_timestamp": Decimal(100), "is_end": False}
+    }
+    table.query.return_value = {
+        "Items": [message_item(205, "b"), message_item(210, "c")]
+    }
+
+    ret = call_handler(segment_id="S1", since="200")
+    body = json.loads(ret["body"])
+
+    assert ret["statusCode"] == 200
+    assert [m["content"] for m in body["messages"]] == ["b", "c"]
+    assert body["next_cursor"] == "210:m210"
+    assert body["is_end"] is False
+    assert body["end_timestamp"] is None
+
+
+def test_since_keeps_cursor_when_nothing_new(table):
+    table.get_item.return_value = {
+        "Item": {
+            "group_id": "G1",
+            "start_timestamp": Decimal(100),
+            "end_timestamp": Decimal(300),
+            "is_end": True,
+        }
+    }
+    table.query.return_value = {"Items": []}
+
+    body = json.loads(call_handler(segment_id="S1", since="300")["body"])
+
+    assert body["messages"] == []
+    assert body["next_cursor"] == "300"
+    assert body["is_end"] is True
+
+
+def test_shards_are_merged_in_send_order(table):
+    table.get_item.return_value = {
+        "Item": {"group_id": "G1", "start_timestamp": Decimal(100), "is_end": False}
+    }
+    table.query.side_effect = [
+        {"Items": [message_item(110, "a"), message_item(130, "c")]},
+        {
+            "Items": [message_item(120, "b"), message_item(140, "d")],
+            "LastEvaluatedKey": {"send_timestamp": Decimal(140)},
+        },
+    ]
+
+    with mock.patch.object(group_shards, "get_shard_count", return_value=2):
+        body = json.loads(call_handler(segment_id="S1", since="100")["body"])
+
+    # d shares the truncation millisecond, so it comes with the next page
+    assert [m["content"] for m in body["messages"]] == ["a", "b", "c"]
+    assert body["next_cursor"] == "140:"
+
+
+def test_truncated_page_returns_a_cursor_without_since(table):
+    table.get_item.return_value = {
+        "Item": {
+            "group_id": "G1",
+            "start_timestamp": Decimal(100),
+            "end_timestamp": Decimal(300),
+            "is_end": True,
+        }
+    }
+    table.query.return_value = {
+        "Items": [message_item(110, "a"), message_item(140, "b")],
+        "LastEvaluatedKey": {"send_timestamp": Decimal(140)},
+    }
+
+    body = json.loads(call_handler(segment_id="S1")["body"])
+
+    assert [m["content"] for m in body["messages"]] == ["a"]
+    assert body["next_cursor"] == "140:"
+
+
+def test_archived_segment_is_read_from_s3(table):
+    table.get_item.return_value = {
+        "Item": {
+            "group_id": "G1",
+            "start_timestamp": Decimal(100),
+            "end_timestamp": Decimal(300),
+            "is_end": True,
+            "archive_key": "archive/G1/S1.json.gz",
+        }
+    }
+    archive = {
+        "messages": [
+            {**message_item(150, "a"), "send_timestamp": 150},
+            {**message_item(250, "b"), "send_timestamp": 250},
+        ]
+    }
+    with mock.patch.object(list_segment_messages, "s3") as s3:
+        s3.get_object.return_value = {
+            "Body": mock.Mock(
+                read=mock.Mock(
+                    return_value=gzip.compress(json.dumps(archive).encode("utf-8"))
+                )
+            )
+        }
+        body = json.loads(call_handler(segment_id="S1", since="200")["body"])
+
+    table.query.assert_not_called()
+    assert [m["content"] for m in body["messages"]] == ["b"]
+    assert body["next_cursor"] == "250:m250"
+
+
+@pytest.fixture()
+def local_gateway():
+    stack = LocalStack(
+        groups=1,
+        segments_per_group=2,
+        messages_per_segment=3,
+        users=4,
+        dynamodb_latency_ms=0,
+        ticket_api_latency_ms=0,
+    )
+    with local_handlers(stack, {"CACHE_TTL_SECONDS": "0"}) as handlers:
+        yield stack, LocalGateway(handlers)
+
+
+def follow(gateway, segment_id, since):
+    response = gateway.request(
+        "GET", "/messages", {"segment_id": segment_id, "since": since}
+    )
+    assert response["statusCode"] == 200, response["body"]
+    return json.loads(response["body"])
+
+
+def test_cursor_at_or_past_the_end_returns_an_empty_page(local_gateway):
+    stack, gateway = local_gateway
+    segment_id = stack.segment_ids[0]
+    end_timestamp = int(stack.todam_table.items[segment_id]["end_timestamp"])
+
+    body = follow(gateway, segment_id, "0")
+    assert len(body["messages"]) == 3
+    assert follow(gateway, segment_id, body["next_cursor"])["messages"] == []
+
+    for since in (end_timestamp, end_timestamp + 1000):
+        body = follow(gateway, segment_id, str(since))
+        assert body["messages"] == []
+        assert body["next_cursor"] == str(since)
+
+
+def test_cursor_keeps_same_millisecond_and_late_messages(local_gateway):
+    stack, gateway = local_gateway
+    group_id = stack.group_ids[0]
+    segment_id = next(
+        item["id"]
+        for item in stack.todam_table.items.values()
+        if item.get("is_segment") and not item["is_end"]
+    )
+    timestamp = int(time.time() * 1000) - 5000
+    first = {**stack._message(group_id, "U1", timestamp), "id": "a" * 32}
+    stack.todam_table.load([first])
+
+    body = follow(gateway, segment_id, f"{timestamp}:{first['id']}")
+    assert body["messages"] == []
+
+    # A second message of the same millisecond and one ingested late
+    same_millisecond = {**stack._message(group_id, "U2", timestamp), "id": "b" * 32}
+    late = stack._message(group_id, "U2", timestamp - 2000)
+    stack.todam_table.load([same_millisecond, late])
+
+    body = follow(gateway, segment_id, f"{timestamp}:{first['id']}")
+    assert [m["id"] for m in body["messages"]] == [same_millisecond["id"]]
+
+    body = follow(gateway, segment_id, "0")
+    ids = [m["id"] for m in body["messages"]]
+    assert ids[-3:] == [late["id"], first["id"], same_millisecond["id"]]
+    # The cursor stays behind the settle window, so the late message would
+    # have been picked up by a client that polled before it arrived
+    assert int(body["next_cursor"].split(":")[0]) < late["send_timestamp"]
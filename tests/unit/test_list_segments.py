@@ -0,0 +1,207 @@
+import base64
+import json
+
+import pytest
+
+from tests.load.local_stack import LocalGateway, LocalStack, local_handlers
+
+
+@pytest.fixture(scope="module")
+def stack():
+    return LocalStack(
+        groups=3,
+        segments_per_group=8,
+        messages_per_segment=2,
+        users=10,
+        dynamodb_latency_ms=0,
+        ticket_api_latency_ms=0,
+    )
+
+
+@pytest.fixture()
+def gateway(stack):
+    with local_handlers(stack, {"CACHE_TTL_SECONDS": "0"}) as handlers:
+        yield LocalGateway(handlers)
+
+
+def unresolved(stack, **conditions):
+    return [
+        item
+        for item in stack.todam_table.items.values()
+        if item.get("is_segment")
+        and not item.get("is_resolved")
+        and all(item[name] == value for name, value in conditions.items())
+    ]
+
+
+def list_segments(gateway, **params):
+    response = gateway.request("GET", "/segments", params)
+    assert response["statusCode"] == 200, response["body"]
+    return json.loads(response["body"])
+
+
+def list_all(gateway, **params):
+    seen, params = [], {"limit": "3", **params}
+    while True:
+        body = list_segments(gateway, **params)
+        seen.extend(body["segments"])
+        if not body["next_token"]:
+            return seen
+        params = {**params, "next_token": body["next_token"]}
+
+
+def token(cursor):
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode("utf-8")).decode()
+
+
+def test_lists_unresolved_segments_newest_first(stack, gateway):
+    body = list_segments(gateway)
+
+    starts = [segment["start_timestamp"] for segment in body["segments"]]
+    assert starts == sorted(starts, reverse=True)
+    assert len(starts) == len(unresolved(stack))
+    assert body["next_token"] is None
+    # Every group's newest segment is still open
+    open_segments = [s for s in body["segments"] if s["status"] == "open"]
+    assert len(open_segments) == len(stack.group_ids)
+    assert all(segment["end_timestamp"] is None for segment in open_segments)
+
+
+def test_filters_by_status_group_and_start_range(stack, gateway):
+    group_id = stack.group_ids[0]
+    starts = sorted(
+        int(item["start_timestamp"]) for item in unresolved(stack, group_id=group_id)
+    )
+    body = list_segments(
+        gateway,
+        group_id=group_id,
+        status="ended",
+        order="asc",
+        **{"from": str(starts[0] + 1), "to": str(starts[-1])},
+    )
+
+    assert body["segments"]
+    assert all(segment["group_id"] == group_id for segment in body["segments"])
+    assert all(segment["status"] == "ended" for segment in body["segments"])
+    returned = [segment["start_timestamp"] for segment in body["segments"]]
+    assert returned == sorted(returned)
+    assert returned[0] > starts[0]
+    assert returned[-1] <= starts[-1]
+
+
+def test_pages_through_both_statuses_with_next_token(stack, gateway):
+    seen, params = [], {"limit": "4", "order": "asc"}
+    while True:
+        body = list_segments(gateway, **params)
+        assert len(body["segments"]) <= 4
+        seen.extend(body["segments"])
+        if not body["next_token"]:
+            break
+        params = {**params, "next_token": body["next_token"]}
+
+    starts = [segment["start_timestamp"] for segment in seen]
+    assert starts == sorted(starts)
+    assert len({segment["segment_id"] for segment in seen}) == len(unresolved(stack))
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"status": "closed"},
+        {"order": "newest"},
+        {"limit": "0"},
+        {"from": "yesterday"},
+        {"from": "200", "to": "100"},
+        {"next_token": "not-a-token"},
+        {"next_token": token({"open": {"id": "S1"}})},
+        {"next_token": token({"status": "all", "after": {"open": {"id": "S1"}}})},
+        {
+            "next_token": token(
+                {"status": "all", "after": {"open": {"id": "S1", "start_timestamp": 1}}}
+            )
+        },
+    ],
+)
+def test_rejects_invalid_parameters(gateway, params):
+    assert gateway.request("GET", "/segments", params)["statusCode"] == 400
+
+
+def test_rejects_next_token_of_another_query(stack, gateway):
+    group_id, other_group_id = stack.group_ids[:2]
+    body = list_segments(gateway, group_id=group_id, status="ended", limit="1")
+    next_token = body["next_token"]
+    start = body["segments"][0]["start_timestamp"]
+
+    for params in (
+        {"group_id": other_group_id, "status": "ended"},
+        {"group_id": group_id, "status": "ended", "from": str(start + 1)},
+        {"status": "ended"},
+        {"group_id": group_id, "status": "open"},
+        {"group_id": group_id},
+    ):
+        response = gateway.request(
+            "GET", "/segments", {**params, "next_token": next_token}
+        )
+        assert response["statusCode"] == 400, params
+
+
+def test_group_listing_reads_only_the_group_partition(stack, gateway, monkeypatch):
+    queries = []
+    query = stack.todam_table.query
+
+    def recording_query(**params):
+        queries.append(params)
+        return query(**params)
+
+    monkeypatch.setattr(stack.todam_table, "query", recording_query)
+    group_id = stack.group_ids[0]
+
+    segments = list_all(gateway, group_id=group_id)
+
+    assert len(segments) == len(unresolved(stack, group_id=group_id))
+    assert {params["IndexName"] for params in queries} == {"SegmentGroupStatusIndex"}
+
+
+@pytest.mark.parametrize(
+    "env",
+    [
+        {"SEGMENT_GROUP_READS_ENABLED": "false"},
+        {
+            "SEGMENT_STATUS_READS_ENABLED": "false",
+            "SEGMENT_GROUP_READS_ENABLED": "false",
+        },
+    ],
+)
+def test_fallbacks_list_the_same_segments_until_the_indexes_serve(stack, gateway, env):
+    group_id = stack.group_ids[0]
+    expected = [
+        list_all(gateway, order=order, **params)
+        for order in ("asc", "desc")
+        for params in ({}, {"group_id": group_id})
+    ]
+
+    scans = []
+    scan = stack.todam_table.scan
+
+    def recording_scan(**params):
+        scans.append(params)
+        return scan(**params)
+
+    with local_handlers(stack, {"CACHE_TTL_SECONDS": "0", **env}) as handlers:
+        fallback = LocalGateway(handlers)
+        listed = [
+            list_all(fallback, order=order, **params)
+            for order in ("asc", "desc")
+            for params in ({}, {"group_id": group_id})
+        ]
+        stack.todam_table.scan = recording_scan
+        list_segments(fallback, limit="500")
+        del stack.todam_table.scan
+
+    assert listed == expected
+    if "SEGMENT_STATUS_READS_ENABLED" in env:
+        # Both statuses come from a single pass over the table
+        assert scans
+        assert len(scans) == len(
+            {json.dumps(params.get("ExclusiveStartKey")) for params in scans}
+        )
@@ -0,0 +1,77 @@
+import sys
+
+from tests.load.local_stack import LocalGateway, LocalStack, local_handlers
+from tests.load.run_load_test import parse_mix, run_load_test
+
+
+def small_stack():
+    return LocalStack(
+        groups=2,
+        segments_per_group=3,
+        messages_per_segment=5,
+        users=10,
+        dynamodb_latency_ms=0,
+        ticket_api_latency_ms=0,
+    )
+
+
+def test_gateway_routes_to_real_handlers():
+    stack = small_stack()
+    with local_handlers(stack) as handlers:
+        gateway = LocalGateway(handlers)
+        segment_id = stack.segment_ids[0]
+        messages = gateway.request("GET", "/messages", {"segment_id": segment_id})
+        missing = gateway.request("GET", "/nothing")
+
+    assert messages["statusCode"] == 200
+    assert segment_id in messages["body"]
+    assert missing["statusCode"] == 404
+
+
+def test_load_test_reports_every_endpoint_without_errors():
+    modules_before = dict(sys.modules)
+    report = run_load_test(
+        small_stack(),
+        parse_mix("segments=1,messages=1,text=1,tickets=1,verify=1"),
+        concurrency=2,
+        duration=30,
+        max_requests=40,
+        env={"CACHE_TTL_SECONDS": "0"},
+    )
+
+    assert sum(row["requests"] for row in report.values()) == 40
+    assert all(row["errors"] == 0 for row in report.values())
+    assert report["messages"]["read_units"] > 0
+    assert report["tickets"]["write_units"] > 0
+    # Handler modules imported by other unit tests are restored
+    assert all(
+        sys.modules.get(name) is module for name, module in modules_before.items()
+    )
+
+
+def test_block_layout_reads_match_item_layout():
+    stack = LocalStack(
+        groups=2,
+        segments_per_group=3,
+        messages_per_segment=450,
+        users=10,
+        dynamodb_latency_ms=0,
+        ticket_api_latency_ms=0,
+        message_layout="blocks",
+    )
+    with local_handlers(stack, {"CACHE_TTL_SECONDS": "0"}) as handlers:
+        gateway = LocalGateway(handlers)
+        packed = [
+            gateway.request("GET", "/messages", {"segment_id": segment_id})
+            for segment_id in stack.segment_ids
+        ]
+        for segment_id in stack.segment_ids:
+            del stack.todam_table.items[segment_id]["block_count"]
+        unpacked = [
+            gateway.request("GET", "/messages", {"segment_id": segment_id})
+            for segment_id in stack.segment_ids
+        ]
+
+    assert any(key.count("#block#") for key in stack.todam_table.items)
+    assert [r["statusCode"] for r in packed] == [200] * len(stack.segment_ids)
+    assert [r["body"] for r in packed] == [r["body"] for r in unpacked]
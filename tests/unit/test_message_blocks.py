@@ -0,0 +1,126 @@
+from tests.load.local_dynamodb import CapacityMeter, LocalDynamoDB, LocalIndex
+from tests.load.local_stack import GROUP_SHARD_INDEX_ATTRIBUTES
+
+import group_shards  # noqa: E402
+import message_blocks  # noqa: E402
+
+
+def message(send_timestamp, content="hello", message_type="text"):
+    return {
+        "id": f"m{send_timestamp}",
+        "group_id": "G1",
+        "group_shard": "G1",
+        "user_id": "U1",
+        "user_type": "Client",
+        "message_type": message_type,
+        "content": content,
+        "send_timestamp": send_timestamp,
+        "is_message": True,
+    }
+
+
+def recording_table(timestamps):
+    dynamodb = LocalDynamoDB(CapacityMeter())
+    table = dynamodb.create_table(
+        "todam_table",
+        "id",
+        {
+            "GroupShardTimeIndex": LocalIndex(
+                "group_shard", "send_timestamp", GROUP_SHARD_INDEX_ATTRIBUTES
+            )
+        },
+    )
+    table.load(
+        [
+            {
+                "id": "S1",
+                "group_id": "G1",
+                "is_segment": True,
+                **message_blocks.new_segment_attributes(timestamps[0]),
+            },
+            {
+                **message_blocks.open_segment_item("G1", "S1"),
+                "unpacked_count": len(timestamps),
+            },
+        ]
+        + [message(timestamp) for timestamp in timestamps]
+    )
+    return dynamodb, table
+
+
+def test_blocks_round_trip():
+    messages = [message(1, "印表機無法連線"), message(2, "", "sticker")]
+    fields = message_blocks.BLOCK_FIELDS
+
+    decoded = message_blocks.decode_block(message_blocks.encode_block(messages))
+
+    assert decoded == [{field: m[field] for field in fields} for m in messages]
+
+
+def test_pack_leaves_unsettled_messages_in_the_tail(monkeypatch):
+    monkeypatch.setattr(message_blocks, "MESSAGE_BLOCK_SIZE", 2)
+    monkeypatch.setattr(message_blocks, "PACK_SETTLE_MS", 100)
+    monkeypatch.setattr(group_shards, "get_shard_count", lambda group_id: 1)
+    dynamodb, table = recording_table([1000, 1010, 1020, 1030, 1950])
+
+    packed = message_blocks.pack_segment(table, table.items["S1"], now=2000)
+    segment = table.items["S1"]
+
+    # 1950 has not settled, and 1020..1030 is a full second block
+    assert packed == 2
+    assert segment["packed_until"] == 1030
+    assert segment["block_last_timestamps"] == [1010, 1030]
+    assert table.items["open_segment#G1"]["unpacked_count"] == 1
+
+    response = message_blocks.read_segment_messages(
+        dynamodb, table, "S1", segment, 1010
+    )
+    assert [m["send_timestamp"] for m in response["Items"]] == [1010, 1020, 1030, 1950]
+
+
+def test_blocks_do_not_split_a_millisecond(monkeypatch):
+    monkeypatch.setattr(message_blocks, "MESSAGE_BLOCK_SIZE", 2)
+    monkeypatch.setattr(message_blocks, "PACK_SETTLE_MS", 100)
+    monkeypatch.setattr(group_shards, "get_shard_count", lambda group_id: 1)
+    dynamodb, table = recording_table([1000, 1010, 1950])
+    table.load([{**message(1010), "id": "m1010-dup"}])
+
+    message_blocks.pack_segment(table, table.items["S1"], now=2000)
+    segment = table.items["S1"]
+
+    assert segment["block_last_timestamps"] == [1010]
+    response = message_blocks.read_segment_messages(
+        dynamodb, table, "S1", segment, 1000
+    )
+    assert sorted(m["id"] for m in response["Items"]) == [
+        "m1000",
+        "m1010",
+        "m1010-dup",
+        "m1950",
+    ]
+
+
+def test_late_messages_are_read_behind_sealed_blocks(monkeypatch):
+    monkeypatch.setattr(message_blocks, "MESSAGE_BLOCK_SIZE", 2)
+    monkeypatch.setattr(message_blocks, "PACK_SETTLE_MS", 100)
+    monkeypatch.setattr(group_shards, "get_shard_count", lambda group_id: 1)
+    dynamodb, table = recording_table([1000, 1010, 1020, 1030])
+    message_blocks.pack_segment(table, table.items["S1"], now=2000)
+
+    late = message(1015)
+    table.load([late])
+    assert message_blocks.record_late_messages(table, "G1", [late], now=5000) == 1
+    # Arrived within the settle window, so the next pack still sees it
+    assert message_blocks.record_late_messages(table, "G1", [message(4950)], 5000) == 0
+
+    segment = table.items["S1"]
+    response = message_blocks.read_segment_messages(
+        dynamodb, table, "S1", segment, 1000
+    )
+    assert [m["send_timestamp"] for m in response["Items"]] == [
+        1000,
+        1010,
+        1015,
+        1020,
+        1030,
+    ]
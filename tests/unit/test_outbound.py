@@ -0,0 +1,73 @@
+from unittest import mock
+
+import pytest
+import requests
+
+import outbound
+
+
+def make_response(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    return response
+
+
+@pytest.fixture()
+def endpoint():
+    return outbound.Endpoint(
+        "test",
+        "https://example.com",
+        breaker=outbound.CircuitBreaker(failure_threshold=2, reset_timeout=60),
+    )
+
+
+def test_circuit_opens_after_failures(endpoint):
+    with mock.patch.object(
+        endpoint.session, "post", return_value=make_response(502)
+    ) as post:
+        endpoint.post(json={})
+        endpoint.post(json={})
+
+        with pytest.raises(outbound.CircuitOpenError):
+            endpoint.post(json={})
+
+    assert post.call_count == 2
+    assert endpoint.breaker.state == outbound.CircuitBreaker.OPEN
+
+
+def test_half_open_probe_closes_circuit(endpoint):
+    endpoint.breaker.record_failure()
+    endpoint.breaker.record_failure()
+    endpoint.breaker.opened_at -= 60
+
+    with mock.patch.object(endpoint.session, "post", return_value=make_response(200)):
+        assert endpoint.post(json={}).status_code == 200
+
+    assert endpoint.breaker.state == outbound.CircuitBreaker.CLOSED
+
+
+def test_retries_are_bounded_by_budget():
+    endpoint = outbound.Endpoint(
+        "test",
+        "https://example.com",
+        max_retries=3,
+        retry_budget=outbound.RetryBudget(ratio=0, max_tokens=1),
+    )
+
+    with mock.patch.object(
+        endpoint.session, "post", side_effect=requests.ConnectionError
+    ) as post:
+        with pytest.raises(requests.ConnectionError):
+            endpoint.post(json={})
+
+    assert post.call_count == 2
+
+
+def test_histogram_snapshot_skips_empty_buckets():
+    histogram = outbound.LatencyHistogram(buckets_ms=[10, 100])
+    histogram.observe(5)
+    histogram.observe(50)
+    histogram.observe(50)
+    histogram.observe(500)
+
+    assert histogram.snapshot() == {"Values": [10, 100, 200], "Counts": [1, 2, 1]}
@@ -0,0 +1,75 @@
+import json
+import os
+from unittest import mock
+
+import pytest
+
+from tests.unit.conftest import add_function_path
+
+os.environ.setdefault("S3_BUCKET", "todam-local")
+os.environ.setdefault("PARSE_IMAGE_API_URL", "https://parse.local/parse")
+add_function_path("parse_image_function")
+
+import parse_image  # noqa: E402
+
+PARSED = {
+    "statusCode": 200,
+    "body": {"SendMessageResponse": {"SendMessageResult": {"MessageId": "q1"}}},
+}
+
+
+def parse_request(message_id, key=None, item_id="M1"):
+    return {
+        "messageId": f"sqs-{message_id}",
+        "body": json.dumps(
+            {
+                "message_id": message_id,
+                "s3_object_key": key or f"jpg/{message_id}.jpg",
+                "dynamodb_table_name": "todam_table",
+                "dynamodb_item_id": item_id,
+            }
+        ),
+    }
+
+
+@pytest.fixture()
+def api():
+    with mock.patch.object(
+        parse_image, "prepare_image_for_parsing", side_effect=lambda bucket, key: key
+    ), mock.patch.object(parse_image, "api_parse_image") as api_parse_image:
+        api_parse_image.return_value = PARSED
+        yield api_parse_image
+
+
+def test_parses_the_image_named_in_the_request(api):
+    ret = parse_image.lambda_handler({"Records": [parse_request("123")]}, None)
+
+    assert ret == {"batchItemFailures": []}
+    payload = api.call_args.args[0]
+    assert payload["s3_object_key"] == "jpg/123.jpg"
+    assert payload["dynamodb_item_id"] == "M1"
+
+
+def test_unavailable_api_returns_the_request_and_the_rest_of_the_batch(api):
+    api.return_value = {"statusCode": 503, "body": "circuit open"}
+
+    ret = parse_image.lambda_handler(
+        {"Records": [parse_request("123"), parse_request("456")]}, None
+    )
+
+    assert ret == {
+        "batchItemFailures": [
+            {"itemIdentifier": "sqs-123"},
+            {"itemIdentifier": "sqs-456"},
+        ]
+    }
+    api.assert_called_once()
+
+
+def test_drops_a_request_whose_image_is_not_its_message(api):
+    ret = parse_image.lambda_handler(
+        {"Records": [parse_request("123", key="jpg/456.jpg")]}, None
+    )
+
+    assert ret == {"batchItemFailures": []}
+    api.assert_not_called()
@@ -0,0 +1,46 @@
+import gzip
+import marshal
+import pickle
+from unittest import mock
+
+import profiling
+
+
+def handler(event, context):
+    return {"statusCode": 200, "body": str(sum(range(event["n"])))}
+
+
+def test_disabled_profiling_returns_handler_unwrapped():
+    with mock.patch.object(profiling, "PROFILE_SAMPLE_RATE", 0.0):
+        assert profiling.profiled(handler) is handler
+
+
+def test_sampled_invocation_uploads_profile_and_snapshot():
+    context = mock.Mock(function_name="todam-test", aws_request_id="req-1")
+    with mock.patch.multiple(
+        profiling, PROFILE_SAMPLE_RATE=1.0, PROFILE_BUCKET="bucket", s3=mock.DEFAULT
+    ):
+        ret = profiling.profiled(handler)({"n": 1000}, context)
+        uploads = {
+            call.kwargs["Key"]: call.kwargs["Body"]
+            for call in profiling.s3.put_object.call_args_list
+        }
+
+    assert ret == {"statusCode": 200, "body": "499500"}
+    prefix = "profiles/todam-test/"
+    [profile_key] = [key for key in uploads if key.endswith("/req-1.prof.gz")]
+    [snapshot_key] = [key for key in uploads if key.endswith("/req-1.tracemalloc.gz")]
+    assert profile_key.startswith(prefix) and snapshot_key.startswith(prefix)
+    stats = marshal.loads(gzip.decompress(uploads[profile_key]))
+    assert any(name == "handler" for _, _, name in stats)
+    assert pickle.loads(gzip.decompress(uploads[snapshot_key])).traces is not None
+
+
+def test_upload_failure_does_not_fail_invocation():
+    with mock.patch.multiple(
+        profiling, PROFILE_SAMPLE_RATE=1.0, PROFILE_BUCKET="bucket", s3=mock.DEFAULT
+    ):
+        profiling.s3.put_object.side_effect = RuntimeError("S3 down")
+        ret = profiling.profiled(handler)({"n": 10}, None)
+
+    assert ret["body"] == "45"
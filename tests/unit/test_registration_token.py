@@ -0,0 +1,102 @@
+import sys
+from unittest import mock
+
+import pytest
+
+import registration_token
+from tests.load.local_stack import LocalGateway, LocalStack, local_handlers
+
+
+@pytest.fixture(autouse=True)
+def signing_key():
+    registration_token.get_signing_key.cache_clear()
+    with mock.patch.object(registration_token, "secretsmanager") as secretsmanager:
+        secretsmanager.get_secret_value.return_value = {"SecretString": "k" * 64}
+        yield
+    registration_token.get_signing_key.cache_clear()
+
+
+def test_token_round_trip():
+    token = registration_token.issue_token("U1", "amy@ecloudvalley.com", 1000)
+
+    claims = registration_token.read_token(token, now=2000)
+
+    assert claims == {"user_id": "U1", "email": "amy@ecloudvalley.com", "iat": 1000}
+
+
+def test_tampered_token_is_rejected():
+    token = registration_token.issue_token("U1", "amy@ecloudvalley.com", 1000)
+    forged = registration_token.issue_token("U2", "amy@ecloudvalley.com", 1000)
+    mixed = forged.split(".")[0] + "." + token.split(".")[1]
+
+    with pytest.raises(ValueError, match="Invalid"):
+        registration_token.read_token(mixed, now=2000)
+    with pytest.raises(ValueError, match="Invalid"):
+        registration_token.read_token("not-a-token", now=2000)
+
+
+def test_expired_token_is_rejected():
+    token = registration_token.issue_token("U1", "amy@ecloudvalley.com", 1000)
+
+    with pytest.raises(ValueError, match="expired"):
+        registration_token.read_token(
+            token, now=1000 + registration_token.TOKEN_TTL_MS + 1
+        )
+
+
+@pytest.fixture()
+def stack():
+    return LocalStack(
+        groups=1,
+        segments_per_group=1,
+        messages_per_segment=1,
+        users=10,
+        dynamodb_latency_ms=0,
+        ticket_api_latency_ms=0,
+    )
+
+
+@pytest.fixture()
+def verify(stack):
+    with local_handlers(stack) as handlers:
+        gateway = LocalGateway(handlers)
+        # Signed with the handlers' own registration_token module
+        issue = sys.modules["registration_token"].issue_token
+
+        def request(params):
+            return gateway.request("GET", "/verify-registration", params)
+
+        yield request, issue
+
+
+def test_valid_link_verifies_the_user(stack, verify):
+    request, issue = verify
+    user_id, email, applied = stack.registrations[0]
+
+    response = request({"token": issue(user_id, email, applied)})
+
+    assert response["statusCode"] == 200
+    assert stack.registered_user_table.items[user_id]["is_verified"] is True
+
+
+@pytest.mark.parametrize(
+    "params", [{"token": "not-a-token"}, {"user_id": "nobody", "code": "1"}, {}]
+)
+def test_invalid_links_are_rejected(verify, params):
+    request, _ = verify
+
+    assert request(params)["statusCode"] == 400
+
+
+def test_expired_and_superseded_links_are_gone(stack, verify):
+    request, issue = verify
+    user_id, email, applied = stack.registrations[0]
+
+    expired = issue(user_id, email, applied - registration_token.TOKEN_TTL_MS - 1)
+    superseded = issue(user_id, email, applied - 1)
+
+    assert request({"token": expired})["statusCode"] == 410
+    assert request({"token": superseded})["statusCode"] == 410
+    # A code link sent before the user applied again and got a signed token
+    assert request({"user_id": user_id, "code": "123456"})["statusCode"] == 410
+    assert stack.registered_user_table.items[user_id]["is_verified"] is False
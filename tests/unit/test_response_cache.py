@@ -0,0 +1,69 @@
+import json
+from unittest import mock
+
+import pytest
+
+import response_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    response_cache._entries.clear()
+
+
+def make_build(body):
+    build = mock.Mock(
+        return_value=(
+            {"statusCode": 200, "body": json.dumps(body), "headers": {}},
+            ["segments#G1"],
+        )
+    )
+    return build
+
+
+def test_conditional_get_returns_not_modified():
+    build = make_build({"segments": []})
+    first = response_cache.serve_cached({}, "key", build)
+
+    second = response_cache.serve_cached(
+        {"headers": {"If-None-Match": first["headers"]["ETag"]}}, "key", build
+    )
+
+    assert second["statusCode"] == 304
+    assert build.call_count == 1
+
+
+def test_entry_is_revalidated_after_ttl():
+    build = make_build({"segments": []})
+    with mock.patch.object(response_cache, "get_versions", return_value=(1,)):
+        response_cache.serve_cached({}, "key", build)
+        # Scopes were learnt on the first build, so the entry is rebuilt once
+        response_cache._entries["key"].checked_at -= response_cache.CACHE_TTL_SECONDS
+        response_cache.serve_cached({}, "key", build)
+        response_cache._entries["key"].checked_at -= response_cache.CACHE_TTL_SECONDS
+        response_cache.serve_cached({}, "key", build)
+
+    assert build.call_count == 2
+
+
+def test_bumped_version_rebuilds_entry():
+    build = make_build({"segments": []})
+    with mock.patch.object(response_cache, "get_versions", return_value=(1,)):
+        response_cache.serve_cached({}, "key", build)
+        response_cache._entries["key"].checked_at -= response_cache.CACHE_TTL_SECONDS
+        response_cache.serve_cached({}, "key", build)
+
+    with mock.patch.object(response_cache, "get_versions", return_value=(2,)):
+        response_cache._entries["key"].checked_at -= response_cache.CACHE_TTL_SECONDS
+        response_cache.serve_cached({}, "key", build)
+
+    assert build.call_count == 3
+
+
+def test_errors_are_not_cached():
+    build = mock.Mock(return_value=({"statusCode": 500, "body": "error"}, None))
+
+    response_cache.serve_cached({}, "key", build)
+    response_cache.serve_cached({}, "key", build)
+
+    assert build.call_count == 2
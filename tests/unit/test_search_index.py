@@ -0,0 +1,142 @@
+from unittest import mock
+
+import pytest
+from botocore.exceptions import ClientError
+
+import search_index
+
+
+@pytest.fixture()
+def index():
+    return search_index.build_index(
+        search_index.InMemoryIndexStore(),
+        [
+            {
+                "id": "S1",
+                "group_id": "G1",
+                "segment_id": "S1",
+                "is_segment": True,
+                "start_timestamp": 100,
+                "end_timestamp": 200,
+            },
+            {
+                "id": "M1",
+                "group_id": "G1",
+                "is_message": True,
+                "send_timestamp": 110,
+                "content": "我想了解如何成為 AWS Educate 校園大使",
+            },
+            {
+                "id": "M2",
+                "group_id": "G1",
+                "is_message": True,
+                "send_timestamp": 120,
+                "content": "校園活動什麼時候開始？",
+            },
+            {
+                "id": "M3",
+                "group_id": "G1",
+                "is_message": True,
+                "send_timestamp": 300,
+                "content": "ＡＷＳ 帳號無法登入",
+            },
+            {
+                "id": "M4",
+                "group_id": "G2",
+                "is_message": True,
+                "send_timestamp": 110,
+                "content": "校園大使",
+            },
+        ],
+    )
+
+
+def test_tokenize_uses_bigrams_for_cjk():
+    assert search_index.tokenize("校園大使 AWS") == ["校園", "園大", "大使", "aws"]
+
+
+def test_tokenize_folds_full_width_characters():
+    assert search_index.tokenize("ＡＷＳ２０２４") == ["aws2024"]
+
+
+def test_full_matches_rank_first(index):
+    result = index.search("G1", "校園大使")
+
+    assert [hit["message_id"] for hit in result["messages"]] == ["M1", "M2"]
+    assert result["messages"][0]["matched_terms"] == 3
+
+
+def test_hits_are_rolled_up_into_segments(index):
+    result = index.search("G1", "aws")
+
+    assert {hit["message_id"]: hit["segment_id"] for hit in result["messages"]} == {
+        "M1": "S1",
+        "M3": None,
+    }
+    assert [segment["segment_id"] for segment in result["segments"]] == ["S1"]
+
+
+def test_unindexed_message_is_not_found(index):
+    index.unindex_message("G1", "M3", "ＡＷＳ 帳號無法登入")
+
+    assert [hit["message_id"] for hit in index.search("G1", "登入")["messages"]] == []
+
+
+def test_replayed_records_do_not_change_the_stats(index):
+    stats = index.store.stats("G1")
+
+    index.index_message("G1", "M1", 110, "我想了解如何成為 AWS Educate 校園大使")
+    index.unindex_message("G1", "M3", "ＡＷＳ 帳號無法登入")
+    index.unindex_message("G1", "M3", "ＡＷＳ 帳號無法登入")
+    index.index_message("G1", "M3", 300, "ＡＷＳ 帳號無法登入")
+
+    assert index.store.stats("G1") == stats
+
+
+def test_stale_version_is_not_subtracted(index):
+    index.unindex_message("G1", "M3", "ＡＷＳ 帳號無法登入")
+    index.index_message("G1", "M3", 300, "帳號")
+    stats = index.store.stats("G1")
+
+    # Replaying the edit must leave the newer version counted
+    index.unindex_message("G1", "M3", "ＡＷＳ 帳號無法登入")
+
+    assert index.store.stats("G1") == stats
+
+
+def cancelled(code):
+    return ClientError(
+        {
+            "Error": {"Code": "TransactionCanceledException"},
+            "CancellationReasons": [{"Code": code}, {"Code": "None"}],
+        },
+        "TransactWriteItems",
+    )
+
+
+def test_dynamodb_stats_are_written_with_the_document_marker():
+    table = mock.MagicMock()
+    table.name = "todam_search_index"
+    table.meta.client.exceptions.TransactionCanceledException = ClientError
+    store = search_index.DynamoDBIndexStore(table)
+
+    store.add_document("G1", "M1", 110, {"aws": 2}, 2)
+
+    marker, stats = table.meta.client.transact_write_items.call_args.kwargs[
+        "TransactItems"
+    ]
+    assert marker["Put"]["Item"]["pk"] == "G1#docs"
+    assert marker["Put"]["ConditionExpression"] == "attribute_not_exists(pk)"
+    assert stats["Update"]["ExpressionAttributeValues"] == {":d": 1, ":l": 2}
+
+    # A replay fails the marker condition and leaves the stats alone
+    table.meta.client.transact_write_items.side_effect = cancelled(
+        "ConditionalCheckFailed"
+    )
+    store.remove_document("G1", "M1", {"aws": 2}, 2)
+
+    table.meta.client.transact_write_items.side_effect = cancelled(
+        "TransactionConflict"
+    )
+    with pytest.raises(ClientError):
+        store.add_document("G1", "M1", 110, {"aws": 2}, 2)
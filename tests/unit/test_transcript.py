@@ -0,0 +1,61 @@
+from tests.unit.conftest import add_function_path
+
+add_function_path("list_segment_messages_function")
+
+import transcript  # noqa: E402
+
+
+def message(user_type, content, message_type="text"):
+    return {"user_type": user_type, "content": content, "message_type": message_type}
+
+
+def test_condense_merges_speakers_and_drops_noise():
+    messages = [
+        message("Client", "start recording", "sticker"),
+        message("Client", "印表機 不能  用"),
+        message("Client", "有人在嗎"),
+        message("Client", "有人在嗎"),
+        message("Client", "", "sticker"),
+        message("Client", "Error 0x1F\nPaper jam", "image"),
+        message("Admin", "請重開機"),
+    ]
+
+    text, stats = transcript.condense_messages(messages)
+
+    assert text == (
+        "Client: 印表機 不能 用 / 有人在嗎 (x2) / [image] Error 0x1F Paper jam"
+        "\\nAdmin: 請重開機"
+    )
+    assert stats["condensed_chars"] < stats["original_chars"]
+    assert 0 < stats["shrink_ratio"] < 1
+
+
+def test_budget_keeps_opening_and_latest_turns():
+    messages = [
+        message("Client" if i % 2 else "Admin", f"message number {i} " * 5)
+        for i in range(40)
+    ]
+
+    text, stats = transcript.condense_messages(messages, token_budget=200)
+    turns = text.split("\\n")
+
+    assert stats["condensed_tokens"] <= 200
+    assert turns[0].startswith("Admin: message number 0 ")
+    assert turns[-1].startswith("Client: message number 39 ")
+    assert any("turns omitted" in turn for turn in turns)
+
+
+def test_budget_truncates_single_long_turn():
+    text, stats = transcript.condense_messages(
+        [message("Client", "很長的描述" * 200)], token_budget=50
+    )
+
+    assert stats["condensed_tokens"] <= 50
+    assert text.startswith("Client: 很長的描述")
+    assert text.endswith(transcript.ELLIPSIS)
+
+
+def test_marker_counts_turns_truncated_to_nothing():
+    turns = ["Client: first", "Admin: second", "Client: third"]
+
+    assert transcript.fit_turns(turns, 1) == ["[... 3 turns omitted ...]"]
@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+from tests.load.local_dynamodb import CapacityMeter, LocalDynamoDB
+from tests.unit.conftest import add_function_path
+
+os.environ.setdefault("PARSE_IMAGE_FIFO_QUEUE_URL", "https://sqs.local/parse.fifo")
+os.environ.setdefault("S3_BUCKET", "todam-local")
+add_function_path("put_line_log_to_db_function")
+
+import user_service  # noqa: E402
+
+
+@pytest.fixture()
+def users(monkeypatch):
+    dynamodb = LocalDynamoDB(CapacityMeter())
+    table = dynamodb.create_table("registered_user_table", "user_id")
+    table.load([{"user_id": "U1", "is_verified": True}, {"user_id": "U2"}])
+    monkeypatch.setattr(user_service, "dynamodb", dynamodb)
+    monkeypatch.setattr(user_service, "registered_user_table", table)
+    user_service._user_types.clear()
+    user_service._unverified_in_batch.clear()
+    return table
+
+
+def test_batch_lookups_are_shared(users):
+    user_service.prefetch_user_types(["U1", "U2", "U3"])
+    users.get_item = None  # every type is known for this batch
+
+    assert user_service.get_user_type_by_id("U1") == "TAM"
+    assert user_service.get_user_type_by_id("U2") == "Client"
+    assert user_service.get_user_type_by_id("U3") == "Client"
+
+
+def test_newly_verified_user_is_a_tam_in_the_next_batch(users):
+    user_service.prefetch_user_types(["U2"])
+    assert user_service.get_user_type_by_id("U2") == "Client"
+
+    users.items["U2"]["is_verified"] = True
+
+    user_service.prefetch_user_types(["U2"])
+    assert user_service.get_user_type_by_id("U2") == "TAM"
+    # Outside a batch the type is read again as well
+    user_service._unverified_in_batch.clear()
+    users.load([{"user_id": "U3", "is_verified": False}])
+    assert user_service.get_user_type_by_id("U3") == "Client"
+    users.load([{"user_id": "U3", "is_verified": True}])
+    assert user_service.get_user_type_by_id("U3") == "TAM"
@@ -0,0 +1,36 @@
+import json
+from unittest import mock
+
+import warmup
+
+
+def test_warmup_event_runs_primers_instead_of_handler():
+    handler = mock.Mock()
+    primer = mock.Mock()
+
+    wrapped = warmup.warmable({"table": primer})(handler)
+    ret = wrapped({"warmup": True}, None)
+
+    handler.assert_not_called()
+    primer.assert_called_once_with()
+    assert ret["statusCode"] == 200
+    assert json.loads(ret["body"])["primed"]["table"] >= 0
+
+
+def test_failing_primer_is_reported_not_raised():
+    def denied():
+        raise PermissionError("AccessDenied")
+
+    timings = warmup.prime({"ses": denied, "ok": lambda: None})
+
+    assert timings["ses"] == "error: PermissionError"
+    assert isinstance(timings["ok"], float)
+
+
+def test_regular_events_reach_the_handler():
+    handler = mock.Mock(return_value={"statusCode": 200})
+
+    wrapped = warmup.warmable({"table": mock.Mock()})(handler)
+
+    assert wrapped({"queryStringParameters": {}}, None) == {"statusCode": 200}
+    assert wrapped({"source": "aws.events"}, None) == {"statusCode": 200}